@@ -0,0 +1,124 @@
+"""
+Benchmark for the cooldown checks every command goes through: a peek at the global cooldown (CustomChecks.bot_check),
+then the global and per-command cooldowns charged together (CustomChecks.command_cooldown).
+
+Simulates millions of users sending commands over simulated time and compares CooldownStore with the approach of
+discord.py's CooldownMapping, which scans every bucket for dead ones on each lookup.
+
+    python -m bench.cooldowns --users 2000000 --ops 2000000 --rate 5000
+"""
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+from tracemalloc import get_traced_memory, start, stop
+
+from src.common.cooldowns import Cooldown, CooldownStore
+
+GLOBAL = ("global", Cooldown(1, 5.0))
+GLOBAL_ONLY = [GLOBAL]
+COMMANDS = [
+    [GLOBAL],
+    [GLOBAL, ("upload", Cooldown(1, 15.0))],
+    [GLOBAL, ("search", Cooldown(1, 30.0))],
+    [GLOBAL, ("info", Cooldown(1, 5.0))],
+]
+
+
+class ScanningMapping:
+    """ A single global cooldown, cleaned up the way discord.py's CooldownMapping does it. """
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self._cache = {}  # key -> [window start, tokens, last used]
+
+    def update(self, key, now: float) -> float:
+        dead = [k for k, v in self._cache.items() if now > v[2] + self.per]
+        for k in dead:
+            del self._cache[k]
+
+        bucket = self._cache.setdefault(key, [now, self.rate, now])
+        bucket[2] = now
+
+        if now > bucket[0] + self.per:
+            bucket[0], bucket[1] = now, self.rate
+
+        if bucket[1] == 0:
+            return self.per - (now - bucket[0])
+
+        bucket[1] -= 1
+        return 0.0
+
+
+def workload(users: int, ops: int, rate: float, seed: int = 0):
+    """ (time, user, scopes) tuples: a few heavy users and a long tail of occasional ones. """
+    rng = Random(seed)
+    heavy = max(1, users // 1000)
+
+    for i in range(ops):
+        user = rng.randrange(heavy) if rng.random() < 0.3 else rng.randrange(users)
+        yield i / rate, user, COMMANDS[rng.randrange(len(COMMANDS))]
+
+
+def run_store(args) -> None:
+    store = CooldownStore(max_entries=args.max_entries, clock=lambda: 0.0)
+    events = list(workload(args.users, args.ops, args.rate))
+    peak = denied = 0
+
+    if args.memory:
+        start()
+
+    began = perf_counter()
+
+    for i, (now, user, scopes) in enumerate(events):
+        if store.check(user, GLOBAL_ONLY, now) or store.update(user, scopes, now):
+            denied += 1
+
+        if not i % 10000:
+            peak = max(peak, len(store))
+
+    elapsed = perf_counter() - began
+
+    print("CooldownStore:   %10.0f checks/s  (%d checks, %.1fs simulated, %d denied)" % (
+        len(events) / elapsed, len(events), events[-1][0], denied))
+    print("                 %d entries at the end, peak %d, %d evictions" % (len(store), peak, store.evictions))
+
+    if args.memory:
+        current, highest = get_traced_memory()
+        stop()
+        print("                 %.1f MB traced (peak %.1f MB)" % (current / 1024 ** 2, highest / 1024 ** 2))
+
+
+def run_scanning(args) -> None:
+    mapping = ScanningMapping(1, 5.0)
+    events = list(workload(args.users, args.scan_ops, args.rate))
+
+    began = perf_counter()
+
+    for now, user, _ in events:
+        mapping.update(user, now)
+
+    elapsed = perf_counter() - began
+
+    print("Scanning mapping: %9.0f checks/s  (%d checks, global cooldown only, %d buckets at the end)" % (
+        len(events) / elapsed, len(events), len(mapping._cache)))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=2000000)
+    parser.add_argument("--ops", type=int, default=2000000)
+    parser.add_argument("--rate", type=float, default=5000, help="Commands per simulated second.")
+    parser.add_argument("--max-entries", type=int, default=200000)
+    parser.add_argument("--scan-ops", type=int, default=20000, help="Checks to run against the scanning mapping.")
+    parser.add_argument("--memory", action="store_true", help="Trace memory use (slower).")
+    args = parser.parse_args()
+
+    run_store(args)
+
+    if args.scan_ops:
+        run_scanning(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Stand-ins for the discord.py objects the hot paths touch, so they can be timed offline.
+"""
+from random import Random
+from typing import *
+
+WORDS = (
+    "frog", "cat", "pepe", "kek", "happy", "sad", "dance", "jam", "blob", "party", "hype", "cry", "wave",
+    "heart", "fire", "vibe", "pog", "smile", "angry", "sleep", "think", "clap", "yes", "no", "ok",
+)
+
+
+class FakeEmoji:
+    __slots__ = ("id", "name", "animated", "available", "guild_id")
+
+    def __init__(self, id_: int, name: str, guild_id: int, animated: bool = False):
+        self.id = id_
+        self.name = name
+        self.guild_id = guild_id
+        self.animated = animated
+        self.available = True
+
+    def __str__(self):
+        return "<%s:%s:%d>" % ("a" if self.animated else "", self.name, self.id)
+
+    @property
+    def url(self) -> str:
+        return "https://cdn.discordapp.com/emojis/%d.%s" % (self.id, "gif" if self.animated else "png")
+
+
+class FakeGuild:
+    __slots__ = ("id", "emojis")
+
+    def __init__(self, id_: int, emojis: List[FakeEmoji]):
+        self.id = id_
+        self.emojis = emojis
+
+
+def make_name(rng: Random) -> str:
+    """ A plausible emoji name, like "happy_frog2". """
+    name = "_".join(rng.choice(WORDS) for _ in range(rng.randint(1, 2)))
+
+    return name + str(rng.randint(1, 9)) if rng.random() < 0.3 else name
+
+
+def make_guilds(guilds: int = 10000, emojis: int = 50, seed: int = 0) -> List[FakeGuild]:
+    """ Build guilds with realistic emoji names. IDs are unique and increasing. """
+    rng = Random(seed)
+    result = []
+    emoji_id = 10 ** 17
+
+    for guild_id in range(1, guilds + 1):
+        guild_emojis = []
+
+        for _ in range(emojis):
+            emoji_id += 1
+            guild_emojis.append(FakeEmoji(emoji_id, make_name(rng), guild_id, rng.random() < 0.2))
+
+        result.append(FakeGuild(guild_id, guild_emojis))
+
+    return result
+
+
+def make_messages(count: int = 10000, seed: int = 0) -> List[str]:
+    """
+    Build mixed message text: mostly plain chat, some with :emojis: (glued or spaced), some with colons
+    that aren't emojis (times, URLs, rendered emojis).
+    """
+    rng = Random(seed)
+    messages = []
+
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 25))]
+        roll = rng.random()
+
+        if roll < 0.10:
+            words.insert(rng.randrange(len(words)), ":%s:" % make_name(rng))
+        elif roll < 0.13:
+            words[-1] += ":%s:" % make_name(rng)
+        elif roll < 0.16:
+            words.append("at %d:%02d:%02d" % (rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59)))
+        elif roll < 0.18:
+            words.append("<:%s:%d>" % (make_name(rng), rng.randint(10 ** 17, 10 ** 18)))
+        elif roll < 0.20:
+            words.append("https://example.com/%s" % rng.choice(WORDS))
+
+        messages.append(" ".join(words))
+
+    return messages
+
+
+class FakeUser:
+    __slots__ = ("id", "bot", "display_name", "avatar_url")
+
+    def __init__(self, id_: int, bot: bool = False):
+        self.id = id_
+        self.bot = bot
+        self.display_name = "user%d" % id_
+        self.avatar_url = "https://cdn.discordapp.com/embed/avatars/%d.png" % (id_ % 5)
+
+
+class FakeChannel:
+    __slots__ = ("id", "guild")
+
+    def __init__(self, id_: int, guild: FakeGuild):
+        self.id = id_
+        self.guild = guild
+
+
+class FakeMessage:
+    __slots__ = ("content", "author", "guild", "channel", "deleted")
+
+    def __init__(self, content: str, author: FakeUser, guild: Optional[FakeGuild]):
+        self.content = content
+        self.author = author
+        self.guild = guild
+        self.channel = FakeChannel(guild.id if guild else 0, guild)
+        self.deleted = 0
+
+    async def delete(self) -> None:
+        self.deleted += 1
+
+
+class FakeContext:
+    """ The parts of a command Context that the hot paths use. Sending and erroring only count. """
+
+    def __init__(self, bot, message: FakeMessage, command=None):
+        self.bot = bot
+        self.message = message
+        self.author = message.author
+        self.guild = message.guild
+        self.channel = message.channel
+        self.command = command
+
+        self.sent = 0
+        self.errors = 0
+
+    async def send(self, *args, **kwargs) -> None:
+        self.sent += 1
+
+    async def error(self, err) -> None:
+        self.errors += 1
+
+
+class FakeWebhookCache:
+    """ Stands in for WebhookCache: counts what would have been sent. """
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, channel, content: str, **kwargs) -> None:
+        self.sent += 1
+
+
+def make_users(count: int = 100000, bots: float = 0.02, seed: int = 0) -> List[FakeUser]:
+    """ Build users, a few of them bots. """
+    rng = Random(seed)
+
+    return [FakeUser(10 ** 16 + i, rng.random() < bots) for i in range(count)]
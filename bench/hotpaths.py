@@ -0,0 +1,304 @@
+"""
+Offline benchmarks for the bot's hot paths, run on fake guilds, users, messages and contexts.
+
+Each hot path is the bot's real code, given a stand-in for the bot and fakes for the Discord objects it touches, so
+nothing connects to Discord. Every benchmark reports operations per second and how much memory it allocated.
+
+    python -m bench.hotpaths                     # 10k guilds with 50 emojis each
+    python -m bench.hotpaths -k prefix -k search # Only some benchmarks
+    python -m bench.hotpaths --save              # Record the results as the baseline
+    python -m bench.hotpaths --check             # Exit with 1 if anything regressed against the baseline
+
+Baselines are only comparable on the machine that recorded them, so CI should record its own (--save on the main
+branch, --check on changes).
+"""
+import asyncio
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+from tracemalloc import get_traced_memory, start, stop
+from types import SimpleNamespace
+from typing import *
+
+from bench.fakes import WORDS, FakeContext, FakeMessage, FakeWebhookCache, make_guilds, make_messages, make_users
+from bot.__main__ import GLOBAL_COOLDOWN, Emojis
+from src.common.cooldowns import Cooldown
+from src.common.emoji_index import EmojiIndex
+from src.common.state import LocalState
+from src.exts.custom_checks import CustomChecks
+from src.exts.fun import Fun
+from src.exts.utility import Utility
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+# How much worse than the baseline counts as a regression: machines (and runs) vary
+DEFAULT_TOLERANCE = 0.25
+MEMORY_SLACK_KB = 16.0  # Ignore differences this small, which are noise
+
+# name -> setup(world, args) -> (one operation taking an index, whether it's a coroutine function)
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+def benchmark(name: str) -> Callable:
+    def register(setup: Callable) -> Callable:
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def make_world(args) -> SimpleNamespace:
+    """ Fake guilds, users and messages, and a stand-in for the bot with the parts the hot paths use. """
+    began = perf_counter()
+    rng = Random(args.seed)
+
+    guilds = make_guilds(args.guilds, args.emojis, args.seed)
+    users = make_users(args.users, seed=args.seed)
+    contents = make_messages(args.messages, args.seed)
+
+    index = EmojiIndex()
+    index.build(guilds)
+
+    bot = SimpleNamespace(
+        emoji_index=index,
+        webhook_cache=FakeWebhookCache(),
+        # A few guilds have their own prefix
+        prefixes={guild.id: rng.choice("!?.$") for guild in guilds if rng.random() < 0.05},
+        state=LocalState(),
+        global_cooldown=Cooldown(*GLOBAL_COOLDOWN),
+        image_hashes=SimpleNamespace(set_packs=lambda packs: None),
+    )
+
+    # A few messages are DMs
+    messages = [
+        FakeMessage(content, rng.choice(users), rng.choice(guilds) if rng.random() < 0.97 else None)
+        for content in contents
+    ]
+
+    print("Built %d guilds, %d emojis and %d messages in %.2fs" % (
+        len(guilds), len(index), len(messages), perf_counter() - began))
+
+    return SimpleNamespace(bot=bot, guilds=guilds, users=users, messages=messages, rng=rng)
+
+
+@benchmark("replace_unparsed_emojis")
+def replace_unparsed_emojis(world, args):
+    bot, messages = world.bot, world.messages
+
+    async def step(i: int) -> None:
+        await Emojis.replace_unparsed_emojis(bot, messages[i % len(messages)])
+
+    return step, True
+
+
+@benchmark("get_prefix")
+def get_prefix(world, args):
+    bot, messages = world.bot, world.messages
+
+    async def step(i: int) -> None:
+        await Emojis.get_prefix(bot, messages[i % len(messages)])
+
+    return step, True
+
+
+@benchmark("bot_check")
+def bot_check(world, args):
+    checks = CustomChecks(world.bot)
+    help_command = SimpleNamespace(name="help", qualified_name="help", callback=None)
+    commands = [Utility.upload, Utility.search, Utility.info, Utility.list_packs, Fun.emojify, help_command]
+
+    # Guild messages only; commands are guild-only
+    messages = [message for message in world.messages if message.guild is not None]
+    contexts = [
+        FakeContext(world.bot, message, world.rng.choice(commands))
+        for message in messages
+    ]
+
+    async def step(i: int) -> None:
+        await checks.bot_check(contexts[i % len(contexts)])
+
+    return step, True
+
+
+@benchmark("emojify")
+def emojify(world, args):
+    cog = Fun(world.bot)
+    messages = [message for message in world.messages if message.guild is not None]
+    contexts = [FakeContext(world.bot, message) for message in messages]
+
+    async def step(i: int) -> None:
+        ctx = contexts[i % len(contexts)]
+        await Fun.emojify.callback(cog, ctx, sentence=ctx.message.content)
+
+    return step, True
+
+
+@benchmark("list_packs")
+def list_packs(world, args):
+    cog = Utility(world.bot)
+    pages = len(cog.packs.pages())
+    ctx = FakeContext(world.bot, world.messages[0])
+
+    async def step(i: int) -> None:
+        await Utility.list_packs.callback(cog, ctx, i % pages + 1)
+
+    return step, True
+
+
+@benchmark("search")
+def search(world, args):
+    index = world.bot.emoji_index
+    rng = world.rng
+
+    # Mostly real words and parts of them, some with no results
+    queries = [rng.choice(WORDS) for _ in range(200)]
+    queries += [word[:rng.randint(1, len(word))] for word in queries[:100]]
+    queries += ["zz%d" % i for i in range(20)]
+
+    def step(i: int) -> None:
+        index.search(queries[i % len(queries)])
+
+    return step, False
+
+
+def time_ops(loop: asyncio.AbstractEventLoop, step: Callable, is_async: bool, ops: int) -> float:
+    """ Run ops operations. Returns the seconds taken. """
+
+    async def run_async() -> None:
+        for i in range(ops):
+            await step(i)
+
+    began = perf_counter()
+
+    if is_async:
+        loop.run_until_complete(run_async())
+    else:
+        for i in range(ops):
+            step(i)
+
+    return perf_counter() - began
+
+
+def measure(name: str, world, args, loop: asyncio.AbstractEventLoop) -> dict:
+    step, is_async = BENCHMARKS[name](world, args)
+
+    # Warm up caches (and the cooldown store) before timing
+    time_ops(loop, step, is_async, min(args.ops, 1000))
+
+    best = min(time_ops(loop, step, is_async, args.ops) for _ in range(args.repeat))
+
+    # Memory in a separate run: tracing slows everything down
+    start()
+    time_ops(loop, step, is_async, args.ops)
+    current, peak = get_traced_memory()
+    stop()
+
+    return {
+        "ops_per_sec": args.ops / best,
+        "us_per_op": best / args.ops * 1e6,
+        "peak_kb": peak / 1024,
+        "retained_bytes_per_op": current / args.ops,
+    }
+
+
+def check(results: Dict[str, dict], baselines: Dict[str, dict], tolerance: float) -> List[str]:
+    """ Describe every result that's meaningfully worse than its baseline. """
+    regressions = []
+
+    for name, result in results.items():
+        baseline = baselines.get(name)
+
+        if baseline is None:
+            continue
+
+        if result["ops_per_sec"] < baseline["ops_per_sec"] * (1 - tolerance):
+            regressions.append("%s: %.0f ops/s, baseline %.0f" % (name, result["ops_per_sec"], baseline["ops_per_sec"]))
+
+        if result["peak_kb"] > baseline["peak_kb"] * (1 + tolerance) + MEMORY_SLACK_KB:
+            regressions.append("%s: %.1f KB peak, baseline %.1f KB" % (name, result["peak_kb"], baseline["peak_kb"]))
+
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--guilds", type=int, default=10000)
+    parser.add_argument("--emojis", type=int, default=50, help="Emojis per guild.")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--ops", type=int, default=20000, help="Operations per timed run.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark; the best is reported.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-k", dest="only", action="append", default=[],
+                        help="Only run benchmarks whose names contain this. Can be repeated.")
+    parser.add_argument("--baselines", default=BASELINES)
+    parser.add_argument("--save", action="store_true", help="Save the results as the baseline.")
+    parser.add_argument("--check", action="store_true", help="Compare with the baseline; exit with 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="How much slower (or bigger) than the baseline is allowed, as a fraction.")
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS if not args.only or any(part in name for part in args.only)]
+
+    if not names:
+        parser.error("no benchmarks match %s" % ", ".join(args.only))
+
+    world = make_world(args)
+    loop = asyncio.new_event_loop()
+    results = {}
+
+    print()
+    print("%-24s %12s %10s %10s %12s" % ("benchmark", "ops/s", "us/op", "peak KB", "retained B/op"))
+
+    try:
+        for name in names:
+            results[name] = result = measure(name, world, args, loop)
+            print("%-24s %12.0f %10.2f %10.1f %12.1f" % (
+                name, result["ops_per_sec"], result["us_per_op"], result["peak_kb"], result["retained_bytes_per_op"]))
+    finally:
+        loop.close()
+
+    status = 0
+
+    if args.check:
+        try:
+            with open(args.baselines) as f:
+                baselines = json.load(f)
+        except FileNotFoundError:
+            print("\nNo baseline at %s; run with --save first." % args.baselines)
+            return 1
+
+        regressions = check(results, baselines, args.tolerance)
+
+        print()
+        for line in regressions:
+            print("REGRESSION " + line)
+
+        if regressions:
+            status = 1
+        else:
+            print("No regressions against %s." % args.baselines)
+
+    if args.save:
+        try:
+            with open(args.baselines) as f:
+                baselines = json.load(f)
+        except FileNotFoundError:
+            baselines = {}
+
+        # Benchmarks that weren't run keep their old baselines
+        baselines.update(results)
+
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+
+        print("\nSaved baselines to %s." % args.baselines)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
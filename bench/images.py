@@ -0,0 +1,88 @@
+"""
+Benchmark for the emoji image normalisation stage (ImagePipeline).
+
+Runs every image in a local directory through the pipeline and reports throughput, how much the output shrank and
+the slowest worker job.
+Needs Pillow.
+
+    python -m bench.images ./path/to/corpus --workers 4
+"""
+import asyncio
+from collections import deque
+from argparse import ArgumentParser
+from os import listdir
+from os.path import isfile, join
+from time import perf_counter
+
+from src.common.images import ImagePipeline, normalise, sniff
+
+
+async def run(paths, workers: int, everything: bool) -> None:
+    pipeline = ImagePipeline(workers=workers)
+    pipeline.stats = deque()
+    corpus = []
+
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if sniff(data):
+            corpus.append((path, data))
+
+    print("%d images (%.1f MB)" % (len(corpus), sum(len(d) for _, d in corpus) / 1024 ** 2))
+
+    # Start the workers outside the timed section
+    await pipeline.run(len, b"")
+
+    async def one(data):
+        try:
+            if everything:
+                # Force every image through the workers, even ones that would be passed through
+                output, stats = await pipeline.run(normalise, data)
+                pipeline.stats.append(stats)
+
+                return output
+
+            return await pipeline.prepare(data)
+        except Exception:
+            return None
+
+    start = perf_counter()
+    results = await asyncio.gather(*(one(data) for _, data in corpus))
+    elapsed = perf_counter() - start
+
+    pipeline.close()
+
+    done = [(len(data), len(out)) for (_, data), out in zip(corpus, results) if out is not None]
+    size_in = sum(i for i, _ in done)
+    size_out = sum(o for _, o in done)
+
+    print("%d ok, %d failed in %.2fs" % (len(done), len(corpus) - len(done), elapsed))
+    print("%.1f images/s, %.2f MB/s in" % (len(corpus) / elapsed, size_in / 1024 ** 2 / elapsed))
+
+    if pipeline.stats:
+        slowest = max(pipeline.stats, key=lambda s: s.milliseconds)
+        print("%d jobs in workers, slowest %.1fms (%d -> %d bytes, %d/%d frames)" % (
+            len(pipeline.stats), slowest.milliseconds, slowest.input_size, slowest.output_size,
+            slowest.frames_kept, slowest.frames_in))
+
+    if size_in:
+        print("Size: %.1f MB -> %.1f MB (%.1f%% smaller)" % (
+            size_in / 1024 ** 2, size_out / 1024 ** 2, 100 * (1 - size_out / size_in)))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("corpus", help="A directory of images.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--all", action="store_true", help="Re-encode images that would be passed through.")
+    args = parser.parse_args()
+
+    paths = [join(args.corpus, name) for name in sorted(listdir(args.corpus))]
+    paths = [path for path in paths if isfile(path)]
+
+    asyncio.get_event_loop().run_until_complete(run(paths, args.workers, args.all))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Microbenchmark for NQN-style :emoji: replacement (Emojis.replace_unparsed_emojis).
+
+Compares the old approach (regex per word, then a linear scan of the guild's emojis and then of every emoji the bot
+can see, like EmojiConverter does) with EmojiIndex.replace_names.
+
+    python -m bench.nqn --guilds 1000 --emojis 50 --messages 20000
+"""
+from argparse import ArgumentParser
+from re import search
+from time import perf_counter
+
+from bench.fakes import make_guilds, make_messages
+from src.common.emoji_index import EmojiIndex
+
+
+def old_replace(content, guild, guilds):
+    """ The replacement logic from before the index, minus the Discord calls. """
+    if not search(r":[a-zA-Z0-9_-]+:", content):
+        return None
+
+    has_updated = False
+    message_split = content.split()
+
+    for i in range(len(message_split)):
+        word = message_split[i]
+
+        if search(r":[a-zA-Z0-9_-]+:", word):
+            name = word.replace(":", "")
+            found = next((e for e in guild.emojis if e.name == name), None)
+
+            if found is None:
+                # bot.emojis builds a fresh list of every emoji on each access
+                every_emoji = [e for g in guilds for e in g.emojis]
+                found = next((e for e in every_emoji if e.name == name), None)
+
+            if found is not None:
+                message_split[i] = str(found)
+                has_updated = True
+
+    return " ".join(message_split) if has_updated else None
+
+
+def run(label, func, messages, guilds) -> float:
+    count = len(messages)
+    start = perf_counter()
+
+    for i, content in enumerate(messages):
+        func(content, guilds[i % len(guilds)])
+
+    elapsed = perf_counter() - start
+    print("%-8s %10.0f msg/s  (%d messages in %.3fs)" % (label, count / elapsed, count, elapsed))
+
+    return count / elapsed
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--emojis", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--skip-old", action="store_true", help="Only time the indexed path.")
+    args = parser.parse_args()
+
+    guilds = make_guilds(args.guilds, args.emojis)
+    messages = make_messages(args.messages)
+
+    start = perf_counter()
+    index = EmojiIndex()
+    index.build(guilds)
+    print("Indexed %d emojis in %.3fs" % (len(index), perf_counter() - start))
+
+    after = run("after", lambda content, guild: index.replace_names(content, guild.id), messages, guilds)
+
+    if not args.skip_old:
+        before = run("before", lambda content, guild: old_replace(content, guild, guilds), messages, guilds)
+        print("Speedup: %.1fx" % (after / before))
+
+
+if __name__ == "__main__":
+    main()
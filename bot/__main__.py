@@ -1,12 +1,21 @@
+import sys
+from time import monotonic, perf_counter
+
+# With --profile-startup, time every import from here on (see src/common/startup.py)
+LAUNCHED = perf_counter()
+if "--profile-startup" in sys.argv:
+    from src.common.startup import ImportProfiler
+    IMPORTS = ImportProfiler().install()
+else:
+    IMPORTS = None
+
 import os
 import asyncio
 import logging
+from argparse import ArgumentParser, ArgumentTypeError
 from os import listdir
 from os.path import splitext
-from re import search
 import keep_alive
-import matplotlib.pyplot as plt
-from dateutil.utils import today
 from discord import (
     Activity,
     ActivityType,
@@ -20,20 +29,31 @@ from discord.ext.commands import (
     MissingRequiredArgument,
     CommandInvokeError,
     AutoShardedBot,
-    EmojiConverter,
-    BucketType,
-    CooldownMapping,
 )
+from discord.http import Route
+from discord.webhook import WebhookAdapter
 
 
 
 from src.common.common import *
+from src.common.cooldowns import Cooldown
+from src.common.diskcache import DiskCache
+from src.common.emoji_index import EmojiIndex
+from src.common.fetch import ImageFetcher
+from src.common.imagehash import DuplicateEmoji, ImageHashIndex
+from src.common.images import ImagePipeline
+from src.common.monitor import LoopMonitor
+from src.common.reactions import ReactionRouter
+from src.common.recorder import EventRecorder
+from src.common.resp import RespError
+from src.common.startup import StartupProfile, load_extensions
+from src.common.state import open_state
+from src.common.storage import SQLiteStore
+from src.common.usage import UsageRecorder
+from src.common.webhooks import WebhookCache
 # from replit import db as db
 log = logging.Logger(__name__)
-
-# from keep_alive import app as keep_alive_app
-# keep_alive_app.loaded_in = True
-GLOBAL_COOLDOWN = (1.0, 5.0)  # (1.0, 5.0) = 1 command per 5 seconds
+GLOBAL_COOLDOWN = (1, 5.0)  # (1, 5.0) = 1 command per 5 seconds
 WELCOME_MSG = "Thanks for inviting Emojis. My prefix is `~`.\n\n"
 
 
@@ -55,28 +75,42 @@ class CustomContext(Context):
 
     async def upload_emoji(self,
                            name: str,
-                           url: str,
-                           post_success: bool = True) -> Emoji:
+                           url: str = None,
+                           post_success: bool = True,
+                           *,
+                           image: bytes = None,
+                           prepared: bool = False) -> Emoji:
         """
         Upload a custom emoji to a guild.
 
         :param name: The name for the emoji.
-        :param url: The source of the image. Must be < 256kb.
+        :param url: [Optional] The source of the image. Images over 256kb are shrunk to fit.
         :param post_success: [Optional] Whether or not to post a success message in the chat.
+        :param image: [Optional] The image bytes, if they have already been fetched (e.g. from an attachment).
+        :param prepared: [Optional] Whether image has already been through ImagePipeline.prepare.
         :returns: The new emoji.
         """
-        response = get(url)
+        if image is None:
+            # Streamed on the bot's shared session, so the event loop keeps running
+            image = await self.bot.fetcher.fetch(url)
+
+        # Fit the image under Discord's size limit (in a worker process, if it needs work)
+        if not prepared:
+            image = await self.bot.images.prepare(image)
 
-        if response.ok:
-            # Store the image in BytesIO to avoid saving to disk
-            emoji_bytes = BytesIO(response.content)
+        # Don't spend a slot on a picture the guild already has under another name
+        hashes = self.bot.image_hashes
+        hashes.prioritise(self.guild.id)
+        image_hash = await hashes.hash_image(image)
+        duplicate = hashes.duplicate(self.guild.id, image_hash)
 
-            # Upload the emoji to the Guild
-            new_emoji = await self.guild.create_custom_emoji(
-                name=name, image=emoji_bytes.read())
-        else:
-            raise Exception("Couldn't fetch image (%s)." %
-                            response.status_code)
+        if duplicate is not None:
+            raise DuplicateEmoji("This server already has that emoji, as `:%s:`." % hashes.emojis[duplicate][1])
+
+        # Upload the emoji to the Guild
+        new_emoji = await self.guild.create_custom_emoji(name=name,
+                                                         image=image)
+        hashes.add_emoji(self.guild.id, new_emoji, image_hash)
 
         # Post a success Embed in the chat
         if post_success:
@@ -90,12 +124,35 @@ class CustomContext(Context):
 
 class Emojis(AutoShardedBot):
     """ A custom AutoShardedBot class with overridden methods."""
-    def __init__(self):
-        self.cooldown = CooldownMapping.from_cooldown(*GLOBAL_COOLDOWN,
-                                                      BucketType.user)
-        self.command_usage = {}
+    def __init__(self,
+                 shard_ids: List[int] = None,
+                 shard_count: int = None,
+                 port: int = keep_alive.PORT):
+        """
+        :param shard_ids: [Optional] The shards this process runs (see bot/cluster.py). Defaults to all of them.
+        :param shard_count: [Optional] The total number of shards. Required with shard_ids.
+        :param port: [Optional] The port to serve health checks and metrics on.
+        """
+        self.health_port = port
+        self.state = open_state(os.environ.get("EMOJIS_STATE_URL"))
+        self.state_versions = [0, 0]
+        self.global_cooldown = Cooldown(*GLOBAL_COOLDOWN)
+        self.usage = UsageRecorder()
+        self.loop_monitor = LoopMonitor()
+        self.reactions = ReactionRouter()
+        self.pack_installs: Dict[str, int] = {}  # Outcome -> pack emojis, from ~pack install
+        self.last_event_at = monotonic()
+        self.health_server = None
+        self.startup_profile: Optional[StartupProfile] = None
+        self.recorder: Optional[EventRecorder] = None  # With --record (see bot/replay.py)
         self.prefixes = {}
         self.blacklist = set()
+        self.fetcher = ImageFetcher(cache=DiskCache())
+        self.emoji_index = EmojiIndex()
+        self.webhook_cache = WebhookCache()
+        self.images = ImagePipeline()
+        self.store = SQLiteStore()
+        self.image_hashes = ImageHashIndex(self.store, self.fetcher, self.images)
 
         # Make sure the bot can't be abused to mass ping
         allowed_mentions = AllowedMentions(roles=False,
@@ -106,7 +163,8 @@ class Emojis(AutoShardedBot):
         intents = Intents(guilds=True,
                           emojis=True,
                           messages=True,
-                          reactions=True)
+                          reactions=True,
+                          webhooks=True)
 
         super().__init__(
             command_prefix=self.get_prefix,
@@ -120,6 +178,8 @@ class Emojis(AutoShardedBot):
             heartbeat_timeout=150.0,
             allowed_mentions=allowed_mentions,
             intents=intents,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
             owner_ids=[
                 269249777185718274,  # DJ
             ],
@@ -128,26 +188,90 @@ class Emojis(AutoShardedBot):
         # Update continuously
         self.presence_updater = self.loop.create_task(
             self._bg_update_presence())
-        # self.usage_updater = self.loop.create_task(self._bg_update_usage())
+        self.usage_updater = self.loop.create_task(self._bg_update_usage())
+        self.state_updater = self.loop.create_task(self._bg_sync_state())
+
+    async def start(self, *args, **kwargs) -> None:
+        """ Load stored settings before connecting, so the first messages already see them. """
+        # Read the versions first, so changes made while loading are picked up by the next sync
+        try:
+            self.state_versions = await self.state.versions("blacklist", "prefixes")
+        except (ConnectionError, OSError, RespError):
+            log.warning("Couldn't reach the shared state; starting without it.")
+
+        await self.update_prefix_list()
+        await self.update_blacklist()
+        await self.image_hashes.start()
+
+        # Health checks and metrics, served from this loop
+        self.loop_monitor.start(self.loop)
+        self.health_server = await keep_alive.keep_alive(
+            self, port=self.health_port)
+
+        await super().start(*args, **kwargs)
+
+    def dispatch(self, event, *args, **kwargs) -> None:
+        self.last_event_at = monotonic()
+
+        # Hand reactions straight to the session that owns the message
+        if event == "raw_reaction_add" or event == "raw_reaction_remove":
+            self.reactions.route(args[0])
+        elif event == "socket_response" and self.recorder is not None:
+            self.recorder.record(args[0])
+
+        super().dispatch(event, *args, **kwargs)
 
-        # Update once
-        # self.loop.create_task(self.update_prefix_list())
-        # self.loop.create_task(self.update_blacklist())
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        # Name event tasks, so the loop monitor can say which event was blocking
+        task = super()._schedule_event(coro, event_name, *args, **kwargs)
+        task.set_name("event:%s" % event_name)
+
+        return task
 
     async def get_prefix(self, message):
-        return self.prefixes.get(message.guild.id, "~")
+        if message.guild is None:
+            return DEFAULT_PREFIX
+
+        return self.prefixes.get(message.guild.id, DEFAULT_PREFIX)
 
     async def get_context(self, message, *, cls=CustomContext):
         """ Use CustomContext instead of Context. """
         return await super().get_context(message, cls=cls)
 
     async def on_message(self, message) -> None:
+        # Drop blacklisted users before doing any work for them
+        if message.author.id in self.blacklist:
+            return
+
         # Process message
         await self.process_commands(message)
 
         # Replace unparsed :emojis:, NQN-style
         await self.replace_unparsed_emojis(message)
 
+    async def close(self) -> None:
+        """ Flush usage stats, then close the shared HTTP session, the image workers and the store. """
+        if self.is_closed():
+            return
+
+        self.usage_updater.cancel()
+        self.state_updater.cancel()
+        self.image_hashes.stop()
+        await self.flush_usage()
+
+        await self.fetcher.close()
+        self.images.close()
+        await self.store.close()
+        await self.state.close()
+
+        if self.recorder is not None:
+            self.recorder.close()
+
+        self.loop_monitor.stop()
+        if self.health_server is not None:
+            await self.health_server.cleanup()
+        await super().close()
+
     async def on_command_error(self, ctx, err) -> None:
         """
         Catch and handle errors thrown by the bot.
@@ -178,18 +302,22 @@ class Emojis(AutoShardedBot):
         await ctx.error(msg)
 
     async def invoke(self, ctx):
-        if ctx.message.author.id in self.blacklist:
-            await ctx.error("Sorry, buddy. You're blacklisted. ")
-        else:
-            await super().invoke(ctx)
+        # Blacklisted users never get this far (see on_message)
+        ctx.invoked_at = perf_counter()
 
-    async def on_command_completion(self, ctx):
-        cmd = ctx.command.name.lower()
+        # Every message comes through here, commands or not
+        if ctx.command is not None:
+            asyncio.current_task().set_name("command:%s" %
+                                            ctx.command.qualified_name)
+        await super().invoke(ctx)
 
-        self.command_usage[cmd] = self.command_usage.get(cmd, 0) + 1
+    async def on_command_completion(self, ctx):
+        self.usage.record(ctx.command.qualified_name,
+                          ctx.guild and ctx.guild.id,
+                          perf_counter() - ctx.invoked_at)
 
     async def on_guild_join(self, guild) -> None:  # noqa
-        """ Send a welcome message, and create the Emojis webhook in each channel. """
+        """ Send a welcome message. Webhooks are created lazily, the first time a channel needs one. """
 
         # Find the first channel the bot can type in and send the welcome message
         for channel in guild.text_channels:
@@ -197,23 +325,55 @@ class Emojis(AutoShardedBot):
                 await channel.send(embed=Embed(description=WELCOME_MSG))
                 break
 
-        for channel in guild.text_channels:
-            await channel.create_webook(name="Emojis")
+        self.emoji_index.set_guild(guild.id, guild.emojis)
+        self.image_hashes.set_guild(guild.id, guild.emojis)
+
+    async def on_guild_remove(self, guild) -> None:  # noqa
+        self.emoji_index.remove_guild(guild.id)
+        self.image_hashes.remove_guild(guild.id)
+        self.webhook_cache.invalidate_guild(guild)
+
+    async def on_webhooks_update(self, channel) -> None:  # noqa
+        self.webhook_cache.updated(channel.id)
+
+    async def on_guild_channel_delete(self, channel) -> None:  # noqa
+        self.webhook_cache.invalidate(channel.id)
+
+    async def on_guild_available(self, guild) -> None:  # noqa
+        self.emoji_index.set_guild(guild.id, guild.emojis)
+        self.image_hashes.set_guild(guild.id, guild.emojis)
+
+    async def on_guild_emojis_update(self, guild, before, after) -> None:  # noqa
+        self.emoji_index.set_guild(guild.id, after)
+        self.image_hashes.set_guild(guild.id, after)
+
+    async def on_connect(self) -> None:  # noqa
+        # The bot's user is known from here on; its own reactions aren't presses
+        self.reactions.user_id = self.user.id
 
     async def on_ready(self) -> None:  # noqa
-        print("Bot ready!")
+        # Index every emoji the bot can see, for ~search and ~random
+        self.emoji_index.build(self.guilds)
 
-    # async def update_blacklist(self):
-    #     query = db.blacklist.find({}, {"_id": False})
+        # Perceptual hashes, for duplicate checks and ~similar (hashed in the background if not stored yet)
+        for guild in self.guilds:
+            self.image_hashes.set_guild(guild.id, guild.emojis)
 
-        # async for result in query:
-        #     self.blacklist.add(result["id"])
+        print("Bot ready!")
+
+        # Profiling startup ends here
+        if self.startup_profile is not None:
+            self.startup_profile.ready_after = perf_counter() - self.startup_profile.started
+            await self.close()
 
-    # async def update_prefix_list(self):
-    # #     query = db.prefixes.find({}, {"_id": False})
+    async def update_blacklist(self):
+        """ Load the blacklist into memory, for constant-time checks on every message. """
+        self.blacklist = await self.store.load_blacklist()
 
-    #     async for result in query:
-    #         self.prefixes[result["id"]] = result["prefix"]
+    async def update_prefix_list(self):
+        """ Load custom prefixes for the guilds on this process's shards (all of them, unless shard_ids is set). """
+        self.prefixes = await self.store.load_prefixes(self.shard_ids,
+                                                       self.shard_count)
 
     async def _bg_update_presence(self, delay: int = 300) -> None:
         """ Update the bot's status continuously. """
@@ -232,115 +392,163 @@ class Emojis(AutoShardedBot):
 
             await asyncio.sleep(delay)
 
-    # async def _bg_update_usage(self, delay: int = 900):
-    #     """ Update the bot's usage stats in MongoDB. """
+    async def _bg_update_usage(self, delay: int = 60) -> None:
+        """ Flush usage stats to the store continuously, in batches. """
 
-    #     await self.wait_until_ready()
+        await self.wait_until_ready()
 
-    #     while not self.is_closed():
-    #         # Update all-time usage data
-    #         for cmd, usage in self.command_usage.items():
-    #             # Update global command usage
-    #             await db.usage.update_one({}, {"$inc": {
-    #                 cmd.lower(): usage
-    #             }},
-    #                                       upsert=True)
+        while not self.is_closed():
+            await asyncio.sleep(delay)
+            await self.flush_usage()
 
-    #             # Update today's command usage
-    #             await db.historical_usage.update_one(
-    #                 {"date": str(today().strftime("%Y-%m-%d"))},
-    #                 {"$inc": {
-    #                     "commands": usage
-    #                 }},
-    #                 upsert=True,
-    #             )
+    async def _bg_sync_state(self, delay: int = 5) -> None:
+        """ Reload the blacklist and prefixes when another process changes them. """
 
-    #         # Reset command usage cache
-    #         self.command_usage = {}
+        await self.wait_until_ready()
 
-    #         await make_graph()
-    #         await asyncio.sleep(delay)
+        while not self.is_closed():
+            await asyncio.sleep(delay)
+
+            try:
+                versions = await self.state.versions("blacklist", "prefixes")
+            except (ConnectionError, OSError, RespError):
+                continue
+
+            blacklist, prefixes = versions
+
+            if blacklist != self.state_versions[0]:
+                await self.update_blacklist()
+            if prefixes != self.state_versions[1]:
+                await self.update_prefix_list()
+
+            self.state_versions = versions
+
+    async def flush_usage(self) -> None:
+        """ Write pending usage stats to the store in one transaction. """
+        counts, latency = self.usage.drain()
+
+        try:
+            await self.store.add_usage(counts, latency)
+        except Exception:
+            # Keep the counts for the next flush
+            self.usage.restore(counts, latency)
+            log.exception("Couldn't flush usage stats.")
 
     async def replace_unparsed_emojis(self, message: Message):
         """
         Replace unparsed ':emojis:' in a message, to simulate Discord Nitro.
         Sends the modified message on a Webhook that looks like the user.
         """
-        has_updated = False
+        if message.author.bot or message.guild is None:
+            return
 
-        if not message.author.bot:
-            # Check for :emojis:
-            match = bool(search(r":[a-zA-Z0-9_-]+:", message.content))
+        # Resolve every :name: in one pass, preferring this guild's emojis
+        content = self.emoji_index.replace_names(message.content,
+                                                 message.guild.id)
 
-            if match:
-                ctx = await self.get_context(message)
-                message_split = message.content.split()
+        if content is not None:
+            # Send the message on the bot's (cached) Webhook
+            await self.webhook_cache.send(
+                message.channel,
+                content,
+                username=message.author.display_name,
+                avatar_url=message.author.avatar_url,
+            )
 
-                # Loop through every word and try to make it an emoji
-                for i in range(len(message_split)):
-                    word = message_split[i]
+            await message.delete()
 
-                    # Matches unparsed emojis
-                    if search(r":[a-zA-Z0-9_-]+:", word):
-                        try:
-                            # Convert to Emoji
-                            found_emoji = await EmojiConverter().convert(
-                                ctx, word.replace(":", ""))
 
-                            message_split[i] = str(found_emoji)
-                            has_updated = True
-                        except BadArgument:
-                            pass
+def shard_range(value: str) -> List[int]:
+    """ Parse a shard range like "0-3" (inclusive) or a single shard ID like "4". """
+    start, _, end = value.partition("-")
 
-                if has_updated:
-                    # Find the bot's Webhook and send the message on it
-                    webhook = await get_emojis_webhook(ctx)
+    try:
+        start, end = int(start), int(end or start)
+    except ValueError:
+        raise ArgumentTypeError("expected a shard range like 0-3")
 
-                    await webhook.send(
-                        " ".join(message_split),
-                        username=message.author.display_name,
-                        avatar_url=message.author.avatar_url,
-                    )
+    if start < 0 or end < start:
+        raise ArgumentTypeError("expected a shard range like 0-3")
 
-                    await message.delete()
+    return list(range(start, end + 1))
 
 
-# async def make_graph():
-#     """ Make a graph of command usage. """
-#     query = db.historical_usage.find({}, {"_id": False})
+def parse_args(argv: List[str] = None):
+    parser = ArgumentParser(prog="python -m bot", description="Run the bot, or some of its shards.")
+    parser.add_argument("--shard-ids", type=shard_range, metavar="A-B",
+                        help="The shards to run in this process (default: all)")
+    parser.add_argument("--shard-count", type=int, metavar="N",
+                        help="The total number of shards (default: Discord's recommendation)")
+    parser.add_argument("--port", type=int, default=keep_alive.PORT,
+                        help="The port to serve /healthz and /metrics on")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Start up, print where the time went, and exit once on_ready fires")
+    parser.add_argument("--startup-budget", type=float, metavar="SECONDS",
+                        help="With --profile-startup: exit with an error if on_ready takes longer than this")
+    parser.add_argument("--record", metavar="PATH",
+                        help="Save anonymised message and reaction events, to replay with bot/replay.py")
 
-#     dates = []
-#     commands = []
+    args = parser.parse_args(argv)
 
-#     async for i in query:
-#         date = i["date"]
-#         cmds = i["commands"]
+    if args.startup_budget is not None and not args.profile_startup:
+        parser.error("--startup-budget needs --profile-startup")
 
-#         dates.append(date)
-#         commands.append(cmds)
+    if args.shard_ids is not None:
+        if args.shard_count is None:
+            parser.error("--shard-ids needs --shard-count")
+        if args.shard_ids[-1] >= args.shard_count:
+            parser.error("--shard-ids must be below --shard-count")
 
-#     plt.clf()
-#     plt.plot(dates, commands)
-#     plt.title = "Command usage by day"
-#     plt.savefig("./data/stats/usage.png")
+    return args
 
 
 if __name__ == "__main__":
-    bot = Emojis()
-    
-    
+    args = parse_args()
+
+    # Point the bot at a stand-in API and gateway for local testing (see bot/standin.py)
+    # Webhooks have their own copy of the base URL
+    if os.environ.get("DISCORD_API_BASE"):
+        Route.BASE = WebhookAdapter.BASE = os.environ["DISCORD_API_BASE"]
+
+    bot = Emojis(shard_ids=args.shard_ids,
+                 shard_count=args.shard_count,
+                 port=args.port)
+
+    if args.record:
+        bot.recorder = EventRecorder(args.record, bot)
+
+    profile = None
+    if args.profile_startup:
+        profile = bot.startup_profile = StartupProfile(LAUNCHED, IMPORTS, args.startup_budget)
+        profile.imported_at = perf_counter()
+
     # Remove the default help command so a better one can be added
     bot.remove_command("help")
 
-    # Load cogs
+    # Load cogs, importing what they depend on concurrently first
     # Ignores files starting with "_", like __init__.py
-    for cog in listdir("./src/exts/"):
-        if not cog.startswith("_"):
-            file_name, file_extension = splitext(cog)
-            bot.load_extension("src.exts.%s" % file_name)
+    cogs = [
+        "src.exts.%s" % splitext(cog)[0]
+        for cog in sorted(listdir("./src/exts/"))
+        if not cog.startswith("_")
+    ]
+    cog_timings = load_extensions(bot, cogs)
+
+    if profile is not None:
+        IMPORTS.uninstall()
+        profile.cogs = cog_timings
+        profile.loaded_at = perf_counter()
+
+        # Don't wait forever for on_ready once the budget is blown
+        if profile.budget is not None:
+            bot.loop.call_later(
+                max(0.0, profile.budget - (profile.loaded_at - LAUNCHED)),
+                lambda: bot.is_ready() or bot.loop.create_task(bot.close()),
+            )
 
-    # Reload the Misc extension to update the help command
-    bot.reload_extension("src.exts.misc")
     bottoken = os.environ['bottoken']
-    keep_alive.keep_alive()
     bot.run(bottoken)
+
+    if profile is not None:
+        print(profile.report())
+        sys.exit(1 if profile.over_budget else 0)
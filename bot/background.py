@@ -1,7 +1,5 @@
 import discord
 from discord.ext import commands, tasks
-import disnake
-from disnake.ext import commands
 # import random
 # from slashtilities import log
 
@@ -0,0 +1,293 @@
+"""
+Run the bot as a cluster of worker processes, each running a contiguous range of shards.
+
+    python -m bot.cluster --workers 4 --shards 16
+
+The supervisor restarts workers that exit, with exponential backoff, and serves every worker's /healthz and /metrics
+as one view on its own port. Workers serve theirs on the ports after it.
+
+Workers share cooldowns and changes to the blacklist and prefixes through a Redis protocol server (see
+src/common/state.py). Set EMOJIS_STATE_URL to use a real Redis; otherwise the supervisor serves one on the port after
+the workers'.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from argparse import ArgumentParser
+from time import monotonic
+from typing import *
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+
+import keep_alive
+from src.common.metrics import Metrics, merge
+from src.common.resp import RespServer
+
+log = logging.getLogger(__name__)
+
+API_BASE = "https://discord.com/api/v7"
+RESTART_BACKOFF = (1.0, 60.0)  # (first delay, longest delay), in seconds
+STABLE_AFTER = 60.0  # A worker that ran this long before exiting restarts without waiting
+SCRAPE_TIMEOUT = 2.0
+
+
+def split_shards(shard_count: int, workers: int) -> List[range]:
+    """ Split the shards into contiguous ranges, one per worker, as evenly as possible. """
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+
+    for i in range(workers):
+        end = start + size + (i < extra)
+        ranges.append(range(start, end))
+        start = end
+
+    return ranges
+
+
+async def recommended_shards(token: str) -> int:
+    """ Ask Discord (or the stand-in, see bot/standin.py) how many shards to run. """
+    base = os.environ.get("DISCORD_API_BASE") or API_BASE
+
+    async with ClientSession(timeout=ClientTimeout(total=10)) as session:
+        async with session.get(base + "/gateway/bot", headers={"Authorization": "Bot " + token}) as response:
+            response.raise_for_status()
+            return (await response.json())["shards"]
+
+
+class Worker:
+    """ One bot process, restarted whenever it exits until the cluster stops. """
+
+    def __init__(self, cluster_id: int, shards: range, shard_count: int, port: int, env: Dict[str, str] = None):
+        self.cluster_id = cluster_id
+        self.shards = shards
+        self.shard_count = shard_count
+        self.port = port
+        self.env = env
+
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.backoff = RESTART_BACKOFF[0]
+
+    @property
+    def command(self) -> List[str]:
+        return [
+            sys.executable, "-m", "bot",
+            "--shard-ids", "%d-%d" % (self.shards[0], self.shards[-1]),
+            "--shard-count", str(self.shard_count),
+            "--port", str(self.port),
+        ]
+
+    @property
+    def up(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def run(self, stopping: asyncio.Event) -> None:
+        """ Keep the worker running until stopping is set. """
+        while not stopping.is_set():
+            self.process = await asyncio.create_subprocess_exec(*self.command, env=self.env)
+            self.started_at = monotonic()
+            log.info("Worker %d (shards %d-%d) started, pid %d.",
+                     self.cluster_id, self.shards[0], self.shards[-1], self.process.pid)
+
+            code = await self.process.wait()
+
+            if stopping.is_set():
+                break
+
+            uptime = monotonic() - self.started_at
+
+            # A worker that crashes straight away keeps backing off; one that ran for a while starts over
+            if uptime >= STABLE_AFTER:
+                self.backoff = RESTART_BACKOFF[0]
+
+            log.warning("Worker %d exited with code %s after %.0fs. Restarting in %.0fs.",
+                        self.cluster_id, code, uptime, self.backoff)
+            self.restarts += 1
+
+            try:
+                await asyncio.wait_for(stopping.wait(), self.backoff)
+            except asyncio.TimeoutError:
+                pass
+
+            self.backoff = min(self.backoff * 2, RESTART_BACKOFF[1])
+
+    async def stop(self, timeout: float = 15.0) -> None:
+        """ Ask the worker to shut down cleanly, and kill it if it takes too long. """
+        if not self.up:
+            return
+
+        self.process.terminate()
+
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Worker %d didn't stop in time; killing it.", self.cluster_id)
+            self.process.kill()
+            await self.process.wait()
+
+
+class Cluster:
+    """ The supervisor: runs the workers and serves their health checks and metrics as one. """
+
+    def __init__(self, workers: int, shard_count: int, port: int = keep_alive.PORT, state_url: str = None):
+        self.shard_count = shard_count
+        self.port = port
+
+        ranges = [shards for shards in split_shards(shard_count, workers) if shards]
+
+        # Without a shared state server to point the workers at, run one
+        self.state_server = RespServer() if not state_url else None
+        self.state_port = port + 1 + len(ranges)
+        self.state_url = state_url or "redis://127.0.0.1:%d" % self.state_port
+
+        env = dict(os.environ, EMOJIS_STATE_URL=self.state_url)
+        self.workers = [Worker(i, shards, shard_count, port + 1 + i, env) for i, shards in enumerate(ranges)]
+
+        self._session: Optional[ClientSession] = None
+
+    async def _scrape(self, worker: Worker, path: str) -> Optional[str]:
+        """ GET a path from a worker's health server. None if it can't be reached. """
+        if not worker.up:
+            return None
+
+        if self._session is None:
+            self._session = ClientSession(timeout=ClientTimeout(total=SCRAPE_TIMEOUT))
+
+        try:
+            # /healthz answers 503 until the worker is ready, but the body is still worth reporting
+            async with self._session.get("http://127.0.0.1:%d%s" % (worker.port, path)) as response:
+                return await response.text()
+        except (ClientError, asyncio.TimeoutError):
+            return None
+
+    async def health(self) -> dict:
+        """ Every worker's health, and whether all of them are ready. """
+        bodies = await asyncio.gather(*(self._scrape(worker, "/healthz") for worker in self.workers))
+        workers = {}
+
+        for worker, body in zip(self.workers, bodies):
+            try:
+                health = json.loads(body) if body is not None else None
+            except ValueError:
+                health = None
+
+            workers[str(worker.cluster_id)] = {
+                "shards": "%d-%d" % (worker.shards[0], worker.shards[-1]),
+                "pid": worker.process.pid if worker.up else None,
+                "restarts": worker.restarts,
+                "health": health,
+            }
+
+        return {
+            "ready": all(w["health"] is not None and w["health"]["ready"] for w in workers.values()),
+            "shard_count": self.shard_count,
+            "workers": workers,
+        }
+
+    async def metrics(self) -> str:
+        """ Every worker's metrics, labelled by worker, plus the supervisor's own. """
+        bodies = await asyncio.gather(*(self._scrape(worker, "/metrics") for worker in self.workers))
+
+        m = Metrics()
+        m.gauge("emojis_cluster_worker_up", "Whether a worker's metrics could be read.",
+                (({"cluster": w.cluster_id}, body is not None) for w, body in zip(self.workers, bodies)))
+        m.counter("emojis_cluster_worker_restarts_total", "Times a worker has been restarted.",
+                  (({"cluster": w.cluster_id}, w.restarts) for w in self.workers))
+
+        merged = merge({
+            str(worker.cluster_id): body
+            for worker, body in zip(self.workers, bodies)
+            if body is not None
+        }, "cluster")
+
+        return merged + m.render()
+
+    async def serve(self, host: str = "0.0.0.0") -> web.AppRunner:
+        """ Serve the combined health checks and metrics. Call cleanup() on the result to stop. """
+
+        async def home(request):
+            return web.Response(text="I'm alive")
+
+        async def healthz(request):
+            body = await self.health()
+
+            return web.Response(
+                text=json.dumps(body),
+                content_type="application/json",
+                status=200 if body["ready"] else 503,
+            )
+
+        async def metrics_(request):
+            return web.Response(text=await self.metrics(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/", home)
+        app.router.add_get("/healthz", healthz)
+        app.router.add_get("/metrics", metrics_)
+
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, self.port).start()
+
+        return runner
+
+    async def run(self) -> None:
+        """ Run every worker until SIGINT or SIGTERM, then stop them all. """
+        loop = asyncio.get_event_loop()
+        stopping = asyncio.Event()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stopping.set)
+            except NotImplementedError:
+                pass  # Windows
+
+        state = None
+        if self.state_server is not None:
+            state = await self.state_server.serve("127.0.0.1", self.state_port)
+
+        runner = await self.serve()
+        tasks = [loop.create_task(worker.run(stopping)) for worker in self.workers]
+
+        try:
+            await stopping.wait()
+        finally:
+            stopping.set()
+            await asyncio.gather(*(worker.stop() for worker in self.workers))
+            await asyncio.gather(*tasks)
+
+            await runner.cleanup()
+            if state is not None:
+                state.close()
+            if self._session is not None:
+                await self._session.close()
+
+
+def main(argv: List[str] = None) -> None:
+    parser = ArgumentParser(prog="python -m bot.cluster", description="Run the bot's shards over several processes.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="How many worker processes to run (default: one per core)")
+    parser.add_argument("--shards", type=int,
+                        help="The total number of shards (default: Discord's recommendation)")
+    parser.add_argument("--port", type=int, default=keep_alive.PORT,
+                        help="The supervisor's port. Worker i serves on port + 1 + i")
+    parser.add_argument("--state-url", default=os.environ.get("EMOJIS_STATE_URL"),
+                        help="A redis:// URL for the workers' shared state (default: run one in the supervisor)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    shard_count = args.shards or asyncio.run(recommended_shards(os.environ["bottoken"]))
+    cluster = Cluster(min(args.workers, shard_count), shard_count, args.port, args.state_url)
+
+    log.info("Running %d shards over %d workers.", shard_count, len(cluster.workers))
+    asyncio.run(cluster.run())
+
+
+if __name__ == "__main__":
+    main()
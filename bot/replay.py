@@ -0,0 +1,361 @@
+"""
+Replay recorded gateway traffic against the bot, through the stand-in, at increasing speeds.
+
+    python -m bot --record events.jsonl              # Record (anonymised) for a while, on the real bot
+    python -m bot.replay events.jsonl --speeds 1 4 16 --latency 50 --jitter 50 --rate-limit 0.01
+    python -m bot.replay --messages 20000 --rate 50  # No recording: synthetic chat from bench/fakes.py
+
+The stand-in (bot/standin.py) is started, then the bot is launched against it (or, with --no-launch, whatever is
+already pointed at it: a single process or bot/cluster.py). Once the bot's /healthz says it's ready, the events are
+replayed at each speed in turn, and for each speed it reports how long messages took to come back as webhook sends
+(the NQN-style replacement) and how many never did.
+
+A message's expected webhook content is worked out with EmojiIndex over every stand-in guild, the same way the bot
+does it, so replies can be matched up however they're interleaved. A cluster worker only sees its own guilds, so names
+that only resolve in another worker's guilds are matched to the oldest outstanding message in the channel instead.
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+from argparse import ArgumentParser
+from random import Random
+from re import compile as compile_regex
+from time import monotonic
+from typing import *
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+
+import keep_alive
+from bench.fakes import make_messages
+from bot.standin import StandIn, add_condition_args, message_payload, now_iso, user_payload
+from src.common.emoji_index import EmojiIndex
+
+log = logging.getLogger(__name__)
+
+# The anonymised emoji names in a recording that resolved when it was made (see src/common/recorder.py)
+RESOLVED_NAME = compile_regex(r":e([0-9]+):")
+
+USER_IDS = 10 ** 16  # Recorded user N replays as this + N
+
+
+def load_recording(path: str) -> List[dict]:
+    """ Events recorded with python -m bot --record, oldest first. """
+    with open(path, encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+
+    events.sort(key=lambda event: event["t"])
+
+    return events
+
+
+def synthetic_recording(messages: int, rate: float, guilds: int, users: int, seed: int = 0) -> List[dict]:
+    """ Chat like bench/fakes.py makes, spread evenly over time, in the same format as a recording. """
+    rng = Random(seed)
+
+    return [
+        {
+            "t": i / rate,
+            "event": "MESSAGE_CREATE",
+            "message": i + 1,
+            "guild": rng.randint(1, guilds),
+            "author": rng.randint(1, users),
+            "bot": False,
+            "content": content,
+        }
+        for i, content in enumerate(make_messages(messages, seed))
+    ]
+
+
+def percentile(ordered: Sequence[float], fraction: float) -> float:
+    """ The nearest-rank percentile of sorted values. 0 if there are none. """
+    if not ordered:
+        return 0.0
+
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+class Replay:
+    """ Plays a recording into the stand-in and matches the bot's webhook sends up with the messages that caused them. """
+
+    def __init__(self, standin: StandIn, events: List[dict]):
+        self.standin = standin
+        self.events = events
+
+        # The bot's view of the emojis, to work out what it should send
+        self.index = EmojiIndex()
+        self.index.build(standin.guilds)
+
+        # Channel ID -> [(expected content, sent at)], oldest first
+        self._pending: Dict[int, List[Tuple[str, float]]] = {}
+        self._latencies: List[float] = []
+        self._mismatched = 0
+        self._unexpected = 0
+
+    def _guild(self, number: int):
+        return self.standin.guilds[(number - 1) % len(self.standin.guilds)]
+
+    @staticmethod
+    def _content(text: str, guild) -> str:
+        """ Give the recording's anonymised emoji names real names from the guild they're replayed in. """
+        if not guild.emojis:
+            return text
+
+        return RESOLVED_NAME.sub(lambda match: ":%s:" % guild.emojis[int(match.group(1)) % len(guild.emojis)].name, text)
+
+    def _webhook(self, channel_id: int, content: str, when: float) -> None:
+        pending = self._pending.get(channel_id)
+
+        if not pending:
+            self._unexpected += 1
+            return
+
+        for i, (expected, sent_at) in enumerate(pending):
+            if expected == content:
+                break
+        else:
+            i = 0
+            self._mismatched += 1
+
+        expected, sent_at = pending.pop(i)
+        self._latencies.append(when - sent_at)
+
+    async def run(self, speed: float, drain: float) -> dict:
+        """
+        Replay every event at a speed, then wait for the bot to catch up.
+
+        :param speed: How many times faster than recorded.
+        :param drain: The most seconds to wait for outstanding replies after the last event.
+        :return: What happened.
+        """
+        standin = self.standin
+        self._pending = {}
+        self._latencies = []
+        self._mismatched = self._unexpected = 0
+
+        requests, rate_limited = sum(standin.requests.values()), standin.rate_limited
+        message_ids: Dict[int, int] = {}
+        sent = expected = gateway_dropped = skipped = 0
+        behind = 0.0
+
+        standin.on_webhook = self._webhook
+        started = monotonic()
+
+        for event in self.events:
+            delay = started + event["t"] / speed - monotonic()
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                behind = max(behind, -delay)
+
+            if event.get("guild") is None:
+                skipped += 1  # DMs
+                continue
+
+            guild = self._guild(event["guild"])
+            channel_id = guild.id + 1
+            name = event["event"]
+
+            if name == "MESSAGE_CREATE":
+                message_id = message_ids[event["message"]] = standin.next_id()
+                author = user_payload(USER_IDS + event["author"], event.get("bot", False))
+                content = self._content(event["content"], guild)
+                data = message_payload(message_id, channel_id, guild.id, author, content)
+
+                reply = None if event.get("bot") else self.index.replace_names(content, guild.id)
+            else:
+                # Reactions to replayed messages go to their replay; others were to the bot's own messages
+                message_id = message_ids.get(event["message"]) or standin.bot_messages.get(channel_id)
+
+                if message_id is None:
+                    skipped += 1
+                    continue
+
+                emoji = {"id": None, "name": event["emoji"]}
+
+                if event["emoji"] is None:
+                    if not guild.emojis:
+                        skipped += 1
+                        continue
+
+                    custom = guild.emojis[event["message"] % len(guild.emojis)]
+                    emoji = {"id": str(custom.id), "name": custom.name}
+
+                user_id = USER_IDS + event["user"]
+                data = {
+                    "user_id": str(user_id),
+                    "channel_id": str(channel_id),
+                    "message_id": str(message_id),
+                    "guild_id": str(guild.id),
+                    "emoji": emoji,
+                }
+
+                if name == "MESSAGE_REACTION_ADD":
+                    data["member"] = {
+                        "user": user_payload(user_id), "roles": [], "joined_at": now_iso(), "deaf": False,
+                        "mute": False,
+                    }
+
+                reply = None
+
+            sent_at = monotonic()
+
+            if not await standin.dispatch(guild.id, name, data):
+                gateway_dropped += 1
+                continue
+
+            sent += 1
+
+            if reply is not None:
+                expected += 1
+                self._pending.setdefault(channel_id, []).append((reply, sent_at))
+
+        replayed_in = monotonic() - started
+
+        # Wait for the stragglers
+        deadline = monotonic() + drain
+
+        while any(self._pending.values()) and monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        standin.on_webhook = None
+        latencies = sorted(self._latencies)
+
+        return {
+            "speed": speed,
+            "events": sent,
+            "events_per_sec": sent / replayed_in if replayed_in else 0.0,
+            "behind_ms": behind * 1000,
+            "expected": expected,
+            "replied": len(latencies),
+            "dropped": sum(len(pending) for pending in self._pending.values()),
+            "gateway_dropped": gateway_dropped,
+            "skipped": skipped,
+            "mismatched": self._mismatched,
+            "unexpected": self._unexpected,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p90_ms": percentile(latencies, 0.90) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+            "requests": sum(standin.requests.values()) - requests,
+            "rate_limited": standin.rate_limited - rate_limited,
+        }
+
+
+async def wait_until_ready(url: str, timeout: float) -> bool:
+    """ Poll a /healthz URL until it says the bot is ready. """
+    deadline = monotonic() + timeout
+
+    async with ClientSession(timeout=ClientTimeout(total=2)) as session:
+        while monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return True
+            except (ClientError, asyncio.TimeoutError):
+                pass
+
+            await asyncio.sleep(0.5)
+
+    return False
+
+
+async def run(args) -> int:
+    if args.recording:
+        events = load_recording(args.recording)
+    else:
+        events = synthetic_recording(args.messages, args.rate, args.guilds, args.users, args.seed)
+
+    standin = StandIn(args.host, args.port, args.shards, args.guilds, args.emojis, args.seed,
+                      args.latency / 1000, args.jitter / 1000, args.rate_limit, args.retry_after)
+    runner = await standin.serve()
+    process = None
+
+    try:
+        if not args.no_launch:
+            env = dict(os.environ, DISCORD_API_BASE="http://%s:%d/api/v7" % (args.host, args.port))
+            env.setdefault("bottoken", "standin")
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "bot", "--port", str(args.bot_port), env=env)
+
+        log.info("Waiting for the bot to be ready...")
+
+        if not await wait_until_ready("http://127.0.0.1:%d/healthz" % args.bot_port, args.startup_timeout):
+            log.error("The bot wasn't ready after %.0fs.", args.startup_timeout)
+            return 1
+
+        replay = Replay(standin, events)
+        duration = events[-1]["t"] if events else 0.0
+
+        print("Replaying %d events (%.1fs as recorded) into %d guilds on %d shards" % (
+            len(events), duration, len(standin.guilds), standin.shard_count))
+        print()
+        print("%6s %7s %9s %10s %8s %8s %8s %8s %8s %8s %8s %6s" % (
+            "speed", "events", "events/s", "behind ms", "expected", "p50 ms", "p90 ms", "p99 ms", "max ms",
+            "dropped", "gw drop", "429s"))
+
+        results = []
+
+        for speed in args.speeds:
+            result = await replay.run(speed, args.drain)
+            results.append(result)
+
+            print("%5gx %7d %9.1f %10.1f %8d %8.1f %8.1f %8.1f %8.1f %8d %8d %6d" % (
+                speed, result["events"], result["events_per_sec"], result["behind_ms"], result["expected"],
+                result["p50_ms"], result["p90_ms"], result["p99_ms"], result["max_ms"], result["dropped"],
+                result["gateway_dropped"], result["rate_limited"]))
+
+        if standin.unhandled:
+            print()
+            print("Requests the stand-in doesn't serve:")
+
+            for route, times in standin.unhandled.most_common():
+                print("  %6d  %s" % (times, route))
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+
+        return 0
+    finally:
+        if process is not None and process.returncode is None:
+            process.terminate()
+            await process.wait()
+
+        await runner.cleanup()
+
+
+def main(argv: List[str] = None) -> int:
+    parser = ArgumentParser(prog="python -m bot.replay", description="Load-test the bot by replaying gateway events.")
+    parser.add_argument("recording", nargs="?", help="Events from python -m bot --record (default: synthetic chat)")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[1.0, 2.0, 4.0, 8.0],
+                        help="Replay at each of these multiples of the recorded speed, in turn")
+    parser.add_argument("--drain", type=float, default=10.0,
+                        help="Seconds to wait for outstanding replies after the last event")
+    parser.add_argument("--messages", type=int, default=5000, help="Synthetic messages, without a recording")
+    parser.add_argument("--rate", type=float, default=20.0, help="Synthetic messages per second, at 1x")
+    parser.add_argument("--users", type=int, default=1000, help="Synthetic users")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765, help="The stand-in's port")
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--emojis", type=int, default=50, help="Emojis per guild")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bot-port", type=int, default=keep_alive.PORT,
+                        help="Where the bot (or cluster supervisor) serves /healthz")
+    parser.add_argument("--no-launch", action="store_true",
+                        help="Don't start the bot; use one already pointed at the stand-in")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--output", metavar="PATH", help="Also save the results as JSON")
+    add_condition_args(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,519 @@
+"""
+A stand-in for Discord's REST API and gateway, for running the bot (or a cluster of it) locally.
+
+    python -m bot.standin --port 8765 --shards 4 --guilds 200 --latency 50 --rate-limit 0.01
+    DISCORD_API_BASE=http://127.0.0.1:8765/api/v7 bottoken=x python -m bot.cluster --workers 2
+
+It serves what the bot uses: the gateway endpoints, the bot's own user, a gateway that identifies shards and sends
+each one its share of fake guilds (from bench/fakes.py), emojis included, and the REST endpoints for messages,
+reactions, webhooks and emojis. REST requests can be slowed down and answered with 429s, to see how the bot copes.
+
+Events can be sent to the bot with StandIn.dispatch; bot/replay.py uses it to replay recorded traffic.
+"""
+import asyncio
+import json
+import logging
+from argparse import ArgumentParser
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import count
+from random import Random
+from time import monotonic
+from typing import *
+
+from aiohttp import WSMsgType, web
+
+from bench.fakes import FakeEmoji, make_guilds
+
+log = logging.getLogger(__name__)
+
+# Gateway opcodes
+DISPATCH, HEARTBEAT, IDENTIFY, RESUME, INVALID_SESSION, HELLO, HEARTBEAT_ACK = 0, 1, 2, 6, 9, 10, 11
+
+HEARTBEAT_INTERVAL = 41250  # ms, as Discord sends
+
+# What the bot needs: view channels, send messages, manage messages, embed links, add reactions, external emojis,
+# manage webhooks and manage emojis
+PERMISSIONS = 0x400 | 0x800 | 0x2000 | 0x4000 | 0x40 | 0x40000 | 0x20000000 | 0x40000000
+
+BOT_USER = {
+    "id": "100000000000000000",
+    "username": "Emojis",
+    "discriminator": "0000",
+    "avatar": None,
+    "bot": True,
+    "verified": True,
+    "mfa_enabled": False,
+    "flags": 0,
+}
+
+# REST paths that are never slowed down or rate limited: the bot can't start without them
+SETUP_PATHS = ("/gateway", "/gateway/bot", "/users/@me")
+
+
+def json_response(data: Any, status: int = 200, headers: dict = None) -> web.Response:
+    """ A JSON response. Its content type is exactly "application/json", without a charset, as discord.py expects. """
+    return web.Response(body=json.dumps(data).encode(), status=status,
+                        headers={"Content-Type": "application/json", **(headers or {})})
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def user_payload(user_id: int, bot: bool = False) -> dict:
+    """ A fake user. """
+    return {"id": str(user_id), "username": "user%d" % user_id, "discriminator": "0001", "avatar": None, "bot": bot}
+
+
+def message_payload(message_id: int, channel_id: int, guild_id: Optional[int], author: dict, content: str,
+                    embeds: List[dict] = None) -> dict:
+    """ A message, as MESSAGE_CREATE sends it and the message endpoints return it. """
+    payload = {
+        "id": str(message_id),
+        "channel_id": str(channel_id),
+        "author": author,
+        "content": content,
+        "timestamp": now_iso(),
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": embeds or [],
+        "pinned": False,
+        "type": 0,
+    }
+
+    if guild_id is not None:
+        payload["guild_id"] = str(guild_id)
+        payload["member"] = {"roles": [], "joined_at": now_iso(), "deaf": False, "mute": False}
+
+    return payload
+
+
+def embeds(payload: dict) -> List[dict]:
+    """ The embeds in a message the bot sent: discord.py sends one as "embed". """
+    if payload.get("embed"):
+        return [payload["embed"]]
+
+    return payload.get("embeds") or []
+
+
+def emoji_payload(emoji) -> dict:
+    return {
+        "id": str(emoji.id),
+        "name": emoji.name,
+        "animated": emoji.animated,
+        "available": True,
+        "managed": False,
+        "require_colons": True,
+        "roles": [],
+    }
+
+
+def guild_payload(guild) -> dict:
+    """ A GUILD_CREATE payload for a fake guild, with one text channel and its emojis. """
+    guild_id = str(guild.id)
+
+    return {
+        "id": guild_id,
+        "name": "Guild %d" % (guild.id >> 22),
+        "owner_id": "1",
+        "member_count": 1,
+        "unavailable": False,
+        "large": False,
+        "roles": [{"id": guild_id, "name": "@everyone", "permissions": str(PERMISSIONS), "position": 0}],
+        "channels": [{"id": str(guild.id + 1), "type": 0, "name": "general", "position": 0, "guild_id": guild_id}],
+        "emojis": [emoji_payload(emoji) for emoji in guild.emojis],
+        "members": [{"user": BOT_USER, "roles": [], "joined_at": None, "deaf": False, "mute": False}],
+        "presences": [],
+        "voice_states": [],
+    }
+
+
+class StandIn:
+    """ The stand-in server. Guilds are split between shards the same way Discord does it: (id >> 22) % shards. """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, shards: int = 1, guilds: int = 100,
+                 emojis: int = 50, seed: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 rate_limit: float = 0.0, retry_after: float = 0.1):
+        """
+        :param latency: [Optional] Seconds to wait before answering each REST request.
+        :param jitter: [Optional] Up to this many more seconds, at random.
+        :param rate_limit: [Optional] The fraction of REST requests to answer with a 429.
+        :param retry_after: [Optional] The seconds a 429 asks the bot to wait.
+        """
+        self.host = host
+        self.port = port
+        self.shards = shards
+
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self._rng = Random(seed)
+
+        self.guilds = make_guilds(guilds, emojis, seed)
+
+        # Discord spreads guilds over shards by the timestamp part of their ID
+        for guild in self.guilds:
+            guild.id <<= 22
+
+        self.guilds_by_id = {guild.id: guild for guild in self.guilds}
+
+        self.identified: Dict[int, int] = {}  # Shard ID -> times identified
+        self._sessions = count(1)
+
+        # Shard ID -> how to send it a payload, while it's connected
+        self.connections: Dict[int, Callable] = {}
+        self.shard_count = shards
+
+        # Webhook ID -> (channel ID, token); channel ID -> the newest message the bot sent there
+        self.webhooks: Dict[int, Tuple[int, str]] = {}
+        self.bot_messages: Dict[int, int] = {}
+        self._ids = count(10 ** 18)
+
+        # Called with (channel ID, content, monotonic time) whenever the bot sends on a webhook
+        self.on_webhook: Optional[Callable[[int, str, float], None]] = None
+
+        # Requests served, by route, and how many were answered with a 429
+        self.requests: Counter = Counter()
+        self.rate_limited = 0
+        self.unhandled: Counter = Counter()
+
+    @property
+    def gateway_url(self) -> str:
+        return "ws://%s:%d/gateway" % (self.host, self.port)
+
+    async def get_gateway(self, request):
+        return json_response({"url": self.gateway_url})
+
+    async def get_bot_gateway(self, request):
+        return json_response({
+            "url": self.gateway_url,
+            "shards": self.shards,
+            "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1},
+        })
+
+    async def get_me(self, request):
+        return json_response(BOT_USER)
+
+    async def gateway(self, request):
+        """ One shard's gateway connection. """
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        sequence = count(1)
+
+        async def send(op: int, data: Any = None, event: str = None) -> None:
+            payload = {"op": op, "d": data}
+
+            if op == DISPATCH:
+                payload.update(s=next(sequence), t=event)
+
+            await ws.send_str(json.dumps(payload))
+
+        # Replies can be sent as plain text frames; the client only inflates binary ones
+        await send(HELLO, {"heartbeat_interval": HEARTBEAT_INTERVAL})
+        shard_id = None
+
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+
+                payload = json.loads(message.data)
+                op = payload["op"]
+
+                if op == HEARTBEAT:
+                    await send(HEARTBEAT_ACK)
+                elif op == IDENTIFY:
+                    shard_id, shard_count = payload["d"].get("shard", (0, 1))
+                    await self.identify(send, shard_id, shard_count)
+                elif op == RESUME:
+                    # Sessions aren't kept, so make the shard identify again
+                    await send(INVALID_SESSION, False)
+                # Presence updates and anything else are accepted and ignored
+        finally:
+            if shard_id is not None and self.connections.get(shard_id) is send:
+                del self.connections[shard_id]
+
+        return ws
+
+    async def identify(self, send: Callable, shard_id: int, shard_count: int) -> None:
+        """ Send READY for a shard, then a GUILD_CREATE for each of its guilds. """
+        self.identified[shard_id] = self.identified.get(shard_id, 0) + 1
+        self.connections[shard_id] = send
+        self.shard_count = shard_count
+        guilds = [guild for guild in self.guilds if (guild.id >> 22) % shard_count == shard_id]
+
+        log.info("Shard %d/%d identified; sending %d guilds.", shard_id, shard_count, len(guilds))
+
+        await send(DISPATCH, {
+            "v": 6,
+            "user": BOT_USER,
+            "guilds": [{"id": str(guild.id), "unavailable": True} for guild in guilds],
+            "session_id": "standin-%d" % next(self._sessions),
+            "shard": [shard_id, shard_count],
+            "application": {"id": BOT_USER["id"], "flags": 0},
+        }, "READY")
+
+        for guild in guilds:
+            await send(DISPATCH, guild_payload(guild), "GUILD_CREATE")
+
+    async def dispatch(self, guild_id: int, event: str, data: dict) -> bool:
+        """
+        Send an event to the shard a guild is on.
+
+        :return: False if that shard isn't connected (or the send failed), so the event was dropped.
+        """
+        send = self.connections.get((guild_id >> 22) % self.shard_count)
+
+        if send is None:
+            return False
+
+        try:
+            await send(DISPATCH, data, event)
+        except (ConnectionError, RuntimeError):
+            return False
+
+        return True
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    # REST
+
+    @web.middleware
+    async def conditions(self, request, handler):
+        """ Slow REST requests down and answer some with a 429, as configured. Counts every request by route. """
+        route = request.match_info.route.resource
+        name = "%s %s" % (request.method, route.canonical if route is not None else request.path)
+        self.requests[name] += 1
+
+        if not request.path.startswith("/api/") or request.path.endswith(SETUP_PATHS):
+            return await handler(request)
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.jitter * self._rng.random())
+
+        if self.rate_limit and self._rng.random() < self.rate_limit:
+            self.rate_limited += 1
+
+            # discord.py treats a 429 without a Via header as a Cloudflare ban
+            return json_response(
+                {"message": "You are being rate limited.", "retry_after": self.retry_after, "global": False},
+                status=429,
+                headers={
+                    "Via": "1.1 google",
+                    "Retry-After": str(self.retry_after),
+                    "X-RateLimit-Limit": "5",
+                    "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Reset-After": str(self.retry_after),
+                    "X-RateLimit-Bucket": "standin",
+                },
+            )
+
+        return await handler(request)
+
+    @staticmethod
+    async def payload(request) -> dict:
+        """ A request's JSON body, including the payload_json part of a multipart one (messages with files). """
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            return json.loads(form.get("payload_json") or "{}")
+
+        if not request.can_read_body:
+            return {}
+
+        return await request.json()
+
+    async def create_message(self, request):
+        channel_id = int(request.match_info["channel_id"])
+        payload = await self.payload(request)
+        message_id = self.next_id()
+        self.bot_messages[channel_id] = message_id
+
+        # Every fake guild's one channel has the ID after the guild's
+        return json_response(message_payload(
+            message_id, channel_id, channel_id - 1, BOT_USER, payload.get("content") or "", embeds(payload)))
+
+    async def edit_message(self, request):
+        channel_id = int(request.match_info["channel_id"])
+        payload = await self.payload(request)
+
+        return json_response(message_payload(
+            int(request.match_info["message_id"]), channel_id, channel_id - 1, BOT_USER,
+            payload.get("content") or "", embeds(payload)))
+
+    async def no_content(self, request):
+        """ Deleting messages, adding and removing reactions: accepted, nothing to return. """
+        return web.Response(status=204)
+
+    def _webhook(self, webhook_id: int) -> dict:
+        channel_id, token = self.webhooks[webhook_id]
+
+        return {
+            "id": str(webhook_id),
+            "type": 1,
+            "name": "Emojis",
+            "avatar": None,
+            "channel_id": str(channel_id),
+            "guild_id": str(channel_id - 1),
+            "token": token,
+            "user": BOT_USER,
+        }
+
+    async def get_channel_webhooks(self, request):
+        channel_id = int(request.match_info["channel_id"])
+
+        return json_response([
+            self._webhook(webhook_id)
+            for webhook_id, (channel, token) in self.webhooks.items()
+            if channel == channel_id
+        ])
+
+    async def create_webhook(self, request):
+        webhook_id = self.next_id()
+        self.webhooks[webhook_id] = (int(request.match_info["channel_id"]), "token%d" % webhook_id)
+
+        return json_response(self._webhook(webhook_id))
+
+    async def execute_webhook(self, request):
+        webhook_id = int(request.match_info["webhook_id"])
+
+        if self.webhooks.get(webhook_id, (None, None))[1] != request.match_info["token"]:
+            return json_response({"message": "Unknown Webhook", "code": 10015}, status=404)
+
+        payload = await self.payload(request)
+        channel_id = self.webhooks[webhook_id][0]
+
+        if self.on_webhook is not None:
+            self.on_webhook(channel_id, payload.get("content") or "", monotonic())
+
+        # discord.py sends wait=1 or wait=0
+        if request.query.get("wait", "").lower() in ("1", "true"):
+            return json_response(message_payload(
+                self.next_id(), channel_id, channel_id - 1, user_payload(webhook_id, bot=True),
+                payload.get("content") or ""))
+
+        return web.Response(status=204)
+
+    async def _emojis_changed(self, guild) -> None:
+        await self.dispatch(guild.id, "GUILD_EMOJIS_UPDATE", {
+            "guild_id": str(guild.id),
+            "emojis": [emoji_payload(emoji) for emoji in guild.emojis],
+        })
+
+    async def create_emoji(self, request):
+        guild = self.guilds_by_id.get(int(request.match_info["guild_id"]))
+
+        if guild is None:
+            return json_response({"message": "Unknown Guild", "code": 10004}, status=404)
+
+        payload = await self.payload(request)
+        animated = payload.get("image", "").startswith("data:image/gif")
+        emoji = FakeEmoji(self.next_id(), payload["name"], guild.id, animated)
+        guild.emojis.append(emoji)
+        await self._emojis_changed(guild)
+
+        return json_response(dict(emoji_payload(emoji), user=BOT_USER))
+
+    async def get_emoji(self, request):
+        guild = self.guilds_by_id.get(int(request.match_info["guild_id"]))
+        emoji_id = int(request.match_info["emoji_id"])
+
+        for emoji in guild.emojis if guild is not None else ():
+            if emoji.id == emoji_id:
+                return json_response(dict(emoji_payload(emoji), user=BOT_USER))
+
+        return json_response({"message": "Unknown Emoji", "code": 10014}, status=404)
+
+    async def delete_emoji(self, request):
+        guild = self.guilds_by_id.get(int(request.match_info["guild_id"]))
+        emoji_id = int(request.match_info["emoji_id"])
+
+        if guild is not None:
+            guild.emojis = [emoji for emoji in guild.emojis if emoji.id != emoji_id]
+            await self._emojis_changed(guild)
+
+        return web.Response(status=204)
+
+    async def not_found(self, request):
+        """ Anything the stand-in doesn't serve. Counted, so gaps show up in the report. """
+        self.unhandled["%s %s" % (request.method, request.match_info["path"])] += 1
+
+        return json_response({"message": "404: Not Found", "code": 0}, status=404)
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.conditions])
+        app.router.add_get("/api/{version}/gateway", self.get_gateway)
+        app.router.add_get("/api/{version}/gateway/bot", self.get_bot_gateway)
+        app.router.add_get("/api/{version}/users/@me", self.get_me)
+        app.router.add_get("/gateway", self.gateway)
+
+        channel = "/api/{version}/channels/{channel_id}"
+        message = channel + "/messages/{message_id}"
+        app.router.add_post(channel + "/messages", self.create_message)
+        app.router.add_patch(message, self.edit_message)
+        app.router.add_delete(message, self.no_content)
+        app.router.add_put(message + "/reactions/{emoji}/@me", self.no_content)
+        app.router.add_delete(message + "/reactions/{emoji}/{user_id}", self.no_content)
+        app.router.add_delete(message + "/reactions", self.no_content)
+        app.router.add_get(channel + "/webhooks", self.get_channel_webhooks)
+        app.router.add_post(channel + "/webhooks", self.create_webhook)
+        app.router.add_post("/api/{version}/webhooks/{webhook_id}/{token}", self.execute_webhook)
+
+        guild = "/api/{version}/guilds/{guild_id}"
+        app.router.add_post(guild + "/emojis", self.create_emoji)
+        app.router.add_get(guild + "/emojis/{emoji_id}", self.get_emoji)
+        app.router.add_delete(guild + "/emojis/{emoji_id}", self.delete_emoji)
+
+        app.router.add_route("*", "/api/{version}/{path:.*}", self.not_found)
+
+        return app
+
+    async def serve(self) -> web.AppRunner:
+        """ Start serving. Call cleanup() on the result to stop. """
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+
+        return runner
+
+
+def add_condition_args(parser: ArgumentParser) -> None:
+    """ The options for slowing down and rate limiting the REST API. Shared with bot/replay.py. """
+    parser.add_argument("--latency", type=float, default=0.0, help="Milliseconds to wait before each REST reply")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many more milliseconds, at random")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="The fraction of REST requests to answer with a 429, e.g. 0.01")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Seconds a 429 asks the bot to wait")
+
+
+def main(argv: List[str] = None) -> None:
+    parser = ArgumentParser(prog="python -m bot.standin", description="A local stand-in for Discord's gateway.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--shards", type=int, default=1, help="The shard count to recommend")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--emojis", type=int, default=50, help="Emojis per guild")
+    parser.add_argument("--seed", type=int, default=0)
+    add_condition_args(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    standin = StandIn(args.host, args.port, args.shards, args.guilds, args.emojis, args.seed,
+                      args.latency / 1000, args.jitter / 1000, args.rate_limit, args.retry_after)
+
+    log.info("Serving on http://%s:%d. Run the bot with DISCORD_API_BASE=http://%s:%d/api/v7",
+             args.host, args.port, args.host, args.port)
+
+    web.run_app(standin.app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,106 @@
-from flask import Flask
-from threading import Thread
+import json
+import os
+from time import monotonic
 
-app = Flask('')
+from aiohttp import web
 
-@app.route('/')
-def home():
-    return "I'm alive"
+from src.common.metrics import Metrics
+from src.common.usage import LATENCY_BUCKETS
 
-def run():
-  app.run(host='0.0.0.0',port=5764)
+PORT = int(os.environ.get("PORT", 5764))
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
\ No newline at end of file
+
+def health(bot) -> dict:
+    """ The bot's health: readiness, per-shard gateway latency, event loop lag and time since the last event. """
+    return {
+        "ready": bot.is_ready(),
+        "shards": {
+            str(shard_id): {
+                "latency_ms": round(latency * 1000, 1),
+                "closed": bot.get_shard(shard_id).is_closed(),
+            }
+            for shard_id, latency in bot.latencies
+        },
+        "loop_lag_ms": round(bot.loop_monitor.lag * 1000, 1),
+        "loop_lag_peak_ms": round(bot.loop_monitor.peak * 1000, 1),
+        "since_last_event_s": round(monotonic() - bot.last_event_at, 1),
+        "guilds": len(bot.guilds),
+    }
+
+
+def metrics(bot) -> str:
+    """ The bot's counters and gauges in the Prometheus text format. """
+    m = Metrics()
+
+    m.gauge("emojis_ready", "Whether the bot is ready.", int(bot.is_ready()))
+    m.gauge("emojis_guilds", "Guilds the bot is in.", len(bot.guilds))
+    m.gauge("emojis_shard_latency_seconds", "Gateway heartbeat latency per shard.",
+            (({"shard": shard_id}, latency) for shard_id, latency in bot.latencies))
+    m.gauge("emojis_loop_lag_seconds", "Most recent event loop lag sample.", bot.loop_monitor.lag)
+    m.gauge("emojis_loop_lag_peak_seconds", "Worst event loop lag in the sample window.", bot.loop_monitor.peak)
+    m.gauge("emojis_since_last_event_seconds", "Time since the last gateway event.", monotonic() - bot.last_event_at)
+    m.gauge("emojis_indexed_emojis", "Emojis in the search index.", len(bot.emoji_index))
+    m.counter("emojis_commands_total", "Completed commands since start.",
+              (({"command": cmd}, sum(h)) for cmd, h in bot.usage.all_latency.items()))
+    m.histogram("emojis_command_latency_ms", "Command latency from invoke to completion.",
+                LATENCY_BUCKETS, bot.usage.all_latency, bot.usage.all_latency_sum, "command")
+    m.counter("emojis_webhook_cache_hits_total", "Webhook cache hits.", bot.webhook_cache.hits)
+    m.counter("emojis_webhook_cache_misses_total", "Webhook cache misses.", bot.webhook_cache.misses)
+    m.gauge("emojis_webhooks_cached", "Channels with a cached webhook.", len(bot.webhook_cache))
+    m.counter("emojis_reactions_routed_total", "Reaction events routed to an open session.", bot.reactions.routed)
+    m.counter("emojis_reactions_dropped_total", "Reaction events with no open session.", bot.reactions.dropped)
+    m.gauge("emojis_reaction_sessions", "Messages with an open reaction session.", len(bot.reactions))
+    m.counter("emojis_state_failures_total", "Times the shared state couldn't be reached.", bot.state.failures)
+    m.counter("emojis_image_cache_hits_total", "Image downloads answered from the disk cache.",
+              bot.fetcher.cache.hits)
+    m.counter("emojis_image_cache_misses_total", "Image downloads not in the disk cache.", bot.fetcher.cache.misses)
+    m.counter("emojis_image_cache_evictions_total", "Images evicted from the disk cache.", bot.fetcher.cache.evictions)
+    m.gauge("emojis_image_cache_bytes", "Bytes of images in the disk cache.", bot.fetcher.cache.size)
+    m.counter("emojis_images_prepared_total", "Images prepared for upload, by what it took.", (
+        ({"result": "passed"}, bot.images.passed),
+        ({"result": "normalised"}, bot.images.normalised),
+        ({"result": "failed"}, bot.images.failed),
+    ))
+    m.counter("emojis_pack_emojis_total", "Emojis from ~pack install, by outcome. Skipped ones didn't fit.",
+              (({"outcome": outcome}, count) for outcome, count in bot.pack_installs.items()))
+    m.gauge("emojis_image_hashes", "Emoji images with a perceptual hash.", len(bot.image_hashes))
+    m.gauge("emojis_image_hashes_pending", "Emoji images waiting to be hashed.", bot.image_hashes.pending)
+    m.counter("emojis_image_hash_failures_total", "Emoji images that couldn't be downloaded or read.",
+              bot.image_hashes.failed)
+
+    return m.render()
+
+
+async def keep_alive(bot, host: str = "0.0.0.0", port: int = PORT) -> web.AppRunner:
+    """
+    Serve health checks and metrics from the bot's own event loop.
+
+    :param bot: The bot to report on.
+    :return: The running server. Call cleanup() on it to stop it.
+    """
+
+    async def home(request):
+        return web.Response(text="I'm alive")
+
+    async def healthz(request):
+        body = health(bot)
+
+        return web.Response(
+            text=json.dumps(body),
+            content_type="application/json",
+            status=200 if body["ready"] else 503,
+        )
+
+    async def metrics_(request):
+        return web.Response(text=metrics(bot), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/", home)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics_)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
@@ -1 +1 @@
-(waitress-serve --port=7125 keep_alive:app &) & python -m bot
\ No newline at end of file
+python -m bot
\ No newline at end of file
@@ -0,0 +1,188 @@
+import asyncio
+from random import randrange
+from typing import *
+
+from discord import HTTPException, Message
+from discord.ext.commands import Context
+
+from src.common.common import Colours, CustomEmojis, Embed
+
+PREVIOUS, UPLOAD, NEXT, SHUFFLE = "⬅", "👍", "➡", "🔀"
+NUMBERS = ("1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣")
+
+# The controls that removing a reaction presses too. Uploads and picks only happen on adds, or they'd happen twice.
+NAVIGATION = (PREVIOUS, NEXT, SHUFFLE)
+
+BROWSER_TIMEOUT = 30.0
+
+
+class SessionLimits:
+    """ Cap how many browsers can be open at once, per user and per guild. """
+
+    def __init__(self, per_user: int = 1, per_guild: int = 5):
+        self.per_user = per_user
+        self.per_guild = per_guild
+
+        self._users: Dict[int, int] = {}
+        self._guilds: Dict[int, int] = {}
+
+    def acquire(self, user_id: int, guild_id: int) -> bool:
+        """ Take a slot for a new session. Returns False if the user or guild is at their limit. """
+        if self._users.get(user_id, 0) >= self.per_user or self._guilds.get(guild_id, 0) >= self.per_guild:
+            return False
+
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        self._guilds[guild_id] = self._guilds.get(guild_id, 0) + 1
+
+        return True
+
+    def release(self, user_id: int, guild_id: int) -> None:
+        """ Give a session's slot back. """
+        for counts, key in ((self._users, user_id), (self._guilds, guild_id)):
+            counts[key] -= 1
+
+            if not counts[key]:
+                del counts[key]
+
+
+class SearchBrowser:
+    """
+    An emoji browser driven by reactions, run as a loop rather than recursively.
+
+    Pages are rendered once and reused. Adding or removing a navigation reaction both count as pressing it, so the bot
+    never has to remove the user's reaction before the next press: one page turn is one message edit. Upload and pick
+    reactions only count when they're added.
+    Reactions arrive through the bot's ReactionRouter, which only hands over events for this browser's message.
+    In grid mode, several emojis are shown per page and picked with the number reactions.
+    """
+
+    def __init__(self, ctx: Context, emojis: list, per_page: int = 1, timeout: float = BROWSER_TIMEOUT):
+        self.ctx = ctx
+        self.emojis = emojis
+        self.per_page = max(1, min(per_page, len(NUMBERS)))
+        self.timeout = timeout
+
+        self.page = 0
+        self.page_count = (len(emojis) + self.per_page - 1) // self.per_page
+        self.message: Optional[Message] = None
+
+        self._pages: Dict[int, Embed] = {}
+
+    @property
+    def grid(self) -> bool:
+        return self.per_page > 1
+
+    @property
+    def controls(self) -> Tuple[str, ...]:
+        if self.grid:
+            return (PREVIOUS, NEXT, SHUFFLE) + NUMBERS[:self.per_page]
+
+        return PREVIOUS, UPLOAD, NEXT, SHUFFLE
+
+    def page_emojis(self, page: int) -> list:
+        return self.emojis[page * self.per_page:(page + 1) * self.per_page]
+
+    def render(self, page: int) -> Embed:
+        """ The embed for a page. Built the first time it's shown, then reused. """
+        embed = self._pages.get(page)
+
+        if embed is not None:
+            return embed
+
+        emojis = self.page_emojis(page)
+        author = self.ctx.author
+
+        if self.grid:
+            embed = Embed(
+                title="Page %s / %s" % (page + 1, self.page_count),
+                description="\n".join(
+                    "%s %s `:%s:`" % (NUMBERS[i], emoji, emoji.name) for i, emoji in enumerate(emojis)),
+            )
+        else:
+            embed = Embed(
+                title="Page %s / %s" % (page + 1, self.page_count),
+                description="`:%s:`" % emojis[0].name,
+            ).set_thumbnail(url=emojis[0].url)
+
+        embed.set_author(icon_url=author.avatar_url, name=author.name)
+        self._pages[page] = embed
+
+        return embed
+
+    async def _next_press(self, presses: asyncio.Queue) -> Optional[str]:
+        """
+        Wait for the author to add one of the controls on the browser, or remove a navigation one. Returns None on
+        timeout.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.timeout
+
+        while True:
+            try:
+                payload = await asyncio.wait_for(presses.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                return None
+
+            control = str(payload.emoji)
+
+            if payload.user_id != self.ctx.author.id or control not in self.controls:
+                continue
+
+            if payload.event_type == "REACTION_ADD" or control in NAVIGATION:
+                return control
+
+    async def _handle(self, control: str) -> None:
+        """ Act on a press. Page changes update self.page; uploads happen straight away. """
+        if control == PREVIOUS:
+            self.page = max(0, self.page - 1)
+        elif control == NEXT:
+            self.page = min(self.page_count - 1, self.page + 1)
+        elif control == SHUFFLE:
+            self.page = randrange(self.page_count)
+        elif control == UPLOAD:
+            emoji = self.page_emojis(self.page)[0]
+            await self.ctx.upload_emoji(emoji.name, emoji.url)
+        elif control in NUMBERS:
+            emojis = self.page_emojis(self.page)
+            index = NUMBERS.index(control)
+
+            if index < len(emojis):
+                await self.ctx.upload_emoji(emojis[index].name, emojis[index].url)
+
+    async def run(self) -> None:
+        """ Show the browser and respond to presses until it times out. """
+        router = self.ctx.bot.reactions
+
+        self.message = await self.ctx.send(embed=self.render(self.page))
+        presses = router.register(self.message.id)
+
+        try:
+            for control in self.controls:
+                await self.message.add_reaction(control)
+
+            while True:
+                control = await self._next_press(presses)
+
+                if control is None:
+                    break
+
+                shown = self.page
+
+                try:
+                    await self._handle(control)
+                except Exception as err:
+                    # A failed upload shouldn't end the session
+                    await self.ctx.error(getattr(err, "text", None) or err)
+
+                if self.page != shown:
+                    await self.message.edit(embed=self.render(self.page))
+        finally:
+            router.unregister(self.message.id)
+
+            try:
+                await self.message.edit(embed=Embed(
+                    colour=Colours.error,
+                    description="%s This search timed out." % CustomEmojis.error,
+                ))
+            except HTTPException:
+                pass
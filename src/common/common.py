@@ -1,4 +1,3 @@
-from io import BytesIO
 from typing import *
 
 # import motor.motor_asyncio
@@ -15,13 +14,15 @@ from discord.ext.commands import (
     check,
     guild_only,
 )
-from requests import get
 
 # Prevent IDEs removing these imports -- they see them as not used
 DO_NOT_REMOVE = (Cog, command, has_permissions)
 
 DEFAULT_PREFIX = "~"
 
+# Where emoji.gg serves the files listed in a pack's "emojis"
+PACK_EMOJI_URL = "https://cdn3.emoji.gg/emojis/%s"
+
 # Set up database
 # mg = motor.motor_asyncio.AsyncIOMotorClient("0.0.0.0", 25017)
 # db = mg.emojis_rewrite
@@ -78,8 +79,15 @@ async def check_if_emoji(ctx, query: str) -> Union[PartialEmoji, None]:
 
 
 async def get_emojis_webhook(ctx: Context) -> Webhook:
-    """ Find the Emojis webhook, or create it if it doesn't exist. """
-    webhooks = await ctx.channel.webhooks()
-    emojis_webhook = discord_get(webhooks, name="Emojis")
-
-    return emojis_webhook or await ctx.channel.create_webhook(name="Emojis")
+    """ Find the Emojis webhook, or create it if it doesn't exist. Cached per channel. """
+    return await ctx.bot.webhook_cache.get(ctx.channel)
+
+
+async def send_as_author(ctx: Context, content: str) -> None:
+    """ Disguise as the author and send a message on the Emojis webhook. """
+    await ctx.bot.webhook_cache.send(
+        ctx.channel,
+        content,
+        username=ctx.author.display_name,
+        avatar_url=ctx.author.avatar_url,
+    )
@@ -0,0 +1,186 @@
+from time import monotonic
+from typing import *
+
+
+class Cooldown(NamedTuple):
+    """ A rate limit: `rate` uses per `per` seconds. """
+
+    rate: int
+    per: float
+
+
+def cooldown(rate: int, per: float) -> Callable:
+    """
+    Give a command a per-user cooldown, charged with the global cooldown in one lookup once the command's checks pass
+    (see CustomChecks.command_cooldown). Use instead of discord.py's @cooldown for user buckets.
+
+    :param rate: Uses allowed per window.
+    :param per: The window length, in seconds.
+    """
+
+    def decorator(func):
+        # Works above or below @command
+        target = getattr(func, "callback", func)
+        target.__emojis_cooldown__ = Cooldown(rate, per)
+
+        return func
+
+    return decorator
+
+
+def command_cooldown(command) -> Optional[Cooldown]:
+    """ The cooldown set on a command with @cooldown, if any. """
+    return getattr(command.callback, "__emojis_cooldown__", None)
+
+
+class CooldownStore:
+    """
+    Per-user cooldowns with bounded memory and amortised O(1) expiry.
+
+    Each user has one entry holding all of their windows (the global one and any per-command ones), so a check is a
+    single dict lookup. Entries are filed in a timing wheel by when their last window ends. Every update advances the
+    wheel and drops the entries whose slots have passed, so cleanup is spread evenly instead of scanning everything.
+    If the store is full, the entries closest to expiring are evicted first.
+    """
+
+    def __init__(self, max_entries: int = 200000, resolution: float = 1.0, slots: int = 128,
+                 clock: Callable[[], float] = monotonic):
+        self.max_entries = max_entries
+        self.resolution = resolution
+        self.clock = clock
+
+        # key -> scope -> [window end, uses left]
+        self._entries: Dict[Hashable, Dict[str, List]] = {}
+        # key -> tick at which the entry's last window has ended
+        self._expires: Dict[Hashable, int] = {}
+
+        self._wheel: List[List[Hashable]] = [[] for _ in range(slots)]
+        self._tick = int(clock() / resolution)
+
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def update(self, key: Hashable, scopes: Sequence[Tuple[str, Cooldown]], now: float = None) -> float:
+        """
+        Use one go of every scope, unless any of them is on cooldown.
+
+        :param key: Who is being rate limited (e.g. a user ID).
+        :param scopes: (name, Cooldown) pairs, e.g. the global cooldown and the command's own.
+        :param now: [Optional] The current time, from the store's clock.
+        :return: 0 if allowed, else the seconds until every scope would allow it. Nothing is used up when denied.
+        """
+        if now is None:
+            now = self.clock()
+
+        retry_after = self.check(key, scopes, now)
+
+        if retry_after:
+            return retry_after
+
+        state = self._entries.get(key)
+
+        if state is None:
+            if len(self._entries) >= self.max_entries:
+                self._evict()
+
+            state = self._entries[key] = {}
+
+        ends = now
+
+        for name, limit in scopes:
+            window = state.get(name)
+
+            if window is None or window[0] <= now:
+                window = state[name] = [now + limit.per, limit.rate]
+
+            window[1] -= 1
+            ends = max(ends, window[0])
+
+        # File the entry under when its last window ends (ceil, so it's only dropped once that has passed)
+        tick = -int(-ends // self.resolution)
+
+        if tick > self._expires.get(key, 0):
+            self._expires[key] = tick
+            self._wheel[tick % len(self._wheel)].append(key)
+
+        return 0.0
+
+    def check(self, key: Hashable, scopes: Sequence[Tuple[str, Cooldown]], now: float = None) -> float:
+        """
+        Like update, but without using anything up.
+
+        :return: 0 if allowed, else the seconds until every scope would allow it.
+        """
+        if now is None:
+            now = self.clock()
+
+        self._advance(now)
+
+        state = self._entries.get(key)
+        retry_after = 0.0
+
+        if state is not None:
+            for name, limit in scopes:
+                window = state.get(name)
+
+                if window is not None and window[1] <= 0 and window[0] > now:
+                    retry_after = max(retry_after, window[0] - now)
+
+        return retry_after
+
+    def _advance(self, now: float) -> None:
+        """ Drop every entry whose windows have all ended. """
+        tick = int(now / self.resolution)
+
+        # Visiting every slot once is enough, however long it's been
+        start = max(self._tick + 1, tick - len(self._wheel) + 1)
+
+        for t in range(start, tick + 1):
+            slot = self._wheel[t % len(self._wheel)]
+
+            if not slot:
+                continue
+
+            keep = []
+
+            for key in slot:
+                expires = self._expires.get(key)
+
+                if expires is None:
+                    continue  # Already dropped
+                elif expires <= tick:
+                    del self._entries[key]
+                    del self._expires[key]
+                elif expires % len(self._wheel) == t % len(self._wheel) and expires > t:
+                    keep.append(key)  # Further out than the wheel spans; check again next time round
+                # Otherwise the entry was re-filed under a later slot
+
+            slot[:] = keep
+
+        self._tick = max(self._tick, tick)
+
+    def _evict(self) -> None:
+        """ Drop the entry closest to expiring, to make room. """
+        slots = len(self._wheel)
+
+        for t in range(self._tick, self._tick + slots):
+            slot = self._wheel[t % slots]
+
+            while slot:
+                key = slot.pop()
+                expires = self._expires.get(key)
+
+                # Skip keys that were re-filed under another slot
+                if expires is not None and expires % slots == t % slots:
+                    del self._entries[key]
+                    del self._expires[key]
+                    self.evictions += 1
+                    return
+
+        # Nothing filed (shouldn't happen); drop an arbitrary entry
+        key = next(iter(self._entries))
+        del self._entries[key]
+        self._expires.pop(key, None)
+        self.evictions += 1
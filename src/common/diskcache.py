@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from typing import *
+
+log = logging.getLogger(__name__)
+
+# Discord serves the same emoji under several URLs (?v=1, ?size=..., cdn vs media); the ID and format are what matter
+EMOJI_URL = re.compile(r"^https?://(?:cdn|media)\.discordapp\.(?:com|net)/emojis/(\d+)\.(\w+)")
+
+TEMP_SUFFIX = ".tmp"
+
+
+def cache_key(url: Any) -> str:
+    """ What a download is cached under: the emoji ID and format for Discord emojis, otherwise the URL. """
+    url = str(url)
+    match = EMOJI_URL.match(url)
+
+    if match is not None:
+        return "emoji:%s.%s" % match.groups()
+
+    return url
+
+
+class DiskCache:
+    """
+    Downloaded images, kept on disk under a size cap and evicted least recently used first.
+
+    Files are named by the SHA-256 of their cache key, written to a temporary file and renamed into place, so a reader
+    never sees half a file. Disk I/O runs on a background thread. Each process keeps its own index of the directory,
+    built when it starts; a file another process evicted is just a miss.
+    """
+
+    def __init__(self, directory: str = "./tmp/images", max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param directory: [Optional] Where to keep the files. Created if it doesn't exist.
+        :param max_bytes: [Optional] How much the files may add up to.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        # File name -> size, least recently used first
+        self.files: "OrderedDict[str, int]" = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-cache")
+
+        self._scan()
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def _scan(self) -> None:
+        """ Index what's already on disk, oldest first, and clear out anything left half written. """
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(TEMP_SUFFIX):
+                self._remove(entry.name)
+            elif entry.is_file():
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for mtime, name, size in sorted(found):
+            self.files[name] = size
+            self.size += size
+
+        for name in self._evict():
+            self._remove(name)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _remove(self, name: str) -> None:
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> List[str]:
+        """ Drop the least recently used files from the index until it's under the cap. Returns their names. """
+        evicted = []
+
+        while self.size > self.max_bytes and self.files:
+            name, size = self.files.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            evicted.append(name)
+
+        return evicted
+
+    def _read(self, name: str) -> Optional[bytes]:
+        try:
+            with open(self._path(name), "rb") as f:
+                data = f.read()
+
+            # The modification time is the recency order when the cache is next scanned
+            os.utime(self._path(name))
+        except FileNotFoundError:
+            return None
+
+        return data
+
+    def _write(self, name: str, data: bytes) -> None:
+        temp = self._path("%s.%d%s" % (name, os.getpid(), TEMP_SUFFIX))
+
+        with open(temp, "wb") as f:
+            f.write(data)
+
+        os.replace(temp, self._path(name))
+
+    async def _run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    async def get(self, url: Any) -> Optional[bytes]:
+        """
+        A cached download.
+
+        :param url: The URL (or Asset) it was downloaded from.
+        :return: The bytes, or None if they aren't cached.
+        """
+        name = sha256(cache_key(url).encode()).hexdigest()
+
+        if name not in self.files:
+            self.misses += 1
+            return None
+
+        self.files.move_to_end(name)
+        data = await self._run(self._read, name)
+
+        if data is None:
+            # Evicted by another process
+            self.size -= self.files.pop(name, 0)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return data
+
+    async def put(self, url: Any, data: bytes) -> None:
+        """
+        Cache a download, evicting the least recently used files if that goes over the cap.
+
+        :param url: The URL (or Asset) it was downloaded from.
+        :param data: The bytes.
+        """
+        if len(data) > self.max_bytes:
+            return
+
+        name = sha256(cache_key(url).encode()).hexdigest()
+
+        try:
+            await self._run(self._write, name, data)
+        except OSError:
+            log.exception("Couldn't cache a download.")
+            return
+
+        self.size += len(data) - self.files.pop(name, 0)
+        self.files[name] = len(data)
+
+        for evicted in self._evict():
+            await self._run(self._remove, evicted)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,278 @@
+from heapq import nsmallest
+from random import randrange
+from re import compile as compile_regex
+from typing import *
+
+if TYPE_CHECKING:
+    from discord import Emoji, Guild
+
+# The most results a search returns, unless told otherwise
+SEARCH_LIMIT = 100
+
+GRAM_SIZE = 3
+
+# Either an already-rendered emoji (<:name:id>), which is skipped, or an unparsed :name:
+EMOJI_TOKEN = compile_regex(r"<a?:[a-zA-Z0-9_]+:[0-9]+>|:([a-zA-Z0-9_-]+):")
+
+
+def ngrams(name: str, size: int = GRAM_SIZE) -> Set[str]:
+    """
+    Split a string into its overlapping n-grams.
+
+    :param name: The (lowercase) string to split.
+    :param size: [Optional] The n-gram length.
+    :return: The set of n-grams. Strings shorter than size are returned whole.
+    """
+    if len(name) <= size:
+        return {name}
+
+    return {name[i:i + size] for i in range(len(name) - size + 1)}
+
+
+class EmojiIndex:
+    """
+    An in-memory trigram index over every emoji the bot can see, keyed on emoji name.
+
+    Built once when the bot is ready, then kept up to date per guild from gateway events,
+    so searches never have to scan (and lowercase) the whole emoji cache.
+    """
+
+    def __init__(self):
+        self._emojis: Dict[int, "Emoji"] = {}  # emoji id -> Emoji
+        self._guilds: Dict[int, List[int]] = {}  # guild id -> emoji ids
+        self._guild_names: Dict[int, Dict[str, "Emoji"]] = {}  # guild id -> exact name -> Emoji
+        self._resolved: Dict[str, "Emoji"] = {}  # exact name -> fallback Emoji from any guild
+        self._names: Dict[str, Set[int]] = {}  # lowercase name -> emoji ids
+        self._grams: Dict[str, Set[str]] = {}  # trigram -> lowercase names
+
+        # Flat list of emoji ids for O(1) random picks
+        self._ids: List[int] = []
+        self._positions: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._emojis)
+
+    def build(self, guilds: Iterable["Guild"]) -> None:
+        """ (Re)build the whole index from a list of guilds. """
+        self.__init__()
+
+        for guild in guilds:
+            self.set_guild(guild.id, guild.emojis)
+
+    def set_guild(self, guild_id: int, emojis: Iterable["Emoji"]) -> None:
+        """
+        Replace a guild's emojis in the index.
+
+        :param guild_id: The guild's ID.
+        :param emojis: The guild's current emojis.
+        """
+        self.remove_guild(guild_id)
+
+        ids = []
+        names = {}
+
+        for emoji in emojis:
+            self._add(emoji)
+            ids.append(emoji.id)
+
+            # Like discord.utils.get, the first emoji with a name wins
+            names.setdefault(emoji.name, emoji)
+
+        self._guilds[guild_id] = ids
+        self._guild_names[guild_id] = names
+
+    def remove_guild(self, guild_id: int) -> None:
+        """ Remove a guild's emojis from the index. """
+        self._guild_names.pop(guild_id, None)
+
+        for emoji_id in self._guilds.pop(guild_id, ()):
+            self._remove(emoji_id)
+
+    def _add(self, emoji: "Emoji") -> None:
+        if emoji.id in self._emojis:
+            self._remove(emoji.id)
+
+        name = emoji.name.lower()
+
+        self._emojis[emoji.id] = emoji
+        self._resolved.pop(emoji.name, None)
+        self._positions[emoji.id] = len(self._ids)
+        self._ids.append(emoji.id)
+
+        if name not in self._names:
+            self._names[name] = set()
+
+            for gram in ngrams(name):
+                self._grams.setdefault(gram, set()).add(name)
+
+        self._names[name].add(emoji.id)
+
+    def _remove(self, emoji_id: int) -> None:
+        emoji = self._emojis.pop(emoji_id, None)
+
+        if emoji is None:
+            return
+
+        # Swap the last id into the removed slot to keep the list dense
+        position = self._positions.pop(emoji_id)
+        last = self._ids.pop()
+
+        if last != emoji_id:
+            self._ids[position] = last
+            self._positions[last] = position
+
+        self._resolved.pop(emoji.name, None)
+
+        name = emoji.name.lower()
+        ids = self._names[name]
+        ids.discard(emoji_id)
+
+        if not ids:
+            del self._names[name]
+
+            for gram in ngrams(name):
+                names = self._grams[gram]
+                names.discard(name)
+
+                if not names:
+                    del self._grams[gram]
+
+    def _candidates(self, query: str) -> Iterable[str]:
+        """ Find every indexed name containing the query. """
+        if len(query) < GRAM_SIZE:
+            # Too short to have a trigram, so check each unique name instead
+            return [name for name in self._names if query in name]
+
+        postings = []
+
+        for gram in ngrams(query):
+            names = self._grams.get(gram)
+
+            if not names:
+                return []
+
+            postings.append(names)
+
+        # Intersect from the smallest set up, then verify (trigrams can match out of order)
+        postings.sort(key=len)
+        names = set.intersection(*postings) if len(postings) > 1 else postings[0]
+
+        return [name for name in names if query in name]
+
+    def search(self, query: str, limit: Optional[int] = SEARCH_LIMIT) -> List["Emoji"]:
+        """
+        Find emojis whose names contain a query.
+
+        Results are ranked: exact matches first, then prefix matches, then other substring matches.
+
+        :param query: The search term.
+        :param limit: [Optional] The maximum number of results. None for no limit.
+        :return: The matching emojis.
+        """
+        query = query.lower()
+
+        def rank(name: str) -> tuple:
+            if name == query:
+                position = 0
+            elif name.startswith(query):
+                position = 1
+            else:
+                position = 2
+
+            return position, len(name), name
+
+        names = self._candidates(query)
+
+        # Every name has at least one emoji, so only the top `limit` names are needed
+        if limit is None:
+            names = sorted(names, key=rank)
+        else:
+            names = nsmallest(limit, names, key=rank)
+
+        results = []
+
+        for name in names:
+            results.extend(self._emojis[i] for i in sorted(self._names[name]))
+
+        return results if limit is None else results[:limit]
+
+    def random(self) -> Optional["Emoji"]:
+        """ Pick a random emoji from the index. """
+        if not self._ids:
+            return None
+
+        return self._emojis[self._ids[randrange(len(self._ids))]]
+
+    def resolve(self, name: str, guild_id: int = None) -> Optional["Emoji"]:
+        """
+        Find an emoji by its exact (case-sensitive) name.
+
+        The guild's own emojis are checked first. Otherwise, the oldest (lowest ID) usable emoji with that name
+        from any other guild is used.
+
+        :param name: The emoji name, without colons.
+        :param guild_id: [Optional] The guild to check first.
+        :return: The emoji, or None if nothing matches.
+        """
+        names = self._guild_names.get(guild_id)
+
+        if names:
+            emoji = names.get(name)
+
+            if emoji is not None:
+                return emoji
+
+        emoji = self._resolved.get(name)
+
+        if emoji is None:
+            matches = [
+                self._emojis[i] for i in self._names.get(name.lower(), ())
+                if self._emojis[i].name == name and self._emojis[i].available
+            ]
+
+            if matches:
+                # Cached until an emoji with this name is added or removed
+                emoji = self._resolved[name] = min(matches, key=lambda e: e.id)
+
+        return emoji
+
+    def replace_names(self, content: str, guild_id: int = None) -> Optional[str]:
+        """
+        Replace every unparsed :name: in a message with the emoji it refers to, in one pass.
+
+        Names glued to other text (like "hi:frog:") are found too. Already-rendered emojis are left alone.
+
+        :param content: The message content.
+        :param guild_id: [Optional] The guild the message was sent in. Its emojis are preferred.
+        :return: The new content, or None if nothing was replaced.
+        """
+        if ":" not in content:
+            return None
+
+        parts = []
+        last = position = 0
+
+        while True:
+            match = EMOJI_TOKEN.search(content, position)
+
+            if match is None:
+                break
+
+            name = match.group(1)
+            emoji = self.resolve(name, guild_id) if name else None
+
+            if emoji is None:
+                # The closing colon could open the next :name:
+                position = match.end() - 1 if name else match.end()
+                continue
+
+            parts.append(content[last:match.start()])
+            parts.append(str(emoji))
+            last = position = match.end()
+
+        if not parts:
+            return None
+
+        parts.append(content[last:])
+
+        return "".join(parts)
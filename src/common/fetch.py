@@ -0,0 +1,93 @@
+from asyncio import TimeoutError as TimeoutError_
+from typing import *
+
+import aiohttp
+
+from src.common.diskcache import DiskCache
+
+# Hard cap on how much of a remote image is downloaded. Anything over 256kb is shrunk before uploading.
+MAX_FETCH_BYTES = 8 * 1024 * 1024
+
+CHUNK_SIZE = 16 * 1024
+
+
+class ImageFetcher:
+    """
+    Fetch remote images without blocking the event loop.
+
+    A single aiohttp session (and its connection pool) is shared for the lifetime of the bot.
+    Bodies are streamed and the download is aborted as soon as it goes over the byte cap.
+    With a disk cache, each image is only downloaded once, however many guilds it's uploaded to.
+    """
+
+    def __init__(self, max_bytes: int = MAX_FETCH_BYTES, connections: int = 20, timeout: float = 15.0,
+                 cache: DiskCache = None):
+        self.max_bytes = max_bytes
+        self.connections = connections
+        self.timeout = timeout
+        self.cache = cache
+
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """ The shared session. Created on first use so it binds to the running loop. """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+
+        return self._session
+
+    async def fetch(self, url: Any, max_bytes: int = None, cache: bool = True) -> bytes:
+        """
+        Download an image.
+
+        :param url: The URL (or Asset) to download.
+        :param max_bytes: [Optional] Override the byte cap for this download.
+        :param cache: [Optional] Whether to use the disk cache. Turn off for one-off bulk downloads.
+        :returns: The image bytes.
+        """
+        max_bytes = max_bytes or self.max_bytes
+        cache = self.cache if cache else None
+
+        if cache is not None:
+            data = await cache.get(url)
+
+            if data is not None and len(data) <= max_bytes:
+                return data
+
+        try:
+            async with self.session.get(str(url)) as response:
+                if response.status != 200:
+                    raise Exception("Couldn't fetch image (%s)." % response.status)
+
+                # Don't bother downloading if the server already says it's too big
+                if response.content_length and response.content_length > max_bytes:
+                    raise Exception("That image is too big (max %dkb)." % (max_bytes // 1024))
+
+                data = bytearray()
+
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    data += chunk
+
+                    if len(data) > max_bytes:
+                        raise Exception("That image is too big (max %dkb)." % (max_bytes // 1024))
+        except (aiohttp.ClientError, TimeoutError_) as err:
+            raise Exception("Couldn't fetch image (%s)." % err.__class__.__name__) from err
+
+        data = bytes(data)
+
+        if cache is not None:
+            await cache.put(url, data)
+
+        return data
+
+    async def close(self) -> None:
+        """ Close the shared session. """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,81 @@
+import asyncio
+from hashlib import sha256
+from io import BytesIO
+from typing import *
+
+GRAPH_SIZE = (8, 4)  # Inches, at 100 DPI
+
+
+def render_usage(days: Sequence[str], counts: Sequence[int]) -> bytes:
+    """
+    Draw command usage by day as a PNG. Runs in a worker process, the only place matplotlib is imported.
+
+    :param days: YYYY-MM-DD dates, oldest first.
+    :param counts: Commands used on each day.
+    :return: The PNG bytes.
+    """
+    from datetime import datetime
+
+    # The object-oriented API, so there's no pyplot global state or GUI backend
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=GRAPH_SIZE, dpi=100)
+    FigureCanvasAgg(figure)
+
+    axes = figure.add_subplot()
+    axes.plot([datetime.strptime(day, "%Y-%m-%d") for day in days], counts)
+    axes.set_title("Command usage by day")
+    axes.set_ylim(bottom=0)
+    figure.autofmt_xdate()
+
+    output = BytesIO()
+    figure.savefig(output, format="png")
+
+    return output.getvalue()
+
+
+class UsageGraph:
+    """
+    The command usage graph, rendered in a worker process and cached by a hash of the data it was drawn from.
+
+    Asking for the graph of unchanged data costs a hash and returns the PNG bytes already in memory.
+    """
+
+    def __init__(self, run: Callable[..., Awaitable]):
+        """
+        :param run: Runs a function in a worker process, e.g. ImagePipeline.run.
+        """
+        self.run = run
+
+        self.digest: Optional[str] = None
+        self.png: Optional[bytes] = None
+        self.renders = 0
+
+        self._rendering: Optional[asyncio.Lock] = None
+
+    async def render(self, daily: Sequence[Tuple[str, int]]) -> bytes:
+        """
+        The graph for some data, only redrawn if the data has changed since last time.
+
+        :param daily: (YYYY-MM-DD, uses) pairs, oldest first (see Store.load_daily_usage).
+        :return: The PNG bytes.
+        """
+        digest = sha256(repr([tuple(row) for row in daily]).encode()).hexdigest()
+
+        if digest == self.digest:
+            return self.png
+
+        if self._rendering is None:
+            self._rendering = asyncio.Lock()
+
+        async with self._rendering:
+            # Another caller may have drawn it while this one waited
+            if digest != self.digest:
+                days, counts = zip(*daily) if daily else ((), ())
+
+                self.png = await self.run(render_usage, days, counts)
+                self.digest = digest
+                self.renders += 1
+
+        return self.png
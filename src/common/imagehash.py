@@ -0,0 +1,408 @@
+import asyncio
+import logging
+from collections import deque
+from functools import lru_cache
+from itertools import combinations
+from typing import *
+
+from src.common.common import PACK_EMOJI_URL
+from src.common.images import open_image
+
+log = logging.getLogger(__name__)
+
+HASH_SIZE = 8  # 8x8 gradient bits: a 64-bit hash
+CHUNKS, CHUNK_BITS = 4, 16  # How MultiIndexHashTable splits hashes up
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+DUPLICATE_DISTANCE = 4  # Hashes this close are the same picture, give or take scaling and compression
+SIMILAR_DISTANCE = 10  # Hashes this close look alike
+
+EMOJI_URL = "https://cdn.discordapp.com/emojis/%d.%s"
+
+# Guild emojis are keyed by ID, pack emojis by file name
+Key = Union[int, str]
+
+try:
+    popcount = int.bit_count  # Python 3.10+
+except AttributeError:
+    def popcount(value: int) -> int:
+        return bin(value).count("1")
+
+
+class DuplicateEmoji(Exception):
+    """ The guild already has an emoji with the same picture. """
+
+
+def hamming(a: int, b: int) -> int:
+    """ How many bits two hashes differ by. """
+    return popcount(a ^ b)
+
+
+def hash_images(images: Sequence[bytes]) -> List[Optional[int]]:
+    """
+    Difference-hash (dHash) a batch of images. Runs in a worker process, where Pillow and NumPy are imported.
+
+    Each image is flattened onto white (emojis are mostly transparent), greyed and shrunk to 9x8; the hash is whether
+    each pixel is brighter than its left neighbour. The comparisons and bit packing are done for the whole batch at
+    once.
+
+    :param images: Image bytes.
+    :return: A 64-bit hash per image, or None for images that couldn't be read.
+    """
+    import numpy as np
+    from PIL import Image
+
+    pixels = np.zeros((len(images), HASH_SIZE, HASH_SIZE + 1), dtype=np.float32)
+    readable = [False] * len(images)
+
+    for i, data in enumerate(images):
+        try:
+            image = open_image(data).convert("RGBA")  # The first frame, for animated images
+            image = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image)
+            image = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+        except Exception:
+            continue
+
+        pixels[i] = np.asarray(image, dtype=np.float32)
+        readable[i] = True
+
+    bits = pixels[:, :, 1:] > pixels[:, :, :-1]
+    hashes = np.packbits(bits.reshape(len(images), -1), axis=1).view(">u8").ravel()
+
+    return [int(value) if ok else None for value, ok in zip(hashes, readable)]
+
+
+@lru_cache()
+def flip_masks(bits: int, width: int = CHUNK_BITS) -> Tuple[int, ...]:
+    """ Every width-bit mask with at most `bits` bits set, fewest first. """
+    return tuple(
+        sum(1 << position for position in positions)
+        for count in range(bits + 1)
+        for positions in combinations(range(width), count)
+    )
+
+
+class MultiIndexHashTable:
+    """
+    A multi-index hash table of 64-bit hashes, for finding every hash within a Hamming distance of another without
+    comparing them all.
+
+    Hashes are split into four 16-bit chunks, with a table per chunk. If two hashes are within r bits of each other, at
+    least one of their chunks is within r // 4 bits, so a search only looks up the chunk values that close to the
+    query's in each table, then checks each candidate's full distance.
+    """
+
+    def __init__(self):
+        # Chunk value -> values whose hash has it, one table per chunk
+        self.tables: List[Dict[int, Set[Any]]] = [{} for _ in range(CHUNKS)]
+        self.hashes: Dict[Any, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @staticmethod
+    def chunks(value_hash: int) -> List[int]:
+        return [(value_hash >> (CHUNK_BITS * i)) & CHUNK_MASK for i in range(CHUNKS)]
+
+    def add(self, value_hash: int, value: Any) -> None:
+        if value in self.hashes:
+            self.remove(value)
+
+        self.hashes[value] = value_hash
+
+        for table, chunk in zip(self.tables, self.chunks(value_hash)):
+            bucket = table.get(chunk)
+
+            if bucket is None:
+                bucket = table[chunk] = set()
+
+            bucket.add(value)
+
+    def remove(self, value: Any) -> None:
+        value_hash = self.hashes.pop(value, None)
+
+        if value_hash is None:
+            return
+
+        for table, chunk in zip(self.tables, self.chunks(value_hash)):
+            bucket = table[chunk]
+            bucket.discard(value)
+
+            if not bucket:
+                del table[chunk]
+
+    def search(self, value_hash: int, radius: int) -> List[Tuple[int, Any]]:
+        """ Every (distance, value) within radius bits of a hash, in no particular order. """
+        masks = flip_masks(radius // CHUNKS)
+        hashes = self.hashes
+        seen = set()
+        results = []
+
+        for table, chunk in zip(self.tables, self.chunks(value_hash)):
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+
+                if not bucket:
+                    continue
+
+                for value in bucket:
+                    if value not in seen:
+                        seen.add(value)
+                        distance = popcount(value_hash ^ hashes[value])
+
+                        if distance <= radius:
+                            results.append((distance, value))
+
+        return results
+
+
+class ImageHashIndex:
+    """
+    Perceptual hashes of every emoji the bot can see and every pack emoji, for spotting duplicates and look-alikes.
+
+    Images are hashed in the background, a batch at a time in the image workers, and the hashes are kept in the store,
+    so each image is only downloaded and hashed once. Emojis are immutable, so a hash never goes stale.
+    """
+
+    def __init__(self, store, fetcher, images, batch: int = 64, downloads: int = 4):
+        self.store = store
+        self.fetcher = fetcher
+        self.images = images
+        self.batch = batch
+
+        self.table = MultiIndexHashTable()
+        self.hashes: Dict[Key, int] = {}
+
+        # What's being indexed: emoji ID -> (guild ID, name, animated), guild ID -> emoji IDs, pack file -> pack index
+        self.emojis: Dict[int, Tuple[int, str, bool]] = {}
+        self.guilds: Dict[int, Set[int]] = {}
+        self.pack_files: Dict[str, int] = {}
+
+        self.hashed = 0
+        self.failed = 0
+
+        self._loaded = False
+        self._urgent: Deque[Key] = deque()
+        self._backlog: Deque[Key] = deque()
+        self._queued: Set[Key] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._downloads = asyncio.Semaphore(downloads)
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @property
+    def pending(self) -> int:
+        """ Images waiting to be hashed. """
+        return len(self._queued)
+
+    async def start(self) -> None:
+        """ Load the stored hashes and start hashing whatever is missing. """
+        for key, value_hash in (await self.store.load_image_hashes()).items():
+            self.hashes[int(key) if key.isdigit() else key] = value_hash
+
+        self._loaded = True
+
+        for key in (*self.emojis, *self.pack_files):
+            self._track(key)
+
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _track(self, key: Key) -> None:
+        """ Put something that just started being indexed in the table, or queue it to be hashed. """
+        if not self._loaded:
+            return  # start() does it
+
+        value_hash = self.hashes.get(key)
+
+        if value_hash is not None:
+            self.table.add(value_hash, key)
+        elif key not in self._queued:
+            self._queued.add(key)
+            self._backlog.append(key)
+
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def _untrack(self, key: Key) -> None:
+        self.table.remove(key)
+
+    def set_guild(self, guild_id: int, emojis: Iterable) -> None:
+        """ Index (or re-index) a guild's emojis, e.g. when it becomes available or its emojis change. """
+        old = self.guilds.get(guild_id, set())
+        new = set()
+
+        for emoji in emojis:
+            new.add(emoji.id)
+            self.emojis[emoji.id] = (guild_id, emoji.name, emoji.animated)
+
+        for emoji_id in old - new:
+            self._untrack(emoji_id)
+            del self.emojis[emoji_id]
+
+        for emoji_id in new - old:
+            self._track(emoji_id)
+
+        self.guilds[guild_id] = new
+
+    def remove_guild(self, guild_id: int) -> None:
+        self.set_guild(guild_id, ())
+        self.guilds.pop(guild_id, None)
+
+    def set_packs(self, packs: Iterable[dict]) -> None:
+        """ Index every emoji in the pack catalogue. """
+        for index, pack in enumerate(packs):
+            for file_name in pack["emojis"]:
+                if file_name not in self.pack_files:
+                    self.pack_files[file_name] = index
+                    self._track(file_name)
+
+    def add_emoji(self, guild_id: int, emoji, value_hash: Optional[int]) -> None:
+        """ Index an emoji the bot has just uploaded, whose hash is already known. """
+        if value_hash is not None and emoji.id not in self.hashes:
+            self.hashes[emoji.id] = value_hash
+            asyncio.ensure_future(self._save({emoji.id: value_hash}))
+
+        # on_guild_emojis_update will re-index the guild too, and find it already there
+        if emoji.id not in self.emojis:
+            self.emojis[emoji.id] = (guild_id, emoji.name, emoji.animated)
+            self.guilds.setdefault(guild_id, set()).add(emoji.id)
+            self._track(emoji.id)
+
+    def prioritise(self, guild_id: int) -> None:
+        """ Hash a guild's emojis next, e.g. because it's about to be checked for duplicates. """
+        for emoji_id in self.guilds.get(guild_id, ()):
+            if emoji_id in self._queued:
+                self._urgent.append(emoji_id)
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def hash_image(self, data: bytes) -> Optional[int]:
+        """ Hash one image, in a worker. None if it couldn't be read. """
+        try:
+            return (await self.images.run(hash_images, [data]))[0]
+        except Exception:
+            log.exception("Couldn't hash an image.")
+            return None
+
+    def duplicate(self, guild_id: int, value_hash: Optional[int], distance: int = DUPLICATE_DISTANCE) -> Optional[int]:
+        """
+        Find an emoji in a guild that's the same picture as a hash.
+
+        :return: The closest emoji's ID, or None if there isn't one.
+        """
+        if value_hash is None:
+            return None
+
+        best, best_distance = None, distance + 1
+
+        for emoji_id in self.guilds.get(guild_id, ()):
+            emoji_hash = self.hashes.get(emoji_id)
+
+            if emoji_hash is not None:
+                d = hamming(value_hash, emoji_hash)
+
+                if d < best_distance:
+                    best, best_distance = emoji_id, d
+
+        return best
+
+    def similar(self, value_hash: int, radius: int = SIMILAR_DISTANCE, limit: int = 10,
+                exclude: Key = None) -> List[Tuple[int, Key]]:
+        """
+        Find guild and pack emojis that look like a hash, closest first.
+
+        :return: Up to limit (distance, key) pairs: an emoji ID for guild emojis, a file name for pack emojis.
+        """
+        matches = sorted(
+            (match for match in self.table.search(value_hash, radius) if match[1] != exclude),
+            # Emoji IDs and file names don't compare, so break ties as text
+            key=lambda match: (match[0], str(match[1])),
+        )
+
+        return matches[:limit]
+
+    def url(self, key: Key) -> str:
+        """ Where to download an indexed image from. """
+        if isinstance(key, int):
+            return EMOJI_URL % (key, "gif" if self.emojis[key][2] else "png")
+
+        return PACK_EMOJI_URL % key
+
+    def _next_batch(self) -> List[Key]:
+        """ Take up to a batch of keys to hash, urgent ones first, skipping anything no longer indexed. """
+        keys = []
+
+        for queue in (self._urgent, self._backlog):
+            while queue and len(keys) < self.batch:
+                key = queue.popleft()
+
+                if key in self._queued and key not in keys:
+                    keys.append(key)
+
+        return keys
+
+    async def _download(self, key: Key) -> Optional[bytes]:
+        if key not in self.emojis and key not in self.pack_files:
+            return None  # Deleted while it was waiting
+
+        async with self._downloads:
+            try:
+                # Most of these are never uploaded; keep them from pushing popular images out of the cache
+                return await self.fetcher.fetch(self.url(key), cache=False)
+            except Exception:
+                return None
+
+    async def _run(self) -> None:
+        while True:
+            keys = self._next_batch()
+
+            if not keys:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            images = await asyncio.gather(*(self._download(key) for key in keys))
+            found = [(key, data) for key, data in zip(keys, images) if data is not None]
+
+            try:
+                hashes = await self.images.run(hash_images, [data for key, data in found]) if found else []
+            except Exception:
+                log.exception("Couldn't hash a batch of images.")
+                hashes = [None] * len(found)
+
+            new = {}
+
+            for (key, data), value_hash in zip(found, hashes):
+                if value_hash is not None:
+                    new[key] = value_hash
+
+            self.hashed += len(new)
+            self.failed += len(keys) - len(new)
+
+            for key in keys:
+                self._queued.discard(key)
+
+                if key in new:
+                    self.hashes[key] = new[key]
+
+                    if key in self.emojis or key in self.pack_files:
+                        self.table.add(new[key], key)
+
+            if new:
+                await self._save(new)
+
+    async def _save(self, hashes: Dict[Key, int]) -> None:
+        try:
+            await self.store.add_image_hashes({str(key): value for key, value in hashes.items()})
+        except Exception:
+            log.exception("Couldn't save image hashes.")
+
@@ -0,0 +1,277 @@
+import asyncio
+from collections import deque
+from io import BytesIO
+from logging import getLogger
+from time import process_time
+from typing import *
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+log = getLogger(__name__)
+
+# Discord rejects emojis over 256kb
+EMOJI_MAX_BYTES = 256 * 1024
+
+# Discord displays emojis at up to 128x128
+EMOJI_SIZE = 128
+
+# Seconds of CPU time a single job may use
+CPU_BUDGET = 10.0
+
+# Refuse to decode anything bigger than this (decompression bombs)
+MAX_PIXELS = 4096 * 4096
+
+# Formats Discord accepts as-is for emojis
+PASSTHROUGH_FORMATS = ("png", "jpeg", "gif")
+
+
+def sniff(data: bytes) -> Optional[str]:
+    """
+    Work out an image's format from its magic bytes.
+
+    :param data: The image bytes.
+    :return: "png", "jpeg", "gif" or "webp", or None if it isn't a supported image.
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    elif data[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    elif data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+
+    return None
+
+
+def open_image(data: bytes):
+    """ Open an image with Pillow, refusing anything too large to decode safely. """
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+    try:
+        image = Image.open(BytesIO(data))
+    except Exception:
+        raise Exception("That doesn't look like a valid image.")
+
+    return image
+
+
+class TranscodeStats(NamedTuple):
+    """ What a normalisation job did. """
+
+    input_size: int
+    output_size: int
+    frames_in: int
+    frames_kept: int
+    milliseconds: float
+
+
+def normalise(data: bytes, max_bytes: int = EMOJI_MAX_BYTES, budget: float = CPU_BUDGET) -> Tuple[bytes, TranscodeStats]:
+    """
+    Fit an image under the emoji size limit. Runs in a worker process.
+
+    :param data: The source image bytes.
+    :param max_bytes: [Optional] The size the result must fit under.
+    :param budget: [Optional] Seconds of CPU time the job may use before giving up.
+    :return: The new image bytes (PNG or GIF) and stats on the job.
+    """
+    started = process_time()
+    image = open_image(data)
+
+    if getattr(image, "is_animated", False):
+        output, frames_in, frames_kept = normalise_animated(image, max_bytes, started + budget)
+    else:
+        output, frames_in, frames_kept = normalise_static(image, max_bytes), 1, 1
+
+    return output, TranscodeStats(
+        input_size=len(data),
+        output_size=len(output),
+        frames_in=frames_in,
+        frames_kept=frames_kept,
+        milliseconds=(process_time() - started) * 1000,
+    )
+
+
+def normalise_static(image, max_bytes: int) -> bytes:
+    """
+    Fit a static image under the size limit.
+
+    Metadata is stripped, the image is downsized to fit 128x128 and re-encoded as PNG. If that's still too big, the
+    palette is reduced, then the image is shrunk further, until it fits.
+    """
+    from PIL import Image
+
+    # Let JPEG decode at a reduced scale instead of decoding the full image and then resizing
+    image.draft("RGB", (EMOJI_SIZE, EMOJI_SIZE))
+
+    # Copying the pixels into a fresh image drops EXIF, ICC profiles and text chunks
+    mode = "RGBA" if image.mode in ("RGBA", "LA", "P", "PA") else "RGB"
+    image = image.convert(mode)
+
+    for size in (EMOJI_SIZE, 96, 64, 48, 32):
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+
+        for colours in (None, 256, 64):
+            frame = resized if colours is None else resized.quantize(colours, method=Image.FASTOCTREE)
+
+            output = BytesIO()
+            frame.save(output, format="PNG", optimize=True)
+
+            if output.tell() <= max_bytes:
+                return output.getvalue()
+
+    raise Exception("Couldn't shrink that image under %dkb." % (max_bytes // 1024))
+
+
+def normalise_animated(image, max_bytes: int, deadline: float) -> Tuple[bytes, int, int]:
+    """
+    Fit an animated GIF/WEBP under the size limit, re-encoded as GIF.
+
+    Each attempt drops frames, reduces the palette or shrinks the frames further. Dropped frames' durations are added
+    to the frame before them, so the animation still loops at the same speed.
+
+    :param image: The opened animation.
+    :param max_bytes: The size the result must fit under.
+    :param deadline: The process_time() at which to give up.
+    :return: The GIF bytes, the number of source frames and the number of frames kept.
+    """
+    from PIL import Image, ImageSequence
+
+    def check_budget() -> None:
+        if process_time() > deadline:
+            raise Exception("That animation is too complex to shrink under %dkb." % (max_bytes // 1024))
+
+    loop = image.info.get("loop", 0)
+    frames = []
+    durations = []
+
+    # Decode and downsize every frame once, up front
+    for frame in ImageSequence.Iterator(image):
+        check_budget()
+
+        frame = frame.convert("RGBA")
+        frame.thumbnail((EMOJI_SIZE, EMOJI_SIZE), Image.LANCZOS)
+
+        frames.append(frame)
+        durations.append(frame.info.get("duration") or image.info.get("duration") or 100)
+
+    for size in (EMOJI_SIZE, 96, 64):
+        for step in (1, 2, 3, 4):
+            for colours in (256, 128, 64, 32):
+                check_budget()
+
+                kept = []
+                kept_durations = []
+
+                for i in range(0, len(frames), step):
+                    frame = frames[i]
+
+                    if size != EMOJI_SIZE:
+                        frame = frame.copy()
+                        frame.thumbnail((size, size), Image.LANCZOS)
+
+                    kept.append(frame.quantize(colours, method=Image.FASTOCTREE))
+                    kept_durations.append(sum(durations[i:i + step]))
+
+                output = BytesIO()
+                kept[0].save(
+                    output,
+                    format="GIF",
+                    save_all=True,
+                    append_images=kept[1:],
+                    duration=kept_durations,
+                    loop=loop,
+                    disposal=2,
+                    optimize=True,
+                )
+
+                if output.tell() <= max_bytes:
+                    return output.getvalue(), len(frames), len(kept)
+
+    raise Exception("Couldn't shrink that animation under %dkb." % (max_bytes // 1024))
+
+
+class ImagePipeline:
+    """
+    Normalise images for upload in a bounded process pool.
+
+    Decoding, resizing and re-encoding happen in worker processes (the only place Pillow is imported), so a big
+    image never stalls the gateway loop. Each job has a CPU time budget, so one huge GIF can't hog a worker.
+    Images Discord can already take are passed straight through.
+    At most `workers * 2` jobs are in flight, so a burst of uploads can't pile up unbounded work.
+    """
+
+    def __init__(self, workers: int = 2, max_bytes: int = EMOJI_MAX_BYTES, budget: float = CPU_BUDGET):
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.budget = budget
+
+        # Stats for the most recent jobs
+        self.stats: Deque[TranscodeStats] = deque(maxlen=100)
+
+        # Images passed straight through, normalised, and that couldn't be normalised
+        self.passed = 0
+        self.normalised = 0
+        self.failed = 0
+
+        self._executor: Optional["ProcessPoolExecutor"] = None
+        self._slots = asyncio.Semaphore(workers * 2)
+
+    @property
+    def executor(self) -> "ProcessPoolExecutor":
+        """ The worker pool. Started on first use; spawned, so workers don't inherit the bot's sockets. """
+        if self._executor is None:
+            # Imported here, so startup doesn't pay for multiprocessing until an image needs work
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+        return self._executor
+
+    async def run(self, func: Callable, *args) -> Any:
+        """ Run a function in the pool, waiting for a free slot first. """
+        async with self._slots:
+            return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    async def prepare(self, data: bytes) -> bytes:
+        """
+        Get image bytes ready to upload as an emoji.
+
+        :param data: The downloaded image.
+        :return: Image bytes under the size limit, in a format Discord accepts.
+        """
+        kind = sniff(data)
+
+        if kind is None:
+            raise Exception("That doesn't look like an image (PNG, JPEG, GIF or WEBP).")
+
+        if kind in PASSTHROUGH_FORMATS and len(data) <= self.max_bytes:
+            self.passed += 1
+            return data
+
+        try:
+            output, stats = await self.run(normalise, data, self.max_bytes, self.budget)
+        except Exception:
+            self.failed += 1
+            raise
+
+        self.normalised += 1
+        self.stats.append(stats)
+        log.info("Normalised image: %d -> %d bytes, %d of %d frames kept, %.1fms",
+                 stats.input_size, stats.output_size, stats.frames_kept, stats.frames_in, stats.milliseconds)
+
+        return output
+
+    def close(self) -> None:
+        """ Shut the worker pool down. """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
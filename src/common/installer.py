@@ -0,0 +1,183 @@
+import asyncio
+from re import sub
+from time import monotonic
+from typing import *
+
+from discord import HTTPException, Message
+from discord.ext.commands import Context
+
+from src.common.common import PACK_EMOJI_URL, Colours, CustomEmojis, Embed
+from src.common.imagehash import DuplicateEmoji
+
+# Discord's error code for a guild with no emoji slots left
+MAX_EMOJIS_REACHED = 30008
+
+
+def emoji_name_from_file(file_name: str) -> str:
+    """
+    Turn an emoji.gg file name into an emoji name, e.g. "3415-vibing-frog.gif" -> "vibing_frog".
+
+    :param file_name: The file name from the pack.
+    :return: A valid emoji name.
+    """
+    name = file_name.rsplit(".", 1)[0]
+
+    # Drop the numeric ID prefix
+    name = sub(r"^[0-9]+[-_]", "", name)
+    name = sub(r"[^a-zA-Z0-9_]", "_", name).strip("_")
+
+    return (name or "emoji")[:32].ljust(2, "_")
+
+
+class PackInstaller:
+    """
+    Install a list of emojis into a guild.
+
+    Downloads (and image preparation) run concurrently, bounded by a semaphore, on the bot's shared session. Finished
+    downloads are queued for a single uploader, which goes one emoji at a time so discord.py's rate limit handling
+    paces it. Only as many static and animated emojis as the guild has free slots for are fetched at all.
+    Progress is shown by editing one message, at most once every few seconds.
+    """
+
+    def __init__(self, ctx: Context, title: str, files: List[str], downloads: int = 8, edit_every: float = 3.0):
+        self.ctx = ctx
+        self.title = title
+        self.files = files
+        self.edit_every = edit_every
+
+        self.uploaded = []
+        self.failed = []
+        self.skipped = []
+        self.duplicates = []
+
+        self._downloads = asyncio.Semaphore(downloads)
+        self._queue = asyncio.Queue()
+        self._message: Optional[Message] = None
+        self._last_edit = 0.0
+        self._full = False
+
+    def _fits(self) -> List[str]:
+        """ Split the files into static and animated, and keep only as many as the guild has slots for. """
+        guild = self.ctx.guild
+        free = {
+            False: guild.emoji_limit - sum(1 for e in guild.emojis if not e.animated),
+            True: guild.emoji_limit - sum(1 for e in guild.emojis if e.animated),
+        }
+
+        fits = []
+
+        for file_name in self.files:
+            animated = file_name.lower().endswith(".gif")
+
+            if free[animated] > 0:
+                free[animated] -= 1
+                fits.append(file_name)
+            else:
+                self.skipped.append(file_name)
+
+        return fits
+
+    def _progress_embed(self, done: bool = False) -> Embed:
+        lines = ["%d uploaded" % len(self.uploaded)]
+
+        if self.failed:
+            lines.append("%d failed" % len(self.failed))
+
+        if self.skipped:
+            lines.append("%d skipped (no free slots)" % len(self.skipped))
+
+        if self.duplicates:
+            lines.append("%d already in this server" % len(self.duplicates))
+
+        status = CustomEmojis.success if done else CustomEmojis.waiting
+        embed = Embed(
+            colour=Colours.success if done else Colours.base,
+            title="%s %s" % ("Installed" if done else "Installing", self.title),
+            description="%s %s of %d\n\n%s" % (
+                status, len(self.uploaded), len(self.files), ", ".join(lines)),
+        )
+
+        if done and self.uploaded:
+            # Show what was added, as long as it fits in a field
+            preview = " ".join(str(e) for e in self.uploaded)
+            if len(preview) <= 1024:
+                embed.add_field(name="Added", value=preview)
+
+        return embed
+
+    async def _update(self, done: bool = False) -> None:
+        """ Edit the progress message, unless it was edited very recently. """
+        if not done and monotonic() - self._last_edit < self.edit_every:
+            return
+
+        self._last_edit = monotonic()
+
+        try:
+            await self._message.edit(embed=self._progress_embed(done))
+        except HTTPException:
+            pass
+
+    async def _download(self, file_name: str) -> None:
+        name = emoji_name_from_file(file_name)
+        image = None
+
+        async with self._downloads:
+            if self._full:
+                # The slots ran out while this was waiting; that's not the image's fault
+                self.skipped.append(file_name)
+            else:
+                try:
+                    image = await self.ctx.bot.fetcher.fetch(PACK_EMOJI_URL % file_name)
+                    image = await self.ctx.bot.images.prepare(image)
+                except Exception:
+                    self.failed.append(file_name)
+
+        await self._queue.put((file_name, name, image))
+
+    async def _upload(self, count: int) -> None:
+        for _ in range(count):
+            file_name, name, image = await self._queue.get()
+
+            if image is None:
+                pass
+            elif self._full:
+                self.skipped.append(file_name)
+            else:
+                try:
+                    emoji = await self.ctx.upload_emoji(name, image=image, post_success=False, prepared=True)
+                    self.uploaded.append(emoji)
+                except HTTPException as err:
+                    if err.code == MAX_EMOJIS_REACHED:
+                        # Someone else used up the slots; don't bother with the rest
+                        self._full = True
+                        self.skipped.append(file_name)
+                    else:
+                        self.failed.append(file_name)
+                except DuplicateEmoji:
+                    self.duplicates.append(file_name)
+                except Exception:
+                    self.failed.append(file_name)
+
+            await self._update()
+
+    async def run(self) -> None:
+        """ Install the emojis, editing the progress message as it goes. """
+        fits = self._fits()
+
+        self._message = await self.ctx.send(embed=self._progress_embed())
+        self._last_edit = monotonic()
+
+        downloads = [asyncio.ensure_future(self._download(f)) for f in fits]
+
+        try:
+            await self._upload(len(fits))
+        finally:
+            for task in downloads:
+                task.cancel()
+
+        await self._update(done=True)
+
+        installs = self.ctx.bot.pack_installs
+        for outcome, emojis in (("uploaded", self.uploaded), ("failed", self.failed), ("skipped", self.skipped),
+                                ("duplicate", self.duplicates)):
+            installs[outcome] = installs.get(outcome, 0) + len(emojis)
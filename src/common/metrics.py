@@ -0,0 +1,143 @@
+from typing import *
+
+# (labels, value) pairs for one metric
+Samples = Iterable[Tuple[Dict[str, Any], float]]
+
+HISTOGRAM_SUFFIXES = ("_bucket", "_sum", "_count")
+
+
+def format_labels(labels: Dict[str, Any]) -> str:
+    """ Format labels as {name="value",...}. """
+    if not labels:
+        return ""
+
+    pairs = ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+
+    return "{%s}" % pairs
+
+
+class Metrics:
+    """
+    Render metrics in the Prometheus text exposition format.
+
+    Components add their metrics with counter() and gauge(); render() joins everything into one response body.
+    """
+
+    def __init__(self):
+        self._lines: List[str] = []
+
+    def _add(self, kind: str, name: str, description: str, samples: Union[float, Samples]) -> None:
+        self._lines.append("# HELP %s %s" % (name, description))
+        self._lines.append("# TYPE %s %s" % (name, kind))
+
+        if isinstance(samples, (int, float)):
+            samples = (({}, samples),)
+
+        for labels, value in samples:
+            self._lines.append("%s%s %s" % (name, format_labels(labels), repr(float(value))))
+
+    def counter(self, name: str, description: str, samples: Union[float, Samples]) -> None:
+        """ Add a counter: a total that only goes up. """
+        self._add("counter", name, description, samples)
+
+    def gauge(self, name: str, description: str, samples: Union[float, Samples]) -> None:
+        """ Add a gauge: a value that can go up and down. """
+        self._add("gauge", name, description, samples)
+
+    def histogram(self, name: str, description: str, bounds: Sequence[float],
+                  histograms: Dict[str, Sequence[int]], sums: Dict[str, float], label: str) -> None:
+        """
+        Add a histogram per label value, from non-cumulative bucket counts.
+
+        :param name: The metric name.
+        :param description: The help text.
+        :param bounds: The upper bound of each bucket. The last should be infinity.
+        :param histograms: Label value -> counts per bucket.
+        :param sums: Label value -> the total of every observed value.
+        :param label: The label name to use for the keys of histograms.
+        """
+        self._lines.append("# HELP %s %s" % (name, description))
+        self._lines.append("# TYPE %s histogram" % name)
+
+        for key, counts in histograms.items():
+            total = 0
+
+            for bound, count in zip(bounds, counts):
+                total += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                self._lines.append("%s_bucket%s %d" % (name, format_labels({label: key, "le": le}), total))
+
+            self._lines.append("%s_sum%s %s" % (name, format_labels({label: key}), repr(float(sums.get(key, 0.0)))))
+            self._lines.append("%s_count%s %d" % (name, format_labels({label: key}), total))
+
+    def render(self) -> str:
+        """ The full exposition body. """
+        return "\n".join(self._lines) + "\n"
+
+
+def merge(bodies: Dict[str, str], label: str) -> str:
+    """
+    Merge several exposition bodies into one, e.g. every cluster worker's /metrics.
+
+    Each sample gets a label saying which body it came from, and samples are regrouped under their metric's HELP and
+    TYPE lines, which are only written once. A histogram's _bucket, _sum and _count samples stay with the histogram.
+
+    :param bodies: Label value -> exposition body.
+    :param label: The label name to add to every sample.
+    :return: The merged body.
+    """
+    # Metric name -> (HELP and TYPE lines, samples), in the order they were first seen
+    families: Dict[str, Tuple[List[str], List[str]]] = {}
+
+    for value, body in bodies.items():
+        extra = format_labels({label: value})[1:-1]
+
+        for line in body.splitlines():
+            if not line:
+                continue
+
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    headers = families.setdefault(parts[2], ([], []))[0]
+
+                    if line not in headers:
+                        headers.append(line)
+
+                continue
+
+            # name{a="b"} 1.0 -> name{label="value",a="b"} 1.0
+            end = min(i for i in (line.find("{"), line.find(" "), len(line)) if i >= 0)
+            name = line[:end]
+
+            if line[end:end + 2] == "{}":
+                sample = "%s{%s}%s" % (name, extra, line[end + 2:])
+            elif line[end:end + 1] == "{":
+                sample = "%s{%s,%s" % (name, extra, line[end + 1:])
+            else:
+                sample = "%s{%s}%s" % (name, extra, line[end:])
+
+            # A histogram's _bucket, _sum and _count samples belong to the histogram
+            family = families.get(name)
+
+            if family is None:
+                for suffix in HISTOGRAM_SUFFIXES:
+                    if name.endswith(suffix) and name[:-len(suffix)] in families:
+                        family = families[name[:-len(suffix)]]
+                        break
+                else:
+                    family = families.setdefault(name, ([], []))
+
+            family[1].append(sample)
+
+    lines = []
+
+    for headers, samples in families.values():
+        lines.extend(headers)
+        lines.extend(samples)
+
+    return "\n".join(lines) + "\n" if lines else ""
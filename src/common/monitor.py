@@ -0,0 +1,118 @@
+import asyncio
+import sys
+import threading
+from collections import deque
+from time import perf_counter, sleep, time
+from traceback import format_stack
+from typing import *
+
+
+class SlowCallback:
+    """ A stretch of time the event loop was blocked by one callback or handler. """
+
+    __slots__ = ("started", "duration", "trigger", "stack")
+
+    def __init__(self, started: float, duration: float, trigger: str, stack: str):
+        self.started = started  # Unix time the block was noticed
+        self.duration = duration  # Seconds; updated once the loop wakes up again
+        self.trigger = trigger  # The task that was running, e.g. "command:upload" or "event:message"
+        self.stack = stack
+
+
+def describe_task(task: Optional[asyncio.Task]) -> str:
+    """ Describe what a task is doing, by its name (see Emojis._schedule_event and Emojis.invoke). """
+    if task is None:
+        return "callback"
+
+    return task.get_name()
+
+
+class LoopMonitor:
+    """
+    Continuously sample event loop lag: how much later than asked a short sleep wakes up.
+
+    Every shard, command and background task shares one loop, so lag here shows up as slow commands and missed
+    heartbeats everywhere. A watchdog thread also notices when the loop has been stuck for longer than a threshold,
+    and records the stack of whatever is blocking it and the task (command or event) that was running.
+    """
+
+    def __init__(self, interval: float = 0.5, window: int = 120, threshold: float = 0.25, history: int = 50):
+        self.interval = interval
+        self.threshold = threshold
+
+        # The most recent samples, in seconds
+        self.samples: Deque[float] = deque(maxlen=window)
+        # The most recent blocks longer than the threshold
+        self.slow_callbacks: Deque[SlowCallback] = deque(maxlen=history)
+
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._running = False
+
+        # When the sampler expects to wake up next (perf_counter), and the block it's currently stuck in, if any
+        self._due = 0.0
+        self._blocked: Optional[SlowCallback] = None
+
+    @property
+    def lag(self) -> float:
+        """ The most recent lag sample, in seconds. """
+        return self.samples[-1] if self.samples else 0.0
+
+    @property
+    def peak(self) -> float:
+        """ The worst lag in the sample window, in seconds. """
+        return max(self.samples, default=0.0)
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """ Start sampling on a loop. Must be called from the loop's thread. """
+        if self._task is not None:
+            return
+
+        self._running = True
+        self._due = perf_counter() + self.interval
+        self._task = loop.create_task(self._sample(loop))
+
+        self._watchdog = threading.Thread(
+            target=self._watch,
+            args=(loop, threading.get_ident()),
+            name="loop-watchdog",
+            daemon=True,
+        )
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        """ Stop sampling. """
+        self._running = False
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _sample(self, loop: asyncio.AbstractEventLoop) -> None:
+        while True:
+            self._due = perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+
+            lag = max(0.0, perf_counter() - self._due)
+            self.samples.append(lag)
+
+            # The loop is running again, so whatever blocked it has finished
+            blocked, self._blocked = self._blocked, None
+            if blocked is not None:
+                blocked.duration = lag
+
+    def _watch(self, loop: asyncio.AbstractEventLoop, loop_thread: int) -> None:
+        """ Runs in the watchdog thread. """
+        while self._running:
+            sleep(self.threshold / 4)
+
+            stuck_for = perf_counter() - self._due
+
+            if stuck_for < self.threshold or self._blocked is not None:
+                continue
+
+            frame = sys._current_frames().get(loop_thread)
+            stack = "".join(format_stack(frame, limit=15)) if frame is not None else ""
+
+            self._blocked = SlowCallback(time(), stuck_for, describe_task(asyncio.current_task(loop)), stack)
+            self.slow_callbacks.append(self._blocked)
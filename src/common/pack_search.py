@@ -0,0 +1,244 @@
+from bisect import bisect_left
+from functools import lru_cache
+from heapq import nlargest
+from re import compile as compile_regex
+from typing import *
+
+from src.common.emoji_index import ngrams
+
+# Words in pack names, descriptions and file names. Numbers on their own (emoji.gg's file ID prefixes) aren't words.
+WORD = compile_regex(r"[a-z0-9]*[a-z][a-z0-9]*")
+
+# How much each kind of match is worth, per query word
+EXACT, PREFIX, TYPO = 1.0, 0.8, 0.6
+
+# Where a word was found: an emoji's file name counts for more than a pack's description
+FIELD_WEIGHTS = {"file": 1.0, "name": 1.0, "description": 0.5}
+
+
+def words(text: str) -> List[str]:
+    """ Split text into lowercase words, e.g. "3415-vibing-frog.gif" -> ["vibing", "frog", "gif"]. """
+    return WORD.findall(text.lower())
+
+
+def max_edits(word: str) -> int:
+    """ How many typos a query word can have: none for very short words, more for long ones. """
+    if len(word) < 4:
+        return 0
+    elif len(word) < 8:
+        return 1
+
+    return 2
+
+
+def letters(word: str) -> int:
+    """ The set of characters in a word, as a bit mask. """
+    mask = 0
+
+    for char in word:
+        mask |= 1 << ord(char)
+
+    return mask
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    How many typos apart two strings are: insertions, deletions, substitutions and swaps of neighbouring letters
+    (the optimal string alignment distance). Stops early, returning limit + 1, once it's over the limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    # Only cells within limit of the diagonal can stay within the limit; the rest are left as "too far"
+    too_far = limit + 1
+    before = None
+    previous = [j if j <= limit else too_far for j in range(len(b) + 1)]
+
+    for i in range(1, len(a) + 1):
+        char_a = a[i - 1]
+        current = [i if i <= limit else too_far] + [too_far] * len(b)
+        best = current[0]
+
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            char_b = b[j - 1]
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+
+            if before is not None and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                distance = min(distance, before[j - 2] + 1)
+
+            current[j] = distance
+
+            if distance < best:
+                best = distance
+
+        if best > limit:
+            return too_far
+
+        before, previous = previous, current
+
+    return min(previous[-1], too_far)
+
+
+class PackResult(NamedTuple):
+    score: float
+    pack: int  # Index in the catalogue
+    emoji: Optional[int]  # Index in the pack's emojis, or None for a match on the pack itself
+
+
+class PackSearch:
+    """
+    A word index over the emoji.gg pack catalogue: pack names and descriptions, and every emoji's file name.
+
+    Each distinct word is indexed once, with the documents (packs and emojis) it appears in, and by its trigrams so
+    misspelled query words can find it. Query words match indexed words exactly, as a prefix, or within a few typos;
+    documents are ranked by how well they match every query word. An emoji file in several packs is indexed once, in
+    the first pack that has it.
+    """
+
+    def __init__(self, packs: Iterable[dict] = ()):
+        self.build(packs)
+
+    def build(self, packs: Iterable[dict]) -> None:
+        """ (Re)build the whole index from the catalogue. """
+        # Documents: (pack index, emoji index or None) with their word counts, to prefer shorter matches
+        self.documents: List[Tuple[int, Optional[int]]] = []
+        self.lengths: List[int] = []
+
+        # Word -> document -> field weight, and (trigram, word length) -> words
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.grams: Dict[Tuple[str, int], List[str]] = {}
+
+        files = set()
+
+        for pack_index, pack in enumerate(packs):
+            self._add((pack_index, None), [
+                ("name", pack.get("name") or ""),
+                ("description", pack.get("description") or ""),
+            ])
+
+            for emoji_index, file_name in enumerate(pack["emojis"]):
+                if file_name not in files:
+                    files.add(file_name)
+
+                    # The extension isn't worth matching on
+                    self._add((pack_index, emoji_index), [("file", file_name.rsplit(".", 1)[0])])
+
+        # Bucketed by length too, so a misspelling is only compared with words it could be within reach of
+        for word in self.postings:
+            for gram in ngrams(" %s " % word):
+                self.grams.setdefault((gram, len(word)), []).append(word)
+
+        self.letters = {word: letters(word) for word in self.postings}
+
+        # Sorted, for prefix matches
+        self.vocabulary = sorted(self.postings)
+        self.matches = lru_cache(maxsize=4096)(self._match)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def _add(self, document: Tuple[int, Optional[int]], fields: List[Tuple[str, str]]) -> None:
+        number = len(self.documents)
+        self.documents.append(document)
+        length = 0
+
+        for field, text in fields:
+            weight = FIELD_WEIGHTS[field]
+
+            for word in words(text):
+                length += 1
+                documents = self.postings.setdefault(word, {})
+
+                if documents.get(number, 0.0) < weight:
+                    documents[number] = weight
+
+        self.lengths.append(length)
+
+    def _match(self, word: str) -> List[Tuple[str, float]]:
+        """
+        The indexed words a query word matches, and how well: exactly, as a prefix of a longer word, or within a few
+        typos. Cached by self.matches until the index is rebuilt.
+        """
+        found = {}
+
+        if word in self.postings:
+            found[word] = EXACT
+
+        # Prefixes, so a query still matches while it's being typed
+        if len(word) >= 3:
+            position = bisect_left(self.vocabulary, word)
+
+            while position < len(self.vocabulary) and self.vocabulary[position].startswith(word):
+                found.setdefault(self.vocabulary[position], PREFIX)
+                position += 1
+
+        limit = max_edits(word)
+
+        if limit:
+            # A typo changes at most four of a word's (padded) trigrams (a swap), so a word within the limit shares
+            # the rest
+            grams = ngrams(" %s " % word)
+            shared: Dict[str, int] = {}
+
+            for length in range(len(word) - limit, len(word) + limit + 1):
+                for gram in grams:
+                    for candidate in self.grams.get((gram, length), ()):
+                        shared[candidate] = shared.get(candidate, 0) + 1
+
+            mask = letters(word)
+
+            for candidate, count in shared.items():
+                # Trigrams and characters only either word has are cheap lower bounds on the typos between them.
+                # Each typo adds or removes at most one distinct character on each side.
+                if count < max(1, max(len(grams), len(candidate)) - 4 * limit) or candidate in found:
+                    continue
+
+                other = self.letters[candidate]
+
+                if bin(mask & ~other).count("1") > limit or bin(other & ~mask).count("1") > limit:
+                    continue
+
+                distance = edit_distance(word, candidate, limit)
+
+                if distance <= limit:
+                    found[candidate] = TYPO - 0.2 * (distance - 1)
+
+        return list(found.items())
+
+    def search(self, query: str, limit: int = 10) -> List[PackResult]:
+        """
+        Find the packs and emojis that best match a query.
+
+        :param query: Words to look for, e.g. "vibing frog".
+        :param limit: [Optional] The most results to return.
+        :return: The best results first.
+        """
+        query_words = words(query)
+
+        if not query_words:
+            return []
+
+        scores: Dict[int, float] = {}
+
+        for word in query_words:
+            # Each query word counts once per document: for the best indexed word it matched there
+            best: Dict[int, float] = {}
+
+            for match, quality in self.matches(word):
+                for document, weight in self.postings[match].items():
+                    score = quality * weight
+
+                    if score > best.get(document, 0.0):
+                        best[document] = score
+
+            for document, score in best.items():
+                scores[document] = scores.get(document, 0.0) + score
+
+        # Matching more of the query comes first; among equals, documents with fewer other words
+        lengths = self.lengths
+        top = nlargest(limit, scores.items(), key=lambda item: (item[1], -lengths[item[0]], -item[0]))
+
+        return [
+            PackResult(score / len(query_words), *self.documents[document])
+            for document, score in top
+        ]
@@ -0,0 +1,186 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from functools import lru_cache
+from typing import *
+
+from src.common.common import Embed
+
+# File layout: magic, pack count, names length | names ("\n"-joined) | offsets (count + 1) | one JSON blob per pack
+MAGIC = b"EPK1"
+HEADER = struct.Struct("<4sII")
+
+# Discord's limit on an embed description
+DESCRIPTION_LIMIT = 4096
+
+
+def compile_catalogue(source: str, destination: str) -> None:
+    """
+    Convert packs.json into the compact, memory-mappable catalogue format.
+
+    :param source: The path to packs.json.
+    :param destination: Where to write the catalogue. Written atomically.
+    """
+    with open(source, "rb") as f:
+        packs = json.load(f)
+
+    names = "\n".join(pack["name"].replace("\n", " ") for pack in packs).encode()
+    blobs = [json.dumps(pack, separators=(",", ":")).encode() for pack in packs]
+
+    # Offsets are absolute positions in the file
+    offsets = array("I")
+    position = HEADER.size + len(names) + (len(packs) + 1) * offsets.itemsize
+
+    for blob in blobs:
+        offsets.append(position)
+        position += len(blob)
+
+    offsets.append(position)
+
+    # Per process: cluster workers can compile the catalogue at the same time
+    temp = "%s.%d.tmp" % (destination, os.getpid())
+
+    with open(temp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(packs), len(names)))
+        f.write(names)
+        f.write(offsets.tobytes())
+
+        for blob in blobs:
+            f.write(blob)
+
+    os.replace(temp, destination)
+
+
+class PackCatalogue:
+    """
+    The emoji.gg pack catalogue, memory-mapped from a compact file.
+
+    packs.json is converted once (and again whenever it changes). Only the pack names are read up front;
+    each pack's details are decoded the first time they're needed.
+    """
+
+    def __init__(self, source: str = "packs.json", path: str = "./data/packs.bin"):
+        self.source = source
+        self.path = path
+
+        self.names: List[str] = []
+        self.version = 0.0
+
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._offsets = array("I")
+        self._pages: List[Embed] = []
+        self._load = lru_cache(maxsize=64)(self._decode)
+
+        self.refresh()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index: int) -> dict:
+        if not 0 <= index < len(self.names):
+            raise IndexError(index)
+
+        return self._load(index)
+
+    def __iter__(self) -> Iterator[dict]:
+        for index in range(len(self.names)):
+            yield self._load(index)
+
+    def refresh(self) -> bool:
+        """
+        Reload the catalogue if packs.json changed since it was last loaded.
+
+        :return: True if the catalogue was reloaded.
+        """
+        version = os.stat(self.source).st_mtime
+
+        if version == self.version:
+            return False
+
+        try:
+            stale = os.stat(self.path).st_mtime < version
+        except OSError:
+            stale = True
+
+        if stale:
+            compile_catalogue(self.source, self.path)
+
+        try:
+            self._open()
+        except ValueError:
+            # Corrupt or from an older format
+            compile_catalogue(self.source, self.path)
+            self._open()
+
+        self.version = version
+        self._pages = []
+
+        return True
+
+    def _open(self) -> None:
+        self.close()
+
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, names_length = HEADER.unpack_from(self._map)
+
+        if magic != MAGIC:
+            raise ValueError("Not a pack catalogue.")
+
+        start = HEADER.size + names_length
+        names = self._map[HEADER.size:start].decode()
+
+        self.names = names.split("\n") if count else []
+        self._offsets = array("I")
+        self._offsets.frombytes(self._map[start:start + (count + 1) * self._offsets.itemsize])
+        self._load.cache_clear()
+
+    def _decode(self, index: int) -> dict:
+        """ Decode one pack's details. Cached by self._load. """
+        return json.loads(self._map[self._offsets[index]:self._offsets[index + 1]])
+
+    def pages(self, per_page: int = 25) -> List[Embed]:
+        """
+        The ~packs list, split into embeds that fit Discord's limits. Rendered once, until the catalogue changes.
+
+        :param per_page: [Optional] The most packs on one page.
+        :return: The pages.
+        """
+        if self._pages:
+            return self._pages
+
+        header = "Type `~pack [number]` to view (example: `~pack 1`)\n"
+        chunks = [[]]
+        length = len(header)
+
+        for number, name in enumerate(self.names, start=1):
+            line = '\n`~pack %d` -- view **"%s"**' % (number, name)
+
+            if len(chunks[-1]) >= per_page or length + len(line) > DESCRIPTION_LIMIT:
+                chunks.append([])
+                length = len(header)
+
+            chunks[-1].append(line)
+            length += len(line)
+
+        self._pages = [
+            Embed(
+                title="%d emoji packs available" % len(self.names),
+                description=header + "".join(lines),
+            ).set_footer(text="Page %d / %d -- type ~packs [page] for more" % (page, len(chunks)))
+            for page, lines in enumerate(chunks, start=1)
+        ]
+
+        return self._pages
+
+    def close(self) -> None:
+        """ Unmap the catalogue file. """
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+
+            self._map = self._file = None
@@ -0,0 +1,71 @@
+import asyncio
+from typing import *
+
+
+class ReactionRouter:
+    """
+    Route raw reaction events straight to the session that owns the message, keyed by message ID.
+
+    Called synchronously from Emojis.dispatch, so a reaction on any other message costs one dict lookup, instead of
+    running every open browser's wait_for check against it. The bot's own reactions (adding a browser's controls) are
+    never routed.
+    """
+
+    def __init__(self, queue_size: int = 32, user_id: int = None):
+        """
+        :param queue_size: [Optional] How many events a session can be behind before more are dropped. More than a
+            browser has controls.
+        :param user_id: [Optional] The bot's user ID, whose reactions are ignored. Set once it's known.
+        """
+        self.queue_size = queue_size
+        self.user_id = user_id
+
+        self._routes: Dict[int, asyncio.Queue] = {}
+
+        self.routed = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def register(self, message_id: int) -> asyncio.Queue:
+        """
+        Start receiving reaction events for a message.
+
+        :param message_id: The message to route reactions from.
+        :return: A queue the message's raw reaction payloads are put on.
+        """
+        queue = self._routes[message_id] = asyncio.Queue(self.queue_size)
+
+        return queue
+
+    def unregister(self, message_id: int) -> None:
+        """ Stop receiving reaction events for a message. """
+        self._routes.pop(message_id, None)
+
+    def route(self, payload) -> bool:
+        """
+        Hand a raw reaction payload to the message's session.
+
+        :param payload: A RawReactionActionEvent.
+        :return: True if the event was routed; False if nothing was listening (or it was behind), so it was dropped,
+            or it was the bot's own reaction.
+        """
+        if payload.user_id == self.user_id:
+            return False
+
+        queue = self._routes.get(payload.message_id)
+
+        if queue is None:
+            self.dropped += 1
+            return False
+
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+        self.routed += 1
+
+        return True
@@ -0,0 +1,129 @@
+import json
+from re import compile as compile_regex
+from time import monotonic
+from typing import *
+
+from src.common.common import DEFAULT_PREFIX
+from src.common.emoji_index import EMOJI_TOKEN
+
+# The gateway events worth replaying: what users do, not what the bot does
+RECORDED_EVENTS = ("MESSAGE_CREATE", "MESSAGE_REACTION_ADD", "MESSAGE_REACTION_REMOVE")
+
+LETTERS = compile_regex(r"[^\W\d_]")
+MENTION = compile_regex(r"<(@[!&]?|#)([0-9]+)>")
+
+
+class EventRecorder:
+    """
+    Record the gateway events users cause, anonymised, for bot/replay.py to replay against the stand-in.
+
+    Every ID is replaced by a small number, consistently within a recording, mentions included. Message text keeps its
+    shape but not its words: letters become "x", while digits, punctuation and spacing stay, so the text costs the
+    same to scan.
+    :emoji: names become ":eN:" if the bot could resolve them and ":uN:" if not, so a replay resolves the same
+    proportion. Command names are kept, their arguments aren't. Usernames, avatars, attachments and embeds are dropped.
+
+    Each line of the file is one event: {"t": seconds since recording started, "event": name, ...fields}.
+    """
+
+    def __init__(self, path: str, bot):
+        self.bot = bot
+        self.file = open(path, "w", encoding="utf-8")
+        self.started = monotonic()
+        self.events = 0
+
+        # (kind, real ID or name) -> anonymous number
+        self._ids: Dict[Tuple[str, Any], int] = {}
+
+    def _id(self, kind: str, value: Any) -> Optional[int]:
+        if value is None:
+            return None
+
+        key = (kind, value)
+        number = self._ids.get(key)
+
+        if number is None:
+            number = self._ids[key] = len(self._ids) + 1
+
+        return number
+
+    def record(self, payload: dict) -> None:
+        """ Record a raw gateway payload (see the socket_response event), if it's one worth replaying. """
+        event = payload.get("t")
+
+        if event not in RECORDED_EVENTS:
+            return
+
+        data = payload["d"]
+
+        if event == "MESSAGE_CREATE":
+            # The bot's own messages and webhook sends are its output, not its input
+            if data.get("webhook_id") or data["author"]["id"] == str(self.bot.user.id):
+                return
+
+            guild_id = int(data["guild_id"]) if data.get("guild_id") else None
+            entry = {
+                "message": self._id("message", data["id"]),
+                "author": self._id("user", data["author"]["id"]),
+                "bot": data["author"].get("bot", False),
+                "content": self.anonymise(data.get("content") or "", guild_id),
+            }
+        else:
+            emoji = data["emoji"]
+            entry = {
+                "message": self._id("message", data["message_id"]),
+                "user": self._id("user", data["user_id"]),
+                # Unicode reactions (like the search browser's) are kept; custom ones are anonymised
+                "emoji": emoji["name"] if emoji.get("id") is None else None,
+            }
+
+        entry.update(
+            t=round(monotonic() - self.started, 4),
+            event=event,
+            guild=self._id("guild", data.get("guild_id")),
+            channel=self._id("channel", data["channel_id"]),
+        )
+
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self.events += 1
+
+    def anonymise(self, content: str, guild_id: int = None) -> str:
+        """ Message text with the same shape, and emoji names that resolve the same way, but none of the words. """
+        parts = []
+        last = 0
+
+        for match in EMOJI_TOKEN.finditer(content):
+            parts.append(self._scrub(content[last:match.start()]))
+            name = match.group(1)
+
+            if name is None:
+                # Already rendered
+                parts.append("<:r:%d>" % self._id("emoji", match.group()))
+            elif self.bot.emoji_index.resolve(name, guild_id) is not None:
+                parts.append(":e%d:" % self._id("emoji", name))
+            else:
+                parts.append(":u%d:" % self._id("emoji", name))
+
+            last = match.end()
+
+        parts.append(self._scrub(content[last:]))
+        text = "".join(parts)
+
+        # Keep the command, if it is one, so the replay invokes it too
+        prefix = self.bot.prefixes.get(guild_id, DEFAULT_PREFIX) if guild_id else DEFAULT_PREFIX
+
+        if content.startswith(prefix):
+            name = content[len(prefix):].split(" ", 1)[0]
+
+            if self.bot.get_command(name) is not None:
+                text = prefix + name + text[len(prefix) + len(name):]
+
+        return text
+
+    def _scrub(self, text: str) -> str:
+        text = MENTION.sub(lambda match: "<%s%d>" % (match.group(1), self._id("mention", match.group(2))), text)
+
+        return LETTERS.sub("x", text)
+
+    def close(self) -> None:
+        self.file.close()
@@ -0,0 +1,367 @@
+"""
+Just enough of the Redis protocol (RESP) for the bot's shared state: a pipelining client, and a tiny in-memory server
+the cluster supervisor runs when there's no Redis to point the workers at.
+"""
+import asyncio
+import heapq
+from collections import deque
+from time import monotonic
+from typing import *
+from urllib.parse import urlparse
+
+
+class RespError(Exception):
+    """ An error reply from the server. """
+
+
+def encode(args: Sequence[Union[bytes, str, int, float]]) -> bytes:
+    """ Encode a command as an array of bulk strings. """
+    parts = [b"*%d\r\n" % len(args)]
+
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """ Read one reply (or, on the server side, one command). Raises ConnectionError at EOF. """
+    line = await reader.readline()
+
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed")
+
+    kind, rest = line[:1], line[1:-2]
+
+    if kind == b"+":
+        return rest.decode()
+    elif kind == b"-":
+        return RespError(rest.decode())
+    elif kind == b":":
+        return int(rest)
+    elif kind == b"$":
+        size = int(rest)
+
+        if size < 0:
+            return None
+
+        return (await reader.readexactly(size + 2))[:-2]
+    elif kind == b"*":
+        size = int(rest)
+
+        if size < 0:
+            return None
+
+        return [await read_reply(reader) for _ in range(size)]
+
+    raise ConnectionError("Bad reply: %r" % line)
+
+
+class RespClient:
+    """
+    A Redis protocol client that pipelines everything.
+
+    Commands issued in the same event loop iteration are written together and their replies are matched up in order, so
+    many concurrent callers share one connection and one round trip. Reconnects on the next command after a failure.
+    Connecting and waiting for replies time out, raising ConnectionError, so a server that stops answering can't hold
+    its callers up for long.
+    """
+
+    def __init__(self, url: str = "redis://127.0.0.1:6379/0", timeout: float = 2.0):
+        """
+        :param url: [Optional] The server, as a redis:// URL.
+        :param timeout: [Optional] Seconds to wait to connect, and for a command's reply.
+        """
+        parsed = urlparse(url)
+        self.timeout = timeout
+
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.strip("/") or 0)
+
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connecting: Optional[asyncio.Lock] = None
+
+        self._buffer = bytearray()
+        self._pending: Deque[asyncio.Future] = deque()
+        self._flush_scheduled = False
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self) -> None:
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+
+        async with self._connecting:
+            if self.connected:
+                return
+
+            try:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+            except asyncio.TimeoutError:
+                raise ConnectionError("Timed out connecting to %s:%d" % (self.host, self.port)) from None
+
+            self._reader_task = asyncio.get_event_loop().create_task(self._read())
+
+            handshake = []
+            if self.password:
+                handshake.append(("AUTH", self.password))
+            if self.db:
+                handshake.append(("SELECT", self.db))
+
+            if handshake:
+                await self.pipeline(*handshake)
+
+    async def execute(self, *args):
+        """ Run one command and return its reply. Error replies are raised as RespError. """
+        if not self.connected:
+            await self.connect()
+
+        return await self._wait(self._send(args))
+
+    async def pipeline(self, *commands: Sequence) -> list:
+        """ Run several commands in one round trip and return their replies, in order. """
+        if not self.connected:
+            await self.connect()
+
+        return list(await self._wait(asyncio.gather(*(self._send(args) for args in commands))))
+
+    async def _wait(self, replies: Awaitable):
+        """ Wait for replies. On a timeout, the connection is dropped: whatever else is waiting on it fails too. """
+        try:
+            return await asyncio.wait_for(replies, self.timeout)
+        except asyncio.TimeoutError:
+            err = ConnectionError("Timed out waiting for %s:%d to reply" % (self.host, self.port))
+            self._fail(err)
+            raise err from None
+
+    def _send(self, args: Sequence) -> asyncio.Future:
+        """ Queue a command to be written with the rest of this loop iteration's, and return its reply's future. """
+        loop = asyncio.get_event_loop()
+
+        self._buffer += encode(args)
+        future = loop.create_future()
+        self._pending.append(future)
+
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop.call_soon(self._flush)
+
+        return future
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+
+        if self._buffer and self.connected:
+            self._writer.write(bytes(self._buffer))
+        self._buffer.clear()
+
+    async def _read(self) -> None:
+        try:
+            while True:
+                reply = await read_reply(self._reader)
+                future = self._pending.popleft()
+
+                if future.done():
+                    continue  # The caller was cancelled
+                elif isinstance(reply, RespError):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError) as err:
+            self._fail(ConnectionError(str(err) or "Connection lost"))
+
+    def _fail(self, err: Exception) -> None:
+        """ Drop the connection and fail everything still waiting on it. """
+        # The reader would otherwise outlive its connection, and fail the next one's commands when it notices
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+        self._buffer.clear()
+
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(err)
+
+    async def close(self) -> None:
+        self._fail(ConnectionError("Client closed"))
+
+
+class RespServer:
+    """
+    A tiny in-memory server for the commands the bot uses: PING, GET, MGET, SET (with PX/EX and NX), INCR, DECR, DEL,
+    PTTL and PEXPIRE. Keys expire lazily when touched, and expired keys are swept off a heap as commands come in.
+    """
+
+    def __init__(self, clock: Callable[[], float] = monotonic):
+        self.clock = clock
+
+        self._data: Dict[bytes, bytes] = {}
+        self._expires: Dict[bytes, float] = {}
+        self._heap: List[Tuple[float, bytes]] = []
+
+        self._commands = {
+            b"PING": self._ping,
+            b"GET": self._get,
+            b"MGET": self._mget,
+            b"SET": self._set,
+            b"INCR": lambda key: self._incr(key, 1),
+            b"DECR": lambda key: self._incr(key, -1),
+            b"DEL": self._del,
+            b"PTTL": self._pttl,
+            b"PEXPIRE": self._pexpire,
+            b"SELECT": lambda db: "OK",
+            b"AUTH": lambda *args: "OK",
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 6380) -> asyncio.AbstractServer:
+        """ Start serving. Call close() on the result to stop. """
+        return await asyncio.start_server(self._client, host, port)
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                command = await read_reply(reader)
+                writer.write(self.handle(command))
+                await writer.drain()
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def handle(self, command) -> bytes:
+        """ Run one command and encode its reply. """
+        if not isinstance(command, list) or not command:
+            return b"-ERR expected a command array\r\n"
+
+        self._sweep()
+
+        func = self._commands.get(command[0].upper())
+
+        if func is None:
+            return b"-ERR unknown command '%s'\r\n" % command[0]
+
+        try:
+            reply = func(*command[1:])
+        except TypeError:
+            return b"-ERR wrong number of arguments for '%s'\r\n" % command[0]
+        except ValueError:
+            return b"-ERR value is not an integer or out of range\r\n"
+
+        return self._encode_reply(reply)
+
+    def _encode_reply(self, reply) -> bytes:
+        if reply is None:
+            return b"$-1\r\n"
+        elif isinstance(reply, str):
+            return b"+%s\r\n" % reply.encode()
+        elif isinstance(reply, int):
+            return b":%d\r\n" % reply
+        elif isinstance(reply, bytes):
+            return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+        return b"*%d\r\n" % len(reply) + b"".join(self._encode_reply(item) for item in reply)
+
+    def _alive(self, key: bytes) -> bool:
+        expires = self._expires.get(key)
+
+        if expires is not None and expires <= self.clock():
+            self._data.pop(key, None)
+            del self._expires[key]
+
+        return key in self._data
+
+    def _expire_at(self, key: bytes, at: float) -> None:
+        self._expires[key] = at
+        heapq.heappush(self._heap, (at, key))
+
+    def _sweep(self) -> None:
+        """ Drop keys that have expired. Heap entries for keys whose expiry has since changed are skipped. """
+        now = self.clock()
+
+        while self._heap and self._heap[0][0] <= now:
+            at, key = heapq.heappop(self._heap)
+
+            if self._expires.get(key) == at:
+                self._data.pop(key, None)
+                del self._expires[key]
+
+    def _ping(self, message: bytes = None):
+        return message if message is not None else "PONG"
+
+    def _get(self, key: bytes):
+        return self._data[key] if self._alive(key) else None
+
+    def _mget(self, *keys: bytes):
+        return [self._get(key) for key in keys]
+
+    def _set(self, key: bytes, value: bytes, *options: bytes):
+        options = [option.upper() for option in options]
+        ttl = None
+
+        if b"PX" in options:
+            ttl = int(options[options.index(b"PX") + 1]) / 1000
+        elif b"EX" in options:
+            ttl = int(options[options.index(b"EX") + 1])
+
+        if b"NX" in options and self._alive(key):
+            return None
+
+        self._data[key] = value
+        self._expires.pop(key, None)
+
+        if ttl is not None:
+            self._expire_at(key, self.clock() + ttl)
+
+        return "OK"
+
+    def _incr(self, key: bytes, by: int):
+        value = int(self._data[key]) + by if self._alive(key) else by
+        self._data[key] = b"%d" % value  # Keeps its expiry, like Redis
+
+        return value
+
+    def _del(self, *keys: bytes):
+        deleted = 0
+
+        for key in keys:
+            if self._alive(key):
+                del self._data[key]
+                self._expires.pop(key, None)
+                deleted += 1
+
+        return deleted
+
+    def _pttl(self, key: bytes):
+        if not self._alive(key):
+            return -2
+
+        expires = self._expires.get(key)
+
+        return -1 if expires is None else max(0, int((expires - self.clock()) * 1000))
+
+    def _pexpire(self, key: bytes, milliseconds: bytes):
+        if not self._alive(key):
+            return 0
+
+        self._expire_at(key, self.clock() + int(milliseconds) / 1000)
+
+        return 1
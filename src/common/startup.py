@@ -0,0 +1,190 @@
+import ast
+import builtins
+import importlib
+import importlib.util
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import *
+
+
+class ImportProfiler:
+    """
+    Time every module imported while installed, like python -X importtime.
+
+    Each module's time is its own: time spent importing the modules it imports is counted against them instead.
+    """
+
+    def __init__(self):
+        # Module -> seconds spent executing it, excluding its own imports
+        self.times: Dict[str, float] = {}
+
+        self._original = builtins.__import__
+        self._stacks = threading.local()
+
+    def install(self) -> "ImportProfiler":
+        builtins.__import__ = self._import
+        return self
+
+    def uninstall(self) -> None:
+        builtins.__import__ = self._original
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Already imported (or relative, which resolves to something the parent is already timing): nothing to time.
+        # "from package import module" can still import the submodules; their time is counted against the package.
+        if level or (name in sys.modules and not self._imports_submodules(name, fromlist)):
+            return self._original(name, globals, locals, fromlist, level)
+
+        stack = getattr(self._stacks, "stack", None)
+        if stack is None:
+            stack = self._stacks.stack = []
+
+        stack.append(0.0)
+        start = perf_counter()
+
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = perf_counter() - start
+            children = stack.pop()
+
+            self.times[name] = self.times.get(name, 0.0) + elapsed - children
+
+            if stack:
+                stack[-1] += elapsed
+
+    @staticmethod
+    def _imports_submodules(name: str, fromlist) -> bool:
+        if not fromlist or not hasattr(sys.modules[name], "__path__"):
+            return False
+
+        return any("%s.%s" % (name, item) not in sys.modules for item in fromlist if item != "*")
+
+    def by_package(self) -> Dict[str, float]:
+        """ Import time per top-level package, e.g. "discord" or "src". """
+        packages: Dict[str, float] = {}
+
+        for name, seconds in self.times.items():
+            package = name.partition(".")[0]
+            packages[package] = packages.get(package, 0.0) + seconds
+
+        return packages
+
+
+def dependencies(name: str) -> List[str]:
+    """
+    The modules a module imports at its top level, found without running it, plus names that might be submodules.
+    Relative imports are left out.
+    """
+    spec = importlib.util.find_spec(name)
+
+    if spec is None or spec.loader is None:
+        return []
+
+    found = []
+
+    for node in ast.parse(spec.loader.get_source(name) or "").body:
+        if isinstance(node, ast.Import):
+            found.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+            found.append(node.module)
+
+            # "from package import module" imports the module too; names that aren't modules just fail to import
+            found.extend("%s.%s" % (node.module, alias.name) for alias in node.names if alias.name != "*")
+
+    return found
+
+
+def load_extensions(bot, names: Sequence[str], workers: int = 4) -> Dict[str, Tuple[float, float]]:
+    """
+    Load extensions, importing what they depend on concurrently first.
+
+    Importing a cog's dependencies is most of the work of loading it. That part runs in threads, so reading and
+    compiling modules overlaps. The cogs themselves aren't imported there: load_extension executes a cog module from
+    scratch, so it would run twice. Setup runs one cog at a time, in order, on this thread, as load_extension has to.
+    A dependency that fails to import in a thread just gets its error raised from the cog's load instead.
+
+    :param bot: The bot to load them into.
+    :param names: Extension module names, e.g. "src.exts.fun".
+    :param workers: [Optional] How many threads to import with.
+    :return: Extension name -> (seconds importing its dependencies, seconds loading).
+    """
+
+    def preload(name: str) -> float:
+        start = perf_counter()
+
+        for dependency in dependencies(name):
+            try:
+                importlib.import_module(dependency)
+            except Exception:
+                pass
+
+        return perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cog-import") as pool:
+        imported = dict(zip(names, pool.map(preload, names)))
+
+    timings = {}
+
+    for name in names:
+        start = perf_counter()
+        bot.load_extension(name)
+        timings[name] = (imported[name], perf_counter() - start)
+
+    return timings
+
+
+class StartupProfile:
+    """ What --profile-startup reports: import times, cog load times, and the time from launch to on_ready. """
+
+    def __init__(self, started: float, imports: ImportProfiler, budget: float = None):
+        self.started = started
+        self.imports = imports
+        self.budget = budget
+
+        self.cogs: Dict[str, Tuple[float, float]] = {}
+        self.imported_at = 0.0
+        self.loaded_at = 0.0
+        self.ready_after: Optional[float] = None
+
+    @property
+    def over_budget(self) -> bool:
+        return self.budget is not None and (self.ready_after is None or self.ready_after > self.budget)
+
+    def report(self, top: int = 15) -> str:
+        """ The breakdown, as text. """
+        ms = lambda seconds: "%8.1f ms" % (seconds * 1000)  # noqa
+        lines = ["Startup profile", ""]
+
+        lines.append("Imports (%s in total)" % ms(sum(self.imports.times.values())).strip())
+
+        for package, seconds in sorted(self.imports.by_package().items(), key=lambda item: -item[1])[:top]:
+            lines.append("  %s  %s" % (ms(seconds), package))
+
+        lines.append("")
+        lines.append("Slowest modules")
+
+        for name, seconds in sorted(self.imports.times.items(), key=lambda item: -item[1])[:top]:
+            lines.append("  %s  %s" % (ms(seconds), name))
+
+        lines.append("")
+        lines.append("Cogs (import dependencies in threads, then load)")
+
+        for name, (imported, loaded) in self.cogs.items():
+            lines.append("  %s  %s  %s" % (ms(imported), ms(loaded), name))
+
+        lines.append("")
+        lines.append("Launch to imports done  %s" % ms(self.imported_at - self.started))
+        lines.append("Launch to cogs loaded   %s" % ms(self.loaded_at - self.started))
+
+        if self.ready_after is None:
+            lines.append("Launch to on_ready      never")
+        else:
+            lines.append("Launch to on_ready      %s" % ms(self.ready_after))
+
+        if self.budget is not None:
+            lines.append("Budget                  %s  %s" % (
+                ms(self.budget), "EXCEEDED" if self.over_budget else "ok"))
+
+        return "\n".join(lines)
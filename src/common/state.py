@@ -0,0 +1,208 @@
+import logging
+from abc import ABC, abstractmethod
+from time import monotonic
+from typing import *
+
+from src.common.cooldowns import Cooldown, CooldownStore
+from src.common.resp import RespClient, RespError
+
+log = logging.getLogger(__name__)
+
+RETRY_INTERVAL = 10.0  # Seconds to stop trying the shared state for, after it couldn't be reached
+
+
+class SharedState(ABC):
+    """
+    State that every process running the bot's shards has to agree on (see bot/cluster.py).
+
+    Cooldowns are checked here, so a user can't dodge them by talking in a guild on another shard. The blacklist and
+    prefixes stay in each process's memory for hot reads and are persisted in the store; when one process changes
+    them it bumps their version here, and the others reload when they see the new version.
+    """
+
+    failures = 0  # Times the shared backend couldn't be reached
+
+    @abstractmethod
+    async def cooldown(self, key: Hashable, scopes: Sequence[Tuple[str, Cooldown]]) -> float:
+        """
+        Use one go of every scope, unless any of them is on cooldown. See CooldownStore.update.
+
+        :return: 0 if allowed, else the seconds until every scope would allow it.
+        """
+
+    @abstractmethod
+    def check(self, key: Hashable, scopes: Sequence[Tuple[str, Cooldown]]) -> float:
+        """
+        Whether any scope is known to be on cooldown, without using anything up or waiting on anything.
+
+        :return: 0 if it looks allowed, else the seconds until every scope would allow it.
+        """
+
+    @abstractmethod
+    async def versions(self, *names: str) -> List[int]:
+        """
+        The current version of each named piece of state, e.g. "blacklist".
+        Raises ConnectionError, OSError or RespError if they can't be read.
+        """
+
+    @abstractmethod
+    async def bump(self, name: str) -> None:
+        """ Tell every process that a piece of state has changed, so they reload it. """
+
+    async def close(self) -> None:
+        pass
+
+
+class LocalState(SharedState):
+    """ State for a bot running in one process, where everything is already shared. """
+
+    def __init__(self, cooldowns: CooldownStore = None):
+        self.cooldowns = cooldowns or CooldownStore()
+
+    async def cooldown(self, key: Hashable, scopes: Sequence[Tuple[str, Cooldown]]) -> float:
+        return self.cooldowns.update(key, scopes)
+
+    def check(self, key: Hashable, scopes: Sequence[Tuple[str, Cooldown]]) -> float:
+        return self.cooldowns.check(key, scopes)
+
+    async def versions(self, *names: str) -> List[int]:
+        return [0] * len(names)
+
+    async def bump(self, name: str) -> None:
+        pass
+
+
+class RemoteState(SharedState):
+    """
+    State shared through a Redis protocol server: the one the cluster supervisor runs (see RespServer), or Redis.
+
+    Cooldowns the process already knows are active are answered from a local CooldownStore without a round trip.
+    Everything else is one pipelined round trip, batched with whatever else the process sends in the same loop
+    iteration. If the server can't be reached, or doesn't answer in time, cooldowns fall back to this process's own
+    (as LocalState) rather than blocking commands, and it isn't tried again for a few seconds.
+    """
+
+    def __init__(self, url: str, namespace: str = "emojis:", timeout: float = 2.0):
+        """
+        :param url: A redis:// URL.
+        :param namespace: [Optional] Prefixed to every key.
+        :param timeout: [Optional] Seconds to wait for the server before falling back.
+        """
+        self.client = RespClient(url, timeout)
+        self.namespace = namespace
+
+        # This process's own uses, mirrored to answer repeat attempts locally, and used on their own when the server
+        # can't be reached
+        self.cooldowns = CooldownStore()
+        self.local = LocalState(self.cooldowns)
+        self.available = True
+        self._retry_at = 0.0
+
+    def _key(self, *parts: Any) -> str:
+        return self.namespace + ":".join(map(str, parts))
+
+    def check(self, key: Hashable, scopes: Sequence[Tuple[str, Cooldown]]) -> float:
+        # Only this process's own uses: other processes' are found out when the cooldown is used
+        return self.cooldowns.check(key, scopes)
+
+    def _unavailable(self) -> None:
+        self.failures += 1
+        self._retry_at = monotonic() + RETRY_INTERVAL
+
+        if self.available:
+            self.available = False
+            log.warning("Couldn't reach the shared state; using this process's own cooldowns until it's back.")
+
+    async def cooldown(self, key: Hashable, scopes: Sequence[Tuple[str, Cooldown]]) -> float:
+        retry_after = self.cooldowns.check(key, scopes)
+
+        if retry_after:
+            return retry_after
+
+        if not self.available and monotonic() < self._retry_at:
+            return await self.local.cooldown(key, scopes)
+
+        keys = [self._key("cooldown", name, key) for name, limit in scopes]
+        commands = []
+
+        # Start the window if it isn't running, then take a use; INCR keeps the window's expiry
+        for k, (name, limit) in zip(keys, scopes):
+            commands += [("SET", k, 0, "PX", int(limit.per * 1000), "NX"), ("INCR", k), ("PTTL", k)]
+
+        try:
+            replies = await self.client.pipeline(*commands)
+        except (ConnectionError, OSError, RespError):
+            self._unavailable()
+            return await self.local.cooldown(key, scopes)
+
+        if not self.available:
+            self.available = True
+            log.info("The shared state is back.")
+
+        allowed = []
+        repairs = []
+
+        for i, (k, (name, limit)) in enumerate(zip(keys, scopes)):
+            uses, ttl = replies[i * 3 + 1], replies[i * 3 + 2]
+
+            # A window without an expiry would never end; give it one
+            if ttl < 0:
+                ttl = int(limit.per * 1000)
+                repairs.append(("PEXPIRE", k, ttl))
+
+            if uses > limit.rate:
+                retry_after = max(retry_after, ttl / 1000)
+            else:
+                allowed.append(k)
+
+        if retry_after:
+            # Give back the uses that were taken, so nothing is used up when denied
+            repairs += [("DECR", k) for k in allowed]
+
+        if repairs:
+            try:
+                await self.client.pipeline(*repairs)
+            except (ConnectionError, OSError, RespError):
+                self._unavailable()
+
+        if retry_after:
+            return retry_after
+
+        self.cooldowns.update(key, scopes)
+
+        return 0.0
+
+    async def versions(self, *names: str) -> List[int]:
+        try:
+            values = await self.client.execute("MGET", *(self._key("version", name) for name in names))
+        except (ConnectionError, OSError, RespError):
+            self._unavailable()
+            raise
+
+        try:
+            return [int(value or 0) for value in values]
+        except ValueError:
+            raise RespError("A version isn't a number: %r" % (values,)) from None
+
+    async def bump(self, name: str) -> None:
+        try:
+            await self.client.execute("INCR", self._key("version", name))
+        except (ConnectionError, OSError, RespError):
+            # Other processes will pick the change up when they next restart
+            self._unavailable()
+            log.warning("Couldn't tell other processes that the %s changed.", name)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+def open_state(url: str = None) -> SharedState:
+    """
+    The shared state for this process.
+
+    :param url: [Optional] A redis:// URL to share state through. Omit when running in a single process.
+    """
+    if url:
+        return RemoteState(url)
+
+    return LocalState()
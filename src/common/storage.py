@@ -0,0 +1,221 @@
+import asyncio
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prefixes (
+    guild_id INTEGER PRIMARY KEY,
+    prefix TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS blacklist (
+    user_id INTEGER PRIMARY KEY,
+    reason TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS usage (
+    command TEXT NOT NULL,
+    day TEXT NOT NULL,
+    guild_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (command, day, guild_id)
+);
+
+CREATE TABLE IF NOT EXISTS image_hashes (
+    key TEXT PRIMARY KEY,
+    hash INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS latency (
+    command TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (command, bucket)
+);
+"""
+
+
+class Store(ABC):
+    """
+    Persistent storage for the bot's settings.
+
+    Everything is async, so implementations can talk to a database without blocking the event loop.
+    The bot keeps its own in-memory copies for hot paths and writes through to the store on change.
+    """
+
+    @abstractmethod
+    async def load_prefixes(self, shard_ids: Iterable[int] = None, shard_count: int = None) -> Dict[int, str]:
+        """
+        Load custom prefixes.
+
+        :param shard_ids: [Optional] Only load guilds on these shards. Omit to load every guild.
+        :param shard_count: [Optional] The total number of shards. Required with shard_ids.
+        :return: A guild ID -> prefix dict.
+        """
+
+    @abstractmethod
+    async def set_prefix(self, guild_id: int, prefix: Optional[str]) -> None:
+        """ Set (or, with None, remove) a guild's custom prefix. """
+
+    @abstractmethod
+    async def load_blacklist(self) -> Set[int]:
+        """ Load the IDs of every blacklisted user. """
+
+    @abstractmethod
+    async def set_blacklisted(self, user_id: int, reason: Optional[str]) -> None:
+        """ Blacklist a user with a reason, or (with None) remove them from the blacklist. """
+
+    @abstractmethod
+    async def add_usage(self, counts: Dict[Tuple[str, str, int], int], latency: Dict[str, List[int]]) -> None:
+        """
+        Add a batch of command usage to the stored totals, in one transaction.
+
+        :param counts: (command, day, guild ID) -> uses.
+        :param latency: command -> latency histogram (counts per bucket).
+        """
+
+    @abstractmethod
+    async def load_usage_totals(self) -> Dict[str, int]:
+        """ Load how many times each command has been used, in total. """
+
+    @abstractmethod
+    async def load_image_hashes(self) -> Dict[str, int]:
+        """ Load every stored perceptual hash, keyed by emoji ID (as text) or pack file name. """
+
+    @abstractmethod
+    async def add_image_hashes(self, hashes: Dict[str, int]) -> None:
+        """ Store a batch of 64-bit perceptual hashes, keyed by emoji ID (as text) or pack file name. """
+
+    @abstractmethod
+    async def load_daily_usage(self) -> List[Tuple[str, int]]:
+        """ Load how many commands were used each day, oldest first, as (YYYY-MM-DD, uses) pairs. """
+
+    async def close(self) -> None:
+        """ Release any resources held by the store. """
+
+
+class SQLiteStore(Store):
+    """
+    A Store backed by a local SQLite file.
+
+    The connection is owned by a single worker thread, so queries never run on (or block) the event loop and never
+    overlap each other.
+    """
+
+    def __init__(self, path: str = "./data/emojis.db"):
+        self.path = path
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+        return self._connection
+
+    async def _run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """ Run func(connection) on the database thread. """
+        return await asyncio.get_event_loop().run_in_executor(self._executor, lambda: func(self._connect()))
+
+    async def load_prefixes(self, shard_ids: Iterable[int] = None, shard_count: int = None) -> Dict[int, str]:
+        query = "SELECT guild_id, prefix FROM prefixes"
+        params = ()
+
+        if shard_ids is not None and shard_count:
+            # Discord's sharding formula: (guild_id >> 22) % shard_count
+            shard_ids = tuple(shard_ids)
+            query += " WHERE (guild_id >> 22) %% ? IN (%s)" % ", ".join("?" * len(shard_ids))
+            params = (shard_count, *shard_ids)
+
+        rows = await self._run(lambda db: db.execute(query, params).fetchall())
+
+        return dict(rows)
+
+    async def set_prefix(self, guild_id: int, prefix: Optional[str]) -> None:
+        def write(db: sqlite3.Connection) -> None:
+            with db:
+                if prefix is None:
+                    db.execute("DELETE FROM prefixes WHERE guild_id = ?", (guild_id,))
+                else:
+                    db.execute("INSERT OR REPLACE INTO prefixes (guild_id, prefix) VALUES (?, ?)", (guild_id, prefix))
+
+        await self._run(write)
+
+    async def load_blacklist(self) -> Set[int]:
+        rows = await self._run(lambda db: db.execute("SELECT user_id FROM blacklist").fetchall())
+
+        return {user_id for user_id, in rows}
+
+    async def set_blacklisted(self, user_id: int, reason: Optional[str]) -> None:
+        def write(db: sqlite3.Connection) -> None:
+            with db:
+                if reason is None:
+                    db.execute("DELETE FROM blacklist WHERE user_id = ?", (user_id,))
+                else:
+                    db.execute("INSERT OR REPLACE INTO blacklist (user_id, reason) VALUES (?, ?)", (user_id, reason))
+
+        await self._run(write)
+
+    async def add_usage(self, counts: Dict[Tuple[str, str, int], int], latency: Dict[str, List[int]]) -> None:
+        usage_rows = [(command, day, guild_id, count) for (command, day, guild_id), count in counts.items()]
+        latency_rows = [
+            (command, bucket, count)
+            for command, histogram in latency.items()
+            for bucket, count in enumerate(histogram) if count
+        ]
+
+        def write(db: sqlite3.Connection) -> None:
+            with db:
+                db.executemany(
+                    "INSERT INTO usage (command, day, guild_id, count) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (command, day, guild_id) DO UPDATE SET count = count + excluded.count",
+                    usage_rows,
+                )
+                db.executemany(
+                    "INSERT INTO latency (command, bucket, count) VALUES (?, ?, ?) "
+                    "ON CONFLICT (command, bucket) DO UPDATE SET count = count + excluded.count",
+                    latency_rows,
+                )
+
+        if usage_rows or latency_rows:
+            await self._run(write)
+
+    async def load_usage_totals(self) -> Dict[str, int]:
+        rows = await self._run(
+            lambda db: db.execute("SELECT command, SUM(count) FROM usage GROUP BY command").fetchall())
+
+        return dict(rows)
+
+    async def load_daily_usage(self) -> List[Tuple[str, int]]:
+        return await self._run(
+            lambda db: db.execute("SELECT day, SUM(count) FROM usage GROUP BY day ORDER BY day").fetchall())
+
+    async def load_image_hashes(self) -> Dict[str, int]:
+        rows = await self._run(lambda db: db.execute("SELECT key, hash FROM image_hashes").fetchall())
+
+        # SQLite integers are signed
+        return {key: value & 0xFFFFFFFFFFFFFFFF for key, value in rows}
+
+    async def add_image_hashes(self, hashes: Dict[str, int]) -> None:
+        rows = [(key, value - (1 << 64) if value >= 1 << 63 else value) for key, value in hashes.items()]
+
+        def write(db: sqlite3.Connection) -> None:
+            with db:
+                db.executemany("INSERT OR REPLACE INTO image_hashes (key, hash) VALUES (?, ?)", rows)
+
+        await self._run(write)
+
+    async def close(self) -> None:
+        def close(db: sqlite3.Connection) -> None:
+            db.close()
+            self._connection = None
+
+        if self._connection is not None:
+            await self._run(close)
+
+        self._executor.shutdown(wait=False)
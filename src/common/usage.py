@@ -0,0 +1,114 @@
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from time import time
+from typing import *
+
+# Upper bounds (in ms) of the latency histogram buckets. The last bucket catches everything slower.
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float("inf"))
+
+
+def percentile(histogram: Sequence[int], fraction: float) -> float:
+    """
+    Estimate a percentile from a latency histogram.
+
+    :param histogram: Counts per bucket, as recorded by UsageRecorder.
+    :param fraction: The percentile, between 0 and 1 (e.g. 0.95).
+    :return: The upper bound (in ms) of the bucket the percentile falls in.
+    """
+    total = sum(histogram)
+    target = fraction * total
+    seen = 0
+
+    for bound, count in zip(LATENCY_BUCKETS, histogram):
+        seen += count
+
+        if count and seen >= target:
+            return bound
+
+    return 0.0
+
+
+class UsageRecorder:
+    """
+    Count command usage per command, per day and per guild, with a latency histogram per command.
+
+    Recording only bumps counters in dicts, so it's cheap enough to run after every command. The pending counts are
+    handed to the store in batches by drain().
+    """
+
+    def __init__(self):
+        # (command, day, guild ID) -> uses since the last drain
+        self.counts: Dict[Tuple[str, str, int], int] = {}
+        # command -> histogram since the last drain
+        self.latency: Dict[str, List[int]] = {}
+        # command -> histogram since the bot started, for live percentiles, and the total of its latencies (in ms)
+        self.all_latency: Dict[str, List[int]] = {}
+        self.all_latency_sum: Dict[str, float] = {}
+
+        self._day = ""
+        self._day_ends = 0.0
+
+    def _today(self) -> str:
+        """ Today's (UTC) date, only recomputed when the day rolls over. """
+        now = time()
+
+        if now >= self._day_ends:
+            today = datetime.utcfromtimestamp(now)
+            tomorrow = datetime(today.year, today.month, today.day) + timedelta(days=1)
+
+            self._day = today.strftime("%Y-%m-%d")
+            self._day_ends = (tomorrow - datetime(1970, 1, 1)).total_seconds()
+
+        return self._day
+
+    def record(self, command: str, guild_id: Optional[int], seconds: float) -> None:
+        """
+        Record a completed command.
+
+        :param command: The command name.
+        :param guild_id: The guild it was used in (None in DMs).
+        :param seconds: How long it took, from invoke to completion.
+        """
+        key = (command, self._today(), guild_id or 0)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+        ms = seconds * 1000
+        bucket = bisect_left(LATENCY_BUCKETS, ms)
+
+        histogram = self.latency.get(command)
+        if histogram is None:
+            histogram = self.latency[command] = [0] * len(LATENCY_BUCKETS)
+        histogram[bucket] += 1
+
+        histogram = self.all_latency.get(command)
+        if histogram is None:
+            histogram = self.all_latency[command] = [0] * len(LATENCY_BUCKETS)
+        histogram[bucket] += 1
+        self.all_latency_sum[command] = self.all_latency_sum.get(command, 0.0) + ms
+
+    def drain(self) -> Tuple[Dict[Tuple[str, str, int], int], Dict[str, List[int]]]:
+        """ Take the pending counts and histograms, leaving empty ones in their place. """
+        counts, latency = self.counts, self.latency
+        self.counts, self.latency = {}, {}
+
+        return counts, latency
+
+    def restore(self, counts: Dict[Tuple[str, str, int], int], latency: Dict[str, List[int]]) -> None:
+        """ Put drained counts back (e.g. after a failed flush), merging with anything recorded since. """
+        for key, count in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+
+        for command, histogram in latency.items():
+            pending = self.latency.setdefault(command, [0] * len(LATENCY_BUCKETS))
+
+            for i, count in enumerate(histogram):
+                pending[i] += count
+
+    def percentiles(self, command: str) -> Tuple[float, float, float]:
+        """ The p50, p95 and p99 latency (in ms) of a command since the bot started. """
+        histogram = self.all_latency.get(command)
+
+        if not histogram:
+            return 0.0, 0.0, 0.0
+
+        return percentile(histogram, 0.5), percentile(histogram, 0.95), percentile(histogram, 0.99)
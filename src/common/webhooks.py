@@ -0,0 +1,109 @@
+from asyncio import Future, ensure_future, shield
+from time import monotonic
+from typing import *
+
+from discord import NotFound, TextChannel, Webhook
+from discord.utils import get as discord_get
+
+WEBHOOK_NAME = "Emojis"
+
+# How long after the bot creates a webhook its own webhooks update event is expected
+CREATE_GRACE = 10.0
+
+
+class WebhookCache:
+    """
+    A channel ID -> Webhook cache for the Emojis webhook.
+
+    Webhooks are looked up (or created) the first time a channel needs one, then reused until Discord says the
+    channel's webhooks changed, a send fails because the webhook is gone, or the channel is deleted. The update that
+    the bot's own create_webhook causes is ignored, so a new webhook isn't forgotten as soon as it's cached.
+    """
+
+    def __init__(self):
+        self._webhooks: Dict[int, Webhook] = {}
+        self._pending: Dict[int, Future] = {}
+
+        # Channel ID -> when the bot created a webhook there, until the update event it causes arrives
+        self._created: Dict[int, float] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._webhooks)
+
+    async def get(self, channel: TextChannel) -> Webhook:
+        """ Get the channel's Emojis webhook, creating it if it doesn't exist. """
+        webhook = self._webhooks.get(channel.id)
+
+        if webhook is not None:
+            self.hits += 1
+            return webhook
+
+        self.misses += 1
+
+        # Share one lookup between every message that arrives while it's in flight
+        pending = self._pending.get(channel.id)
+
+        if pending is None:
+            pending = self._pending[channel.id] = ensure_future(self._fetch(channel))
+
+            def done(future: Future) -> None:
+                if self._pending.get(channel.id) is future:
+                    del self._pending[channel.id]
+
+            pending.add_done_callback(done)
+
+        return await shield(pending)
+
+    async def _fetch(self, channel: TextChannel) -> Webhook:
+        webhooks = await channel.webhooks()
+        webhook = discord_get(webhooks, name=WEBHOOK_NAME)
+
+        if webhook is None:
+            webhook = await channel.create_webhook(name=WEBHOOK_NAME)
+            self._created[channel.id] = monotonic()
+
+        self._webhooks[channel.id] = webhook
+
+        return webhook
+
+    async def send(self, channel: TextChannel, content: str, **kwargs) -> None:
+        """
+        Send a message on the channel's Emojis webhook.
+        If the cached webhook was deleted, it is looked up again (or recreated) and the send is retried once.
+
+        :param channel: The channel to send in.
+        :param content: The message content.
+        :param kwargs: Passed to Webhook.send (username, avatar_url, ...).
+        """
+        webhook = await self.get(channel)
+
+        try:
+            await webhook.send(content, **kwargs)
+        except NotFound:
+            self.invalidate(channel.id)
+
+            webhook = await self.get(channel)
+            await webhook.send(content, **kwargs)
+
+    def updated(self, channel_id: int) -> None:
+        """ Discord says a channel's webhooks changed: forget its webhook, unless the change was the bot creating it. """
+        created = self._created.pop(channel_id, None)
+
+        if created is not None and monotonic() - created < CREATE_GRACE:
+            return
+
+        self.invalidate(channel_id)
+
+    def invalidate(self, channel_id: int) -> None:
+        """ Forget a channel's webhook. """
+        self._webhooks.pop(channel_id, None)
+        self._pending.pop(channel_id, None)
+        self._created.pop(channel_id, None)
+
+    def invalidate_guild(self, guild) -> None:
+        """ Forget the webhooks of every channel in a guild. """
+        for channel in guild.channels:
+            self.invalidate(channel.id)
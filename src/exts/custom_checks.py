@@ -1,4 +1,8 @@
 from src.common.common import *
+from src.common.cooldowns import command_cooldown
+
+# Commands with no cooldown at all
+COOLDOWN_WHITELIST = ("help",)
 
 
 class CustomChecks(Cog):
@@ -12,20 +16,20 @@ class CustomChecks(Cog):
         Checks that affect the entire bot.
 
         Checks implemented:
-            - cooldown: A global cooldown for every command.
+            - cooldown: A global cooldown for every command (only checked here; see command_cooldown).
 
         """
 
         async def cooldown_check() -> bool:
-            """ Implement a global cooldown for every command, defined in bot.cooldown. """
-            whitelist = ("help",)
-
-            if ctx.command.name in whitelist:
+            """
+            Turn away users already on the global cooldown, defined in bot.global_cooldown, without using a go: that's
+            charged in command_cooldown, once every check has passed.
+            """
+            if ctx.command.name in COOLDOWN_WHITELIST:
                 return True
 
             # Get current cooldown
-            bucket = self.bot.cooldown.get_bucket(ctx.message)
-            retry_after = bucket.update_rate_limit()
+            retry_after = self.bot.state.check(ctx.author.id, [("global", self.bot.global_cooldown)])
 
             if retry_after:  # On cooldown
                 await ctx.error(
@@ -47,6 +51,36 @@ class CustomChecks(Cog):
 
         return True
 
+    async def command_cooldown(self, ctx):
+        """
+        Charge the global cooldown along with the command's own (set with src.common.cooldowns.cooldown), in one
+        lookup by bot.state, which shares them between processes when the bot runs as a cluster.
+
+        Runs as the bot's before_invoke hook, after every check has passed, so a user who isn't allowed to run a
+        command doesn't use up a go of it. If either is on cooldown, neither is used up.
+        """
+        if ctx.command.name in COOLDOWN_WHITELIST:
+            return
+
+        scopes = [("global", self.bot.global_cooldown)]
+
+        command_limit = command_cooldown(ctx.command)
+        if command_limit:
+            scopes.append((ctx.command.qualified_name, command_limit))
+
+        retry_after = await self.bot.state.cooldown(ctx.author.id, scopes)
+
+        if retry_after:
+            await ctx.error("You're on cooldown. Try again in %d seconds." % int(retry_after))
+            raise CheckFailure("On cooldown")
+
+    def cog_unload(self):
+        # Unless another hook has replaced it since
+        if self.bot._before_invoke == self.command_cooldown:
+            self.bot._before_invoke = None
+
 
 def setup(bot):
-    bot.add_cog(CustomChecks(bot))
+    cog = CustomChecks(bot)
+    bot.add_cog(cog)
+    bot.before_invoke(cog.command_cooldown)
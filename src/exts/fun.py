@@ -51,12 +51,7 @@ class Fun(Cog):
                 emojis.append(":black_large_square:")
 
         # Disguise as the user and send on Webhook
-        webhook = await get_emojis_webhook(ctx)
-        await webhook.send(
-            " ".join(emojis),
-            username=ctx.author.display_name,
-            avatar_url=ctx.author.avatar_url,
-        )
+        await send_as_author(ctx, " ".join(emojis))
 
         await ctx.message.delete()
 
@@ -76,13 +71,15 @@ class Fun(Cog):
         """
         if search:
             # Make a list of emojis that match the search
-            search = search.lower()
-            emojis = [e for e in self.bot.emojis if search in e.name.lower()]
+            emojis = self.bot.emoji_index.search(search, limit=None)
+            emoji = choice(emojis) if emojis else None
         else:
-            emojis = self.bot.emojis
+            emoji = self.bot.emoji_index.random()
 
-        # Pick and upload a random emoji
-        emoji = choice(emojis)
+        if not emoji:
+            raise Exception("No results. ")
+
+        # Upload the random emoji
         await ctx.upload_emoji(emoji.name, emoji.url)
 
     @command(
@@ -58,35 +58,78 @@ class Management(Cog):
         await emoji.delete(reason="Delete command called by %s" % ctx.author)
         await ctx.success("Emoji deleted.")
 
-    # @command(
-    #     name="prefix",
-    #     description="Update the bot's prefix.",
-    #     usage=">prefix [prefix]",
-    # )
-    # @guild_only()
-    # @has_permissions(manage_guild=True)
-    # async def prefix(self, ctx, *, prefix) -> None:
-    #     await db.prefixes.update_one(
-    #         {"id": ctx.guild.id}, {"$set": {"prefix": prefix}}, upsert=True
-    #     )
-    #     self.bot.prefixes[ctx.guild.id] = prefix
-
-    #     await ctx.success("My new prefix is `%s`." % prefix)
-
-    # @command(
-    #     name="blacklist",
-    #     description="Blacklist a user.",
-    #     usage=">blacklist [user] [reason]",
-    #     hidden=True,
-    # )
-    # @is_owner()
-    # async def blacklist(self, ctx, user: User, *, reason="Unspecified") -> None:
-    #     await db.blacklist.update_one(
-    #         {"id": user.id}, {"$set": {"reason:": reason}}, upsert=True
-    #     )
-    #     self.bot.blacklist.add(user.id)
-
-    #     await ctx.success("%s blacklisted." % user)
+    @command(
+        name="prefix",
+        description="Update the bot's prefix.",
+        usage=">prefix [prefix]",
+    )
+    @guild_only()
+    @has_permissions(manage_guild=True)
+    async def prefix(self, ctx, *, prefix) -> None:
+        """
+        Update the bot's prefix for this server.
+
+        :param ctx:
+        :param prefix: The new prefix.
+        """
+        if len(prefix) > 10:
+            raise Exception("Prefixes can be at most 10 characters long.")
+
+        # Write through: the store first, then the in-memory copy get_prefix reads
+        await self.bot.store.set_prefix(
+            ctx.guild.id, None if prefix == DEFAULT_PREFIX else prefix
+        )
+
+        if prefix == DEFAULT_PREFIX:
+            self.bot.prefixes.pop(ctx.guild.id, None)
+        else:
+            self.bot.prefixes[ctx.guild.id] = prefix
+
+        await self.bot.state.bump("prefixes")
+
+        await ctx.success("My new prefix is `%s`." % prefix)
+
+    @command(
+        name="blacklist",
+        description="Blacklist a user.",
+        usage=">blacklist [user] [reason]",
+        hidden=True,
+    )
+    @is_owner()
+    async def blacklist(self, ctx, user: User, *, reason="Unspecified") -> None:
+        """
+        Stop a user from using the bot. Takes effect immediately (within a few seconds on other cluster workers).
+
+        :param ctx:
+        :param user: The user to blacklist.
+        :param reason: [Optional] Why they were blacklisted.
+        """
+        await self.bot.store.set_blacklisted(user.id, reason)
+        self.bot.blacklist.add(user.id)
+        await self.bot.state.bump("blacklist")
+
+        await ctx.success("%s blacklisted." % user)
+
+    @command(
+        name="unblacklist",
+        description="Remove a user from the blacklist.",
+        usage=">unblacklist [user]",
+        hidden=True,
+    )
+    @is_owner()
+    async def unblacklist(self, ctx, user: User) -> None:
+        """
+        Let a blacklisted user use the bot again. Takes effect immediately (within a few seconds on other cluster
+        workers).
+
+        :param ctx:
+        :param user: The user to remove from the blacklist.
+        """
+        await self.bot.store.set_blacklisted(user.id, None)
+        self.bot.blacklist.discard(user.id)
+        await self.bot.state.bump("blacklist")
+
+        await ctx.success("%s removed from the blacklist." % user)
 
 
 def setup(bot):
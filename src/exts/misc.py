@@ -1,7 +1,15 @@
+import asyncio
+import logging
+from datetime import datetime
+from io import BytesIO
+
 from discord import File
 from discord.ext.commands import Command, CommandNotFound, is_owner
 
 from src.common.common import *
+from src.common.graphs import UsageGraph
+
+log = logging.getLogger(__name__)
 
 INVITE_URL = "https://github.com/DJStompZone/emojis"
 VOTE_URL = "https://github.com/DJStompZone/emojis"
@@ -21,6 +29,26 @@ class Misc(Cog):
         self.base_help_embed = Embed()
         self.bot.loop.create_task(self.create_help_embed())
 
+        # Drawn in the image workers, and only when the data has changed
+        self.usage_graph = UsageGraph(self.bot.images.run)
+        self.graph_updater = self.bot.loop.create_task(self._bg_update_graph())
+
+    def cog_unload(self):
+        self.graph_updater.cancel()
+
+    async def _bg_update_graph(self, delay: int = 900) -> None:
+        """ Keep the usage graph drawn, so ~usage can answer straight away. """
+
+        await self.bot.wait_until_ready()
+
+        while True:
+            try:
+                await self.usage_graph.render(await self.bot.store.load_daily_usage())
+            except Exception:
+                log.exception("Couldn't draw the usage graph.")
+
+            await asyncio.sleep(delay)
+
     async def create_help_embed(self) -> None:
         """ Create the top-level help Embed (list of commands). """
 
@@ -35,7 +63,7 @@ class Misc(Cog):
         # Loop through each command and add it to the dictionary
         for cmd in self.bot.walk_commands():
             if not cmd.hidden:
-                cmd_usage = ">" + cmd.name
+                cmd_usage = ">" + cmd.qualified_name
 
                 if cmd.cog is not None:
                     command_list[type(cmd.cog).__name__].append(cmd_usage)
@@ -162,39 +190,70 @@ class Misc(Cog):
     #         )
     #     )
 
-    # @command(
-    #     name="usage",
-    #     description="View command usage.",
-    #     usage=">usage",
-    #     hidden=True,
-    # )
-    # @is_owner()
-    # async def usage(self, ctx) -> None:
-    #     """ View usage stats for the bot. """
-    #     query = db.usage.find({}, {"_id": False})
-
-    #     async for i in query:
-    #         results = dict(i)
-    #         sort = sorted(results, key=lambda x: results[x], reverse=True)
-    #         usage = ["`>%s`: %d" % (x, results[x]) for x in sort]
-
-    #         pic = None
-
-    #         try:
-    #             with open("./data/stats/usage.png", "rb") as f:
-    #                 pic = File(f)
-    #         except OSError:
-    #             pass
-
-    #         await ctx.send(
-    #             embed=Embed(
-    #                 description="%s\n\nTotal: %d"
-    #                 % ("\n".join(usage), sum(results.values()))
-    #             ),
-    #             file=pic,
-    #         )
+    @command(
+        name="usage",
+        description="View command usage.",
+        usage=">usage",
+        hidden=True,
+    )
+    @is_owner()
+    async def usage(self, ctx) -> None:
+        """ View usage stats for the bot, with a graph of usage by day. """
+        # Count everything up to now
+        await self.bot.flush_usage()
+
+        totals = await self.bot.store.load_usage_totals()
+        png = await self.usage_graph.render(await self.bot.store.load_daily_usage())
+
+        top = sorted(totals, key=lambda x: totals[x], reverse=True)[:25]
+        usage = ["`>%s`: %d" % (x, totals[x]) for x in top]
+
+        embed = Embed(description="%s\n\nTotal: %d" % ("\n".join(usage), sum(totals.values())))
+        embed.set_image(url="attachment://usage.png")
+
+        await ctx.send(embed=embed, file=File(BytesIO(png), filename="usage.png"))
+
+    @command(
+        name="loopstats",
+        description="View event loop lag and recent slow callbacks.",
+        usage=">loopstats",
+        hidden=True,
+    )
+    @is_owner()
+    async def loopstats(self, ctx) -> None:
+        """ View event loop lag and the most recent callbacks that blocked it. """
+        monitor = self.bot.loop_monitor
+
+        embed = Embed(
+            title="Event loop",
+            description="Lag: %.1fms (peak %.1fms over the last %d samples)\nSlow callback threshold: %dms"
+            % (
+                monitor.lag * 1000,
+                monitor.peak * 1000,
+                len(monitor.samples),
+                monitor.threshold * 1000,
+            ),
+        )
+
+        # Newest first
+        for slow in list(monitor.slow_callbacks)[:-6:-1]:
+            # Only the innermost frames fit in a field
+            stack = slow.stack[-900:]
+
+            embed.add_field(
+                name="%s -- %.0fms, %s" % (
+                    slow.trigger,
+                    slow.duration * 1000,
+                    datetime.utcfromtimestamp(slow.started).strftime("%H:%M:%S UTC"),
+                ),
+                value="```\n%s\n```" % stack if stack else "No stack captured.",
+                inline=False,
+            )
+
+        if not monitor.slow_callbacks:
+            embed.add_field(name="Slow callbacks", value="None recorded.")
 
-    #         return
+        await ctx.send(embed=embed)
 
     @command(
         name="reload",
@@ -1,13 +1,17 @@
+import asyncio
 import logging
-from asyncio import TimeoutError as TimeoutError_
-from random import randint
 from re import sub
-import json
 
-from discord import Member, User, Message, NotFound
-from discord.ext.commands import cooldown, BucketType, is_owner
+from discord import Member, User, NotFound
+from discord.ext.commands import cooldown as commands_cooldown, group, BucketType, is_owner
 
+from src.common.browser import SearchBrowser, SessionLimits
 from src.common.common import *
+from src.common.cooldowns import cooldown
+from src.common.fetch import MAX_FETCH_BYTES
+from src.common.installer import PackInstaller, emoji_name_from_file
+from src.common.pack_search import PackSearch
+from src.common.packs import PackCatalogue
 
 
 class Utility(Cog):
@@ -15,26 +19,21 @@ class Utility(Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        #self.packs = get("https://discordemoji.com/api/packs").json()
-        dataf = open('packs.json',)
-        self.packs = json.load(dataf)
-        self.packs_embed = self.list_packs()
-
-    def list_packs(self) -> Embed:
-        """ A list of emoji packs from emoji.gg that can be downloaded. """
-
-        list_embed = Embed(
-            title=f"{len(self.packs)} emoji packs available",
-            description="Type `~pack [number]` to view (example: `~pack 1`)\n",
-        )
-
-        for count, value in enumerate(self.packs, start=1):
-            list_embed.description += '\n`~pack %d` -- view **"%s"**' % (
-                count,
-                value["name"],
-            )
+        self.packs = PackCatalogue()
+        self.pack_search = PackSearch(self.packs)
+        self.pack_search_version = self.packs.version
+        self.sessions = SessionLimits()
+        self.browsers = set()
+
+        # Pack emojis are hashed in the background, for ~similar
+        self.bot.image_hashes.set_packs(self.packs)
+
+    def cog_unload(self):
+        self.packs.close()
 
-        return list_embed
+        # End open search browsers, so they don't outlive the cog
+        for task in self.browsers:
+            task.cancel()
 
     @command(
         name="upload",
@@ -44,7 +43,7 @@ class Utility(Cog):
     )
     @guild_only()
     @has_permissions(manage_emojis=True)
-    @cooldown(1, 15, BucketType.user)
+    @cooldown(1, 15)
     async def upload(self,
                      ctx,
                      name,
@@ -81,8 +80,14 @@ class Utility(Cog):
 
             # An attachment was uploaded, use that for the emoji URL
             if ctx.message.attachments:
-                url = ctx.message.attachments[0].url
-                await ctx.upload_emoji(name, url)
+                attachment = ctx.message.attachments[0]
+
+                if attachment.size > MAX_FETCH_BYTES:
+                    raise Exception("That image is too big (max %dkb)." %
+                                    (MAX_FETCH_BYTES // 1024))
+
+                # Read the attachment directly rather than fetching its URL again
+                await ctx.upload_emoji(name, image=await attachment.read())
 
             # No attachments
             else:
@@ -124,103 +129,44 @@ class Utility(Cog):
 
     @command(
         name="search",
-        description="Search for an emoji.",
-        usage="~search [query]",
+        description="Search for an emoji. Add `grid` to see 9 at a time.",
+        usage="~search [query] [grid]",
         aliases=("browse", "find"),
     )
     @guild_only()
     @has_permissions(manage_emojis=True)
-    @cooldown(1, 30, BucketType.user)
-    async def search(self, ctx, query):
+    @cooldown(1, 30)
+    async def search(self, ctx, query, mode: str = None):
         """
         Search the bot cache for emojis.
 
         :param ctx:
         :param query: The search term that emoji names must contain.
+        :param mode: [Optional] "grid" to show several results per page.
         """
-        def reaction_check(reaction) -> bool:
-            """ Check if the reaction added is valid. """
-            return reaction.member.id == ctx.author.id
-
-        async def browse(emojis: list,
-                         page: int,
-                         existing_msg: Message = None) -> None:
-            """
-            Create and manage an emoji browser.
-
-            :param emojis: The list of emojis to choose from.
-            :param page: The current page number of the browser.
-            :param existing_msg: [Optional] The Message of the current browser. If present, edits the existing message
-            instead of posting a new one.
-            """
-
-            # Pick the Emoji and create the search Embed
-            emoji = emojis[page]
-            embed = (Embed(
-                title="Page %s / %s" % (page + 1, len(emojis)),
-                description="`:%s:`" % emoji.name,
-            ).set_thumbnail(url=emoji.url).set_author(
-                icon_url=ctx.author.avatar_url, name=ctx.author.name))
-
-            # If no message exists, send the Embed to the chat
-            if not existing_msg:
-                sent_msg = await ctx.send(embed=embed)
-
-                for reaction in ("⬅", "👍", "➡", "🔀"):
-                    await sent_msg.add_reaction(reaction)
-
-            # If a message does exist, edit it with the new Embed
-            else:
-                sent_msg = existing_msg
-                await sent_msg.edit(embed=embed)
-
-            try:
-                # Wait for a reaction to be added
-                # Times out after 30 seconds and must be a valid emoji (⬅/👍/➡/🔀)
-                reaction = await self.bot.wait_for("raw_reaction_add",
-                                                   timeout=30.0,
-                                                   check=reaction_check)
-            except TimeoutError_:  # asyncio.TimeoutError
-                await sent_msg.edit(embed=Embed(
-                    colour=Colours.error,
-                    description="%s This search timed out." %
-                    CustomEmojis.error,
-                ))
-            else:
-                reaction = reaction.emoji.name
-
-                # Reaction controls:
-                #   - ⬅ Previous page
-                #   - 👍 Upload current emoji
-                #   - ➡ Next page
-                #   - 🔀 Random page
-                if reaction == "⬅":
-                    if page != 0:
-                        page -= 1
-                elif reaction == "👍":
-                    await ctx.upload_emoji(emoji.name, emoji.url)
-                elif reaction == "➡":
-                    if page != len(emojis) - 1:
-                        page += 1
-                elif reaction == "🔀":
-                    page = randint(0, len(emojis) - 1)
-
-                # Update Embed to reflect new page
-                await sent_msg.remove_reaction(reaction, ctx.author)
-                await browse(emojis, page, existing_msg=sent_msg)
-
-        # Search for results in the emoji cache
-        query = query.lower()
-        search_results = [
-            e for e in self.bot.emojis if query in e.name.lower()
-        ]
+        # Search for results in the emoji index
+        search_results = self.bot.emoji_index.search(query)
 
         if len(search_results) == 0:
             raise Exception("No results. ")
 
+        if not self.sessions.acquire(ctx.author.id, ctx.guild.id):
+            raise Exception(
+                "There are too many searches open. Wait for one to time out first."
+            )
+
+        browser = SearchBrowser(ctx,
+                                search_results,
+                                per_page=9 if mode == "grid" else 1)
+        task = asyncio.current_task()
+        self.browsers.add(task)
+
         # Start browsing
-        # Function is recursive
-        await browse(emojis=search_results, page=0)
+        try:
+            await browser.run()
+        finally:
+            self.browsers.discard(task)
+            self.sessions.release(ctx.author.id, ctx.guild.id)
 
     @command(
         name="link",
@@ -244,7 +190,7 @@ class Utility(Cog):
         aliases=("?", "details"),
     )
     @guild_only()
-    @cooldown(1, 5, BucketType.user)
+    @cooldown(1, 5)
     async def info(self, ctx, emoji: PartialEmoji):
         """
         Get information on an emoji from the current server.
@@ -270,10 +216,115 @@ class Utility(Cog):
                        )
 
     @command(
+        name="similar",
+        description="Find emojis that look like another one.",
+        usage="~similar [emoji]",
+        aliases=("lookalike", ),
+    )
+    @cooldown(1, 10)
+    async def similar(self, ctx, emoji: PartialEmoji):
+        """
+        Find emojis that look like another one, in the servers the bot is in and in the emoji packs.
+
+        :param ctx:
+        :param emoji: The emoji to compare. Any custom emoji.
+        """
+        hashes = self.bot.image_hashes
+        image_hash = hashes.hashes.get(emoji.id)
+
+        if image_hash is None:
+            image = await self.bot.fetcher.fetch(str(emoji.url))
+            image_hash = await hashes.hash_image(image)
+
+            if image_hash is None:
+                raise Exception("Couldn't read that emoji's image.")
+
+        matches = hashes.similar(image_hash, exclude=emoji.id)
+
+        if not matches:
+            raise Exception("No look-alikes found.")
+
+        lines = []
+
+        for distance, key in matches:
+            alike = "%d%% alike" % (100 * (1 - distance / 64))
+
+            if isinstance(key, int):
+                guild_id, name, animated = hashes.emojis[key]
+                lines.append("<%s:%s:%d> `:%s:` -- %s" % ("a" if animated else "", name, key, name, alike))
+            else:
+                number = hashes.pack_files[key] + 1
+                lines.append("[%s](%s) from `~pack %d` -- %s" % (key, hashes.url(key), number, alike))
+
+        await ctx.send(embed=Embed(title="Emojis like :%s:" % emoji.name, description="\n".join(lines)))
+
+    @command(
+        name="packs",
+        description="List the emoji packs that can be installed.",
+        usage="~packs [page]",
+    )
+    async def list_packs(self, ctx, page: int = 1):
+        """
+        List the emoji packs from emoji.gg that can be installed.
+
+        :param ctx:
+        :param page: [Optional] The page of the list to view.
+        """
+        # Pages are rendered once, until packs.json changes
+        self.packs.refresh()
+        pages = self.packs.pages()
+
+        if not 1 <= page <= len(pages):
+            raise Exception("There are only %d pages." % len(pages))
+
+        await ctx.send(embed=pages[page - 1])
+
+    @command(
+        name="packsearch",
+        description="Search the emoji packs, and the emojis in them.",
+        usage="~packsearch [query]",
+        aliases=("searchpacks", ),
+    )
+    @cooldown(1, 5)
+    async def search_packs(self, ctx, *, query: str):
+        """
+        Search pack names, descriptions and emoji names. Typos are allowed.
+
+        :param ctx:
+        :param query: What to look for, e.g. "vibing frog".
+        """
+        self.packs.refresh()
+
+        if self.pack_search_version != self.packs.version:
+            self.pack_search.build(self.packs)
+            self.pack_search_version = self.packs.version
+
+        results = self.pack_search.search(query)
+
+        if not results:
+            raise Exception("No packs or emojis found. Try `~packs` to see them all.")
+
+        lines = []
+
+        for result in results:
+            pack = self.packs[result.pack]
+            number = result.pack + 1
+
+            if result.emoji is None:
+                lines.append("**%s** (%d emojis) -- `~pack %d`" % (pack["name"], len(pack["emojis"]), number))
+            else:
+                file_name = pack["emojis"][result.emoji]
+                lines.append("[%s](%s) from **%s** -- `~pack install %d %d-%d`" % (
+                    emoji_name_from_file(file_name), PACK_EMOJI_URL % file_name, pack["name"],
+                    number, result.emoji + 1, result.emoji + 1))
+
+        await ctx.send(embed=Embed(title="Packs matching \"%s\"" % query[:200], description="\n".join(lines)))
+
+    @group(
         name="pack",
-        description="View an emoji pack. Use `~pack` first!",
+        description="View an emoji pack. Use `~packs` first!",
         usage="~pack [number]",
-        aliases=("packs", ),
+        invoke_without_command=True,
     )
     async def pack(self, ctx, pack_number: int = None):
         """
@@ -284,7 +335,7 @@ class Utility(Cog):
         """
 
         if not pack_number:
-            await ctx.send(embed=self.packs_embed)
+            await self.list_packs(ctx)
             return
 
         # Pack does not exist
@@ -299,11 +350,55 @@ class Utility(Cog):
         embed = (Embed(
             title=pack["name"], description=pack["description"]).add_field(
                 name="Download",
-                value=pack["download"]).set_image(url=pack["image"]))
+                value=pack["download"]).add_field(
+                    name="Install",
+                    value="`~pack install %d` (%d emojis)" %
+                    (pack_number, len(pack["emojis"]))).set_image(url=pack["image"]))
 
         # send
         await ctx.send(embed=embed)
 
+    @pack.command(
+        name="install",
+        description="Install an emoji pack into this server.",
+        usage="~pack install [number] [optional range, e.g. 1-10]",
+    )
+    @guild_only()
+    @has_permissions(manage_emojis=True)
+    @commands_cooldown(1, 60, BucketType.guild)
+    async def pack_install(self, ctx, pack_number: int, emoji_range: str = None):
+        """
+        Install the emojis from a pack, or a range of them.
+
+        :param ctx:
+        :param pack_number: The pack to install, as listed by ~packs.
+        :param emoji_range: [Optional] Which of the pack's emojis to install, e.g. "1-10" or "5".
+        """
+        try:
+            pack = self.packs[pack_number - 1]
+        except IndexError:
+            raise Exception(
+                "That's not a valid pack. Use `~packs` to see a list of available packs."
+            )
+
+        files = pack["emojis"]
+
+        if emoji_range:
+            try:
+                start, _, end = emoji_range.partition("-")
+                start, end = int(start), int(end or start)
+            except ValueError:
+                raise Exception(
+                    "That doesn't look like a range. Try something like `1-10`."
+                )
+
+            if not 1 <= start <= end <= len(files):
+                raise Exception("This pack only has emojis 1-%d." % len(files))
+
+            files = files[start - 1:end]
+
+        await PackInstaller(ctx, pack["name"], files).run()
+
 
 def setup(bot):
     bot.add_cog(Utility(bot))
@@ -0,0 +1,25 @@
+import os
+import socket
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    """ A port nothing is listening on, right now. """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def root() -> str:
+    """ The repository, which the bot has to be run from. """
+    return ROOT
+
+
+@pytest.fixture
+def ports():
+    """ Two free ports: one for the stand-in and one for the bot's health checks. """
+    return free_port(), free_port()
@@ -0,0 +1,43 @@
+"""
+Smoke test for bot/replay.py: a replayed message with an emoji name in it comes back as the bot's webhook send.
+
+Runs the real bot against the stand-in, so it needs the bot's dependencies installed.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("aiohttp")
+
+
+def test_replayed_message_gets_matched_webhook_reply(tmp_path, root, ports):
+    standin_port, bot_port = ports
+
+    # One message, using an emoji name that resolves in the guild it's replayed in
+    recording = tmp_path / "events.jsonl"
+    recording.write_text(json.dumps({
+        "t": 0.0, "event": "MESSAGE_CREATE", "guild": 1, "channel": 1, "message": 1, "author": 1, "bot": False,
+        "content": "xxxxx :e1:",
+    }) + "\n")
+    output = tmp_path / "results.json"
+
+    result = subprocess.run(
+        [sys.executable, "-m", "bot.replay", str(recording), "--speeds", "1", "--drain", "15",
+         "--guilds", "3", "--emojis", "5", "--port", str(standin_port), "--bot-port", str(bot_port),
+         "--startup-timeout", "90", "--output", str(output)],
+        cwd=root, env=dict(os.environ, bottoken="standin"), timeout=180,
+    )
+
+    assert result.returncode == 0
+
+    [run] = json.loads(output.read_text())
+
+    assert run["expected"] == 1
+    assert run["replied"] == 1
+    assert run["dropped"] == 0
+    assert run["mismatched"] == 0
+    assert run["unexpected"] == 0
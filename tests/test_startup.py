@@ -0,0 +1,54 @@
+"""
+Cold start budget: the bot has to get from launch to on_ready, against the stand-in, within STARTUP_BUDGET seconds.
+
+    STARTUP_BUDGET=5 python -m pytest tests/test_startup.py
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("aiohttp")
+
+BUDGET = float(os.environ.get("STARTUP_BUDGET", 15))
+
+
+def wait_for_port(port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise TimeoutError("Nothing listening on port %d" % port)
+
+
+@pytest.fixture
+def standin(root, ports):
+    port = ports[0]
+    process = subprocess.Popen([sys.executable, "-m", "bot.standin", "--port", str(port)], cwd=root)
+
+    try:
+        wait_for_port(port)
+        yield port
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def test_cold_start_within_budget(root, ports, standin):
+    result = subprocess.run(
+        [sys.executable, "-m", "bot", "--profile-startup", "--startup-budget", str(BUDGET), "--port", str(ports[1])],
+        cwd=root, timeout=BUDGET + 60,
+        env=dict(os.environ, DISCORD_API_BASE="http://127.0.0.1:%d/api/v7" % standin, bottoken="standin"),
+    )
+
+    # The profile is printed either way; the exit code says whether on_ready came within the budget
+    assert result.returncode == 0